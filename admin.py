@@ -3,8 +3,9 @@
 domain.py - منطق اصلی کسب‌وکار بدون وابستگی به تلگرام
 """
 
-import json
+import asyncio
 import re
+import sys
 import logging
 from typing import Dict, List, Optional, Tuple, Any, Union
 from datetime import datetime, timedelta
@@ -15,6 +16,11 @@ import hashlib
 import random
 import string
 
+from core.base_storage import BaseStorage, INDEXED_FIELDS
+from core.json_storage import JsonStore
+from core.link_generator import match_platform
+from core.stats import StatsCounters
+
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +40,7 @@ class DownloadStatus(Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class PaymentStatus(Enum):
@@ -50,9 +57,9 @@ class AdType(Enum):
     REWARDED = "rewarded"
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
-    """مدل کاربر"""
+    """مدل کاربر (بدون __dict__ برای مصرف کمتر حافظه)"""
     id: str
     username: Optional[str]
     first_name: str
@@ -74,6 +81,10 @@ class User:
     def from_dict(cls, data: Dict) -> 'User':
         """ساخت از دیکشنری"""
         data['status'] = UserStatus(data.get('status', UserStatus.FREE.value))
+        # نام‌ها و زبان تکراری زیادی دارند؛ یک نسخه مشترک در حافظه نگه داشته می‌شود
+        for field in ('first_name', 'last_name', 'language'):
+            if data.get(field):
+                data[field] = sys.intern(data[field])
         return cls(**data)
     
     def is_premium(self) -> bool:
@@ -130,6 +141,19 @@ class DownloadRequest:
     file_size: Optional[float] = None
     file_path: Optional[str] = None
     error_message: Optional[str] = None
+    # اطلاعات ادامه کار پس از راه‌اندازی مجدد
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+    output_dir: Optional[str] = None
+    part_path: Optional[str] = None
+    started_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    attempts: int = 0
+    
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (DownloadStatus.COMPLETED, DownloadStatus.FAILED,
+                               DownloadStatus.CANCELLED)
     
     def to_dict(self) -> Dict:
         """تبدیل به دیکشنری"""
@@ -215,11 +239,32 @@ class AdCampaign:
 # =========================
 
 class BaseRepository:
-    """ریپوزیتوری پایه"""
-    
-    def __init__(self, data_dir: Path):
+    """ریپوزیتوری پایه
+    
+    بدون storage تمام رکوردها در حافظه نگهداری و در فایل JSON ذخیره می‌شوند و
+    برای فیلدهای indexed_fields ایندکس ثانویه حافظه به صورت افزایشی نگهداری می‌شود.
+    با storage، دیکشنری حافظه فقط cache رکوردهای استفاده‌شده است و
+    جستجوها روی ایندکس‌های storage انجام می‌شوند. مجموعه‌ها در storage با پیشوند
+    namespace ذخیره می‌شوند تا با مجموعه‌های هم‌نام DataManager (users، downloads و
+    payments با ساختار کلید متفاوت) در یک فایل SQLite تداخل نداشته باشند.
+    """
+    
+    namespace: str = "domain"
+    collection: str = None
+    filename: str = None
+    model = None
+    indexed_fields: Tuple[str, ...] = ()
+    # تأخیر (ثانیه) برای ادغام ذخیره‌های پشت‌سرهم فایل JSON در یک snapshot
+    persist_delay: float = 0.5
+    
+    def __init__(self, data_dir: Path, storage: Optional[BaseStorage] = None):
         self.data_dir = data_dir
         self.data_dir.mkdir(exist_ok=True)
+        self.storage = storage
+        self.storage_collection = f"{self.namespace}.{self.collection}"
+        self.json_store = JsonStore(data_dir)
+        self._dirty_records: Optional[Dict[str, Any]] = None
+        self._persist_handle: Optional[asyncio.TimerHandle] = None
     
     def _generate_id(self, length: int = 10) -> str:
         """تولید شناسه منحصربه‌فرد"""
@@ -229,66 +274,229 @@ class BaseRepository:
     def _load_json(self, filename: str) -> Dict:
         """بارگذاری فایل JSON"""
         try:
-            file_path = self.data_dir / filename
-            if file_path.exists():
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            return self.json_store.load(filename, {})
         except Exception as e:
             logger.error(f"خطا در بارگذاری {filename}: {e}")
         return {}
     
     def _save_json(self, filename: str, data: Dict):
-        """ذخیره فایل JSON"""
+        """ذخیره فایل JSON (اتمیک و خارج از حلقه رویداد)"""
         try:
-            file_path = self.data_dir / filename
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.json_store.save_background(filename, data)
         except Exception as e:
             logger.error(f"خطا در ذخیره {filename}: {e}")
+    
+    def _load_records(self) -> Dict[str, Any]:
+        """بارگذاری رکوردها از فایل JSON (با storage بارگذاری اولیه لازم نیست)"""
+        # value -> شناسه‌ها (دیکشنری به عنوان مجموعه مرتب)
+        self._indexes: Dict[str, Dict[Any, Dict[str, None]]] = {
+            field: {} for field in self.indexed_fields
+        }
+        self._index_keys: Dict[str, Tuple] = {}
+        
+        if self.storage is not None:
+            return {}
+        
+        data = self._load_json(self.filename)
+        records = {}
+        for record_id, record_data in data.items():
+            try:
+                records[record_id] = self.model.from_dict(record_data)
+                self._index_add(record_id, records[record_id])
+            except Exception as e:
+                logger.error(f"خطا در بارگذاری رکورد {record_id} از {self.filename}: {e}")
+        return records
+    
+    def _index_add(self, record_id: str, record):
+        """افزودن رکورد به ایندکس‌های ثانویه"""
+        keys = tuple(getattr(record, field) for field in self.indexed_fields)
+        for field, key in zip(self.indexed_fields, keys):
+            self._indexes[field].setdefault(key, {})[record_id] = None
+        self._index_keys[record_id] = keys
+    
+    def _index_remove(self, record_id: str):
+        """حذف رکورد از ایندکس‌های ثانویه"""
+        keys = self._index_keys.pop(record_id, None)
+        if keys is None:
+            return
+        for field, key in zip(self.indexed_fields, keys):
+            ids = self._indexes[field].get(key)
+            if ids is not None:
+                ids.pop(record_id, None)
+                if not ids:
+                    del self._indexes[field][key]
+    
+    def _reindex(self, records: Dict[str, Any], record_id: str):
+        """به‌روزرسانی ایندکس‌ها پس از تغییر یک رکورد (فقط در صورت تغییر فیلدهای ایندکس)"""
+        if self.storage is not None or not self.indexed_fields:
+            return
+        record = records.get(record_id)
+        if record is None:
+            self._index_remove(record_id)
+            return
+        old_keys = self._index_keys.get(record_id)
+        if old_keys is None:
+            self._index_add(record_id, record)
+            return
+        
+        keys = tuple(getattr(record, field) for field in self.indexed_fields)
+        for field, old_key, key in zip(self.indexed_fields, old_keys, keys):
+            if old_key == key:
+                continue
+            ids = self._indexes[field].get(old_key)
+            if ids is not None:
+                ids.pop(record_id, None)
+                if not ids:
+                    del self._indexes[field][old_key]
+            self._indexes[field].setdefault(key, {})[record_id] = None
+        self._index_keys[record_id] = keys
+    
+    def _persist(self, records: Dict[str, Any], record_id: str = None):
+        """ذخیره تغییرات؛ با storage فقط رکورد تغییرکرده نوشته می‌شود"""
+        if record_id is not None:
+            self._reindex(records, record_id)
+        
+        if self.storage is None:
+            self._schedule_snapshot(records)
+        elif record_id is not None:
+            self.storage.put(self.storage_collection, record_id, records[record_id].to_dict())
+        else:
+            self.storage.put_many(
+                self.storage_collection,
+                {r_id: r.to_dict() for r_id, r in records.items()}
+            )
+    
+    def _schedule_snapshot(self, records: Dict[str, Any]):
+        """زمان‌بندی نوشتن فایل JSON
+        
+        ساخت دیکشنری کامل رکوردها روی حلقه رویداد O(n) است؛ تغییرات پشت‌سرهم
+        در بازه persist_delay فقط یک snapshot می‌سازند.
+        """
+        self._dirty_records = records
+        if self._persist_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_snapshot()
+            return
+        self._persist_handle = loop.call_later(self.persist_delay, self._write_snapshot)
+    
+    def _write_snapshot(self):
+        """ساخت snapshot رکوردهای تغییرکرده و ارسال آن به thread های I/O"""
+        self._persist_handle = None
+        records, self._dirty_records = self._dirty_records, None
+        if records is not None:
+            self._save_json(self.filename, {r_id: r.to_dict() for r_id, r in records.items()})
+    
+    def flush(self):
+        """نوشتن snapshot معلق و انتظار برای پایان ذخیره‌سازی‌های در جریان"""
+        if self._persist_handle is not None:
+            self._persist_handle.cancel()
+        self._write_snapshot()
+        self.json_store.flush()
+    
+    def _get_record(self, records: Dict[str, Any], record_id: str):
+        """دریافت رکورد از cache یا storage"""
+        record = records.get(record_id)
+        if record is None and self.storage is not None:
+            data = self.storage.get(self.storage_collection, record_id)
+            if data is not None:
+                record = self.model.from_dict(data)
+                records[record_id] = record
+        return record
+    
+    def _delete_record(self, records: Dict[str, Any], record_id: str) -> bool:
+        """حذف رکورد"""
+        existed = records.pop(record_id, None) is not None
+        self._index_remove(record_id)
+        if self.storage is not None:
+            existed = self.storage.delete(self.storage_collection, record_id) or existed
+        elif existed:
+            self._persist(records)
+        return existed
+    
+    def _wrap(self, records: Dict[str, Any], rows) -> List[Any]:
+        """تبدیل ردیف‌های storage به مدل (با اولویت نمونه‌های موجود در cache)"""
+        result = []
+        for record_id, data in rows:
+            record = records.get(record_id)
+            result.append(record if record is not None else self.model.from_dict(data))
+        return result
+    
+    def _all_records(self, records: Dict[str, Any]) -> List[Any]:
+        """تمام رکوردها"""
+        if self.storage is None:
+            return list(records.values())
+        return self._wrap(records, self.storage.iter_all(self.storage_collection))
+    
+    def _find_records(self, records: Dict[str, Any], field: str, value: Any) -> List[Any]:
+        """جستجو روی یک فیلد ایندکس‌شده"""
+        if self.storage is None:
+            if field in self._indexes:
+                return [records[r_id] for r_id in self._indexes[field].get(value, ())]
+            return [r for r in records.values() if getattr(r, field) == value]
+        
+        if field in INDEXED_FIELDS:
+            stored_value = value.value if isinstance(value, Enum) else value
+            return self._wrap(records, self.storage.find(self.storage_collection, field, stored_value))
+        return [r for r in self._all_records(records) if getattr(r, field) == value]
+    
+    def _count_by(self, records: Dict[str, Any], field: str, value: Any) -> int:
+        """تعداد رکوردها با یک مقدار مشخص در فیلد ایندکس‌شده"""
+        if self.storage is None and field in self._indexes:
+            return len(self._indexes[field].get(value, ()))
+        if self.storage is not None and field in INDEXED_FIELDS:
+            stored_value = value.value if isinstance(value, Enum) else value
+            return self.storage.count(self.storage_collection, field, stored_value)
+        return len(self._find_records(records, field, value))
+    
+    def _count_records(self, records: Dict[str, Any]) -> int:
+        """تعداد رکوردها"""
+        if self.storage is None:
+            return len(records)
+        return self.storage.count(self.storage_collection)
 
 
 class UserRepository(BaseRepository):
     """ریپوزیتوری کاربران"""
     
-    def __init__(self, data_dir: Path):
-        super().__init__(data_dir)
-        self.users_file = "users.json"
+    collection = "users"
+    filename = "users.json"
+    model = User
+    indexed_fields = ('status',)
+    
+    def __init__(self, data_dir: Path, storage: Optional[BaseStorage] = None):
+        super().__init__(data_dir, storage)
+        self.users_file = self.filename
         self._users = self._load_users()
     
     def _load_users(self) -> Dict[str, User]:
         """بارگذاری کاربران"""
-        data = self._load_json(self.users_file)
-        users = {}
-        for user_id, user_data in data.items():
-            try:
-                users[user_id] = User.from_dict(user_data)
-            except Exception as e:
-                logger.error(f"خطا در بارگذاری کاربر {user_id}: {e}")
-        return users
+        return self._load_records()
     
-    def _save_users(self):
+    def _save_users(self, user_id: str = None):
         """ذخیره کاربران"""
-        data = {user_id: user.to_dict() for user_id, user in self._users.items()}
-        self._save_json(self.users_file, data)
+        self._persist(self._users, user_id)
     
     def get_user(self, user_id: str) -> Optional[User]:
         """دریافت کاربر"""
-        return self._users.get(user_id)
+        return self._get_record(self._users, user_id)
     
     def get_all_users(self) -> List[User]:
         """دریافت تمام کاربران"""
-        return list(self._users.values())
+        return self._all_records(self._users)
     
     def create_user(self, user_data: Dict) -> User:
         """ایجاد کاربر جدید"""
         user_id = user_data.get('id', self._generate_id())
         
-        if user_id in self._users:
+        if self.get_user(user_id):
             raise ValueError(f"کاربر با شناسه {user_id} از قبل وجود دارد")
         
         user = User.from_dict(user_data)
         self._users[user_id] = user
-        self._save_users()
+        self._save_users(user_id)
         return user
     
     def update_user(self, user_id: str, updates: Dict) -> Optional[User]:
@@ -302,51 +510,65 @@ class UserRepository(BaseRepository):
             if hasattr(user, key):
                 setattr(user, key, value)
         
-        self._save_users()
+        self._save_users(user_id)
         return user
     
     def delete_user(self, user_id: str) -> bool:
         """حذف کاربر"""
-        if user_id in self._users:
-            del self._users[user_id]
-            self._save_users()
-            return True
-        return False
+        return self._delete_record(self._users, user_id)
     
     def count_users(self) -> int:
         """تعداد کاربران"""
-        return len(self._users)
+        return self._count_records(self._users)
     
     def get_premium_users(self) -> List[User]:
         """دریافت کاربران پریمیوم"""
-        return [user for user in self._users.values() if user.is_premium()]
+        return self._find_records(self._users, 'status', UserStatus.PREMIUM)
+    
+    def count_premium_users(self) -> int:
+        """تعداد کاربران پریمیوم"""
+        return self._count_by(self._users, 'status', UserStatus.PREMIUM)
 
 
 class DownloadRepository(BaseRepository):
-    """ریپوزیتوری دانلود"""
-    
-    def __init__(self, data_dir: Path):
-        super().__init__(data_dir)
-        self.downloads_file = "downloads.json"
+    """ریپوزیتوری دانلود
+    
+    وضعیت کارهای دانلود فقط از طریق انتقال‌های مجاز تغییر می‌کند و هر انتقال
+    بلافاصله ذخیره می‌شود تا کارهای ناتمام پس از راه‌اندازی مجدد ادامه یابند.
+    """
+    
+    collection = "downloads"
+    filename = "downloads.json"
+    model = DownloadRequest
+    indexed_fields = ('user_id', 'status')
+    
+    # انتقال‌های مجاز وضعیت (PROCESSING -> PENDING برای صف‌گذاری دوباره پس از راه‌اندازی مجدد)
+    TRANSITIONS = {
+        DownloadStatus.PENDING: (DownloadStatus.PROCESSING, DownloadStatus.FAILED,
+                                 DownloadStatus.CANCELLED),
+        DownloadStatus.PROCESSING: (DownloadStatus.COMPLETED, DownloadStatus.FAILED,
+                                    DownloadStatus.CANCELLED, DownloadStatus.PENDING),
+        DownloadStatus.COMPLETED: (),
+        DownloadStatus.FAILED: (),
+        DownloadStatus.CANCELLED: (),
+    }
+    
+    def __init__(self, data_dir: Path, storage: Optional[BaseStorage] = None):
+        super().__init__(data_dir, storage)
+        self.downloads_file = self.filename
         self._downloads = self._load_downloads()
     
     def _load_downloads(self) -> Dict[str, DownloadRequest]:
         """بارگذاری دانلودها"""
-        data = self._load_json(self.downloads_file)
-        downloads = {}
-        for download_id, download_data in data.items():
-            try:
-                downloads[download_id] = DownloadRequest.from_dict(download_data)
-            except Exception as e:
-                logger.error(f"خطا در بارگذاری دانلود {download_id}: {e}")
-        return downloads
+        return self._load_records()
     
-    def _save_downloads(self):
+    def _save_downloads(self, download_id: str = None):
         """ذخیره دانلودها"""
-        data = {d_id: d.to_dict() for d_id, d in self._downloads.items()}
-        self._save_json(self.downloads_file, data)
+        self._persist(self._downloads, download_id)
     
-    def create_download(self, user_id: str, url: str, platform: str) -> DownloadRequest:
+    def create_download(self, user_id: str, url: str, platform: str,
+                        quality: Optional[str] = None, chat_id: Optional[int] = None,
+                        message_id: Optional[int] = None) -> DownloadRequest:
         """ایجاد درخواست دانلود"""
         download_id = f"DL_{self._generate_id()}"
         
@@ -356,20 +578,23 @@ class DownloadRepository(BaseRepository):
             url=url,
             platform=platform,
             status=DownloadStatus.PENDING,
-            requested_at=datetime.now().isoformat()
+            requested_at=datetime.now().isoformat(),
+            quality=quality,
+            chat_id=chat_id,
+            message_id=message_id
         )
         
         self._downloads[download_id] = download
-        self._save_downloads()
+        self._save_downloads(download_id)
         return download
     
     def get_download(self, download_id: str) -> Optional[DownloadRequest]:
         """دریافت دانلود"""
-        return self._downloads.get(download_id)
+        return self._get_record(self._downloads, download_id)
     
     def get_user_downloads(self, user_id: str) -> List[DownloadRequest]:
         """دریافت دانلودهای کاربر"""
-        return [d for d in self._downloads.values() if d.user_id == user_id]
+        return self._find_records(self._downloads, 'user_id', user_id)
     
     def update_download(self, download_id: str, updates: Dict) -> Optional[DownloadRequest]:
         """به‌روزرسانی دانلود"""
@@ -381,55 +606,149 @@ class DownloadRepository(BaseRepository):
             if hasattr(download, key):
                 setattr(download, key, value)
         
-        self._save_downloads()
+        self._save_downloads(download_id)
         return download
     
-    def complete_download(self, download_id: str, file_path: str, file_size: float) -> bool:
-        """تکمیل دانلود"""
+    def transition(self, download_id: str, status: DownloadStatus,
+                   **updates) -> Optional[DownloadRequest]:
+        """تغییر وضعیت دانلود (فقط انتقال‌های مجاز) و ذخیره فوری"""
         download = self.get_download(download_id)
         if not download:
-            return False
+            return None
         
-        download.status = DownloadStatus.COMPLETED
-        download.completed_at = datetime.now().isoformat()
-        download.file_path = file_path
-        download.file_size = file_size
+        if status is not download.status and status not in self.TRANSITIONS[download.status]:
+            logger.warning(f"انتقال نامعتبر وضعیت دانلود {download_id}: "
+                           f"{download.status.value} -> {status.value}")
+            return None
         
-        self._save_downloads()
-        return True
+        download.status = status
+        for key, value in updates.items():
+            setattr(download, key, value)
+        download.updated_at = datetime.now().isoformat()
+        
+        self._save_downloads(download_id)
+        return download
+    
+    def start_download(self, download_id: str, output_dir: Optional[str] = None) -> Optional[DownloadRequest]:
+        """شروع (یا ادامه) دانلود"""
+        download = self.get_download(download_id)
+        if not download:
+            return None
+        return self.transition(
+            download_id, DownloadStatus.PROCESSING,
+            output_dir=output_dir or download.output_dir,
+            started_at=datetime.now().isoformat(),
+            attempts=download.attempts + 1
+        )
+    
+    def record_part(self, download_id: str, part_path: str):
+        """ثبت مسیر فایل .part در حال دانلود (فقط در صورت تغییر ذخیره می‌شود)"""
+        download = self.get_download(download_id)
+        if download and download.part_path != part_path:
+            download.part_path = part_path
+            self._save_downloads(download_id)
+    
+    def complete_download(self, download_id: str, file_path: str, file_size: float) -> bool:
+        """تکمیل دانلود"""
+        return self.transition(
+            download_id, DownloadStatus.COMPLETED,
+            completed_at=datetime.now().isoformat(),
+            file_path=file_path,
+            file_size=file_size,
+            part_path=None
+        ) is not None
+    
+    def fail_download(self, download_id: str, error_message: str) -> bool:
+        """ثبت خطای دانلود"""
+        return self.transition(
+            download_id, DownloadStatus.FAILED,
+            error_message=error_message[:500], part_path=None
+        ) is not None
+    
+    def cancel_download(self, download_id: str) -> bool:
+        """لغو دانلود توسط کاربر"""
+        return self.transition(download_id, DownloadStatus.CANCELLED, part_path=None) is not None
+    
+    def get_unfinished(self) -> List[DownloadRequest]:
+        """کارهای ناتمام (در صف یا در حال اجرا) به ترتیب درخواست"""
+        unfinished = (
+            self._find_records(self._downloads, 'status', DownloadStatus.PENDING) +
+            self._find_records(self._downloads, 'status', DownloadStatus.PROCESSING)
+        )
+        return sorted(unfinished, key=lambda d: d.requested_at)
     
     def count_downloads(self) -> int:
         """تعداد دانلودها"""
-        return len(self._downloads)
+        return self._count_records(self._downloads)
     
     def count_user_downloads(self, user_id: str) -> int:
         """تعداد دانلودهای کاربر"""
-        return len(self.get_user_downloads(user_id))
+        return self._count_by(self._downloads, 'user_id', user_id)
+    
+    def get_downloads_by_status(self, status: DownloadStatus) -> List[DownloadRequest]:
+        """دریافت دانلودها بر اساس وضعیت"""
+        return self._find_records(self._downloads, 'status', status)
+    
+    def get_downloads_before(self, cutoff: datetime) -> List[DownloadRequest]:
+        """دریافت دانلودهای درخواست‌شده قبل از یک زمان"""
+        if self.storage is not None:
+            return self._wrap(
+                self._downloads,
+                self.storage.find_range(self.storage_collection, 'requested_at', end=cutoff.isoformat())
+            )
+        return [
+            d for d in self._downloads.values()
+            if datetime.fromisoformat(d.requested_at) < cutoff
+        ]
+    
+    def get_downloads_since(self, start: datetime) -> List[DownloadRequest]:
+        """دریافت دانلودهای درخواست‌شده از یک زمان به بعد"""
+        if self.storage is not None:
+            return self._wrap(
+                self._downloads,
+                self.storage.find_range(self.storage_collection, 'requested_at', start=start.isoformat())
+            )
+        return [
+            d for d in self._downloads.values()
+            if datetime.fromisoformat(d.requested_at) >= start
+        ]
+    
+    def delete_downloads(self, download_ids: List[str]):
+        """حذف گروهی دانلودها"""
+        if self.storage is not None:
+            with self.storage.batch():
+                for download_id in download_ids:
+                    self._downloads.pop(download_id, None)
+                    self._index_remove(download_id)
+                    self.storage.delete(self.storage_collection, download_id)
+            return
+        
+        for download_id in download_ids:
+            self._downloads.pop(download_id, None)
+            self._index_remove(download_id)
+        self._save_downloads()
 
 
 class PaymentRepository(BaseRepository):
     """ریپوزیتوری پرداخت"""
     
-    def __init__(self, data_dir: Path):
-        super().__init__(data_dir)
-        self.payments_file = "payments.json"
+    collection = "payments"
+    filename = "payments.json"
+    model = Payment
+    indexed_fields = ('user_id', 'status')
+    
+    def __init__(self, data_dir: Path, storage: Optional[BaseStorage] = None):
+        super().__init__(data_dir, storage)
+        self.payments_file = self.filename
         self._payments = self._load_payments()
     
     def _load_payments(self) -> Dict[str, Payment]:
         """بارگذاری پرداخت‌ها"""
-        data = self._load_json(self.payments_file)
-        payments = {}
-        for payment_id, payment_data in data.items():
-            try:
-                payments[payment_id] = Payment.from_dict(payment_data)
-            except Exception as e:
-                logger.error(f"خطا در بارگذاری پرداخت {payment_id}: {e}")
-        return payments
+        return self._load_records()
     
-    def _save_payments(self):
+    def _save_payments(self, payment_id: str = None):
         """ذخیره پرداخت‌ها"""
-        data = {p_id: p.to_dict() for p_id, p in self._payments.items()}
-        self._save_json(self.payments_file, data)
+        self._persist(self._payments, payment_id)
     
     def create_payment(self, user_id: str, plan_id: str, amount_usdt: float, 
                       wallet_address: str) -> Payment:
@@ -447,16 +766,28 @@ class PaymentRepository(BaseRepository):
         )
         
         self._payments[payment_id] = payment
-        self._save_payments()
+        self._save_payments(payment_id)
         return payment
     
     def get_payment(self, payment_id: str) -> Optional[Payment]:
         """دریافت پرداخت"""
-        return self._payments.get(payment_id)
+        return self._get_record(self._payments, payment_id)
     
     def get_user_payments(self, user_id: str) -> List[Payment]:
         """دریافت پرداخت‌های کاربر"""
-        return [p for p in self._payments.values() if p.user_id == user_id]
+        return self._find_records(self._payments, 'user_id', user_id)
+    
+    def count_user_payments(self, user_id: str) -> int:
+        """تعداد پرداخت‌های کاربر"""
+        return self._count_by(self._payments, 'user_id', user_id)
+    
+    def get_payments_by_status(self, status: PaymentStatus) -> List[Payment]:
+        """دریافت پرداخت‌ها بر اساس وضعیت"""
+        return self._find_records(self._payments, 'status', status)
+    
+    def get_all_payments(self) -> List[Payment]:
+        """دریافت تمام پرداخت‌ها"""
+        return self._all_records(self._payments)
     
     def update_payment(self, payment_id: str, updates: Dict) -> Optional[Payment]:
         """به‌روزرسانی پرداخت"""
@@ -468,7 +799,7 @@ class PaymentRepository(BaseRepository):
             if hasattr(payment, key):
                 setattr(payment, key, value)
         
-        self._save_payments()
+        self._save_payments(payment_id)
         return payment
     
     def confirm_payment(self, payment_id: str, txid: str) -> bool:
@@ -484,7 +815,7 @@ class PaymentRepository(BaseRepository):
         # محاسبه تاریخ انقضا (اگر plan_id مشخص باشد)
         # این بخش باید با سرویس اشتراک‌ها تکمیل شود
         
-        self._save_payments()
+        self._save_payments(payment_id)
         return True
     
     def complete_payment(self, payment_id: str) -> bool:
@@ -494,33 +825,30 @@ class PaymentRepository(BaseRepository):
             return False
         
         payment.status = PaymentStatus.COMPLETED
-        self._save_payments()
+        self._save_payments(payment_id)
         return True
 
 
 class AdRepository(BaseRepository):
     """ریپوزیتوری تبلیغات"""
     
-    def __init__(self, data_dir: Path):
-        super().__init__(data_dir)
-        self.ads_file = "ads.json"
+    collection = "ads"
+    filename = "ads.json"
+    model = AdCampaign
+    indexed_fields = ('is_active',)
+    
+    def __init__(self, data_dir: Path, storage: Optional[BaseStorage] = None):
+        super().__init__(data_dir, storage)
+        self.ads_file = self.filename
         self._campaigns = self._load_campaigns()
     
     def _load_campaigns(self) -> Dict[str, AdCampaign]:
         """بارگذاری کمپین‌ها"""
-        data = self._load_json(self.ads_file)
-        campaigns = {}
-        for campaign_id, campaign_data in data.items():
-            try:
-                campaigns[campaign_id] = AdCampaign.from_dict(campaign_data)
-            except Exception as e:
-                logger.error(f"خطا در بارگذاری کمپین {campaign_id}: {e}")
-        return campaigns
+        return self._load_records()
     
-    def _save_campaigns(self):
+    def _save_campaigns(self, campaign_id: str = None):
         """ذخیره کمپین‌ها"""
-        data = {c_id: c.to_dict() for c_id, c in self._campaigns.items()}
-        self._save_json(self.ads_file, data)
+        self._persist(self._campaigns, campaign_id)
     
     def create_campaign(self, campaign_data: Dict) -> AdCampaign:
         """ایجاد کمپین جدید"""
@@ -529,16 +857,16 @@ class AdRepository(BaseRepository):
         
         campaign = AdCampaign.from_dict(campaign_data)
         self._campaigns[campaign_id] = campaign
-        self._save_campaigns()
+        self._save_campaigns(campaign_id)
         return campaign
     
     def get_campaign(self, campaign_id: str) -> Optional[AdCampaign]:
         """دریافت کمپین"""
-        return self._campaigns.get(campaign_id)
+        return self._get_record(self._campaigns, campaign_id)
     
     def get_active_campaigns(self) -> List[AdCampaign]:
         """دریافت کمپین‌های فعال"""
-        return [c for c in self._campaigns.values() if c.is_active]
+        return self._find_records(self._campaigns, 'is_active', True)
     
     def record_impression(self, campaign_id: str) -> bool:
         """ثبت نمایش تبلیغ"""
@@ -547,7 +875,7 @@ class AdRepository(BaseRepository):
             return False
         
         campaign.impressions += 1
-        self._save_campaigns()
+        self._save_campaigns(campaign_id)
         return True
     
     def record_click(self, campaign_id: str) -> bool:
@@ -557,7 +885,7 @@ class AdRepository(BaseRepository):
             return False
         
         campaign.clicks += 1
-        self._save_campaigns()
+        self._save_campaigns(campaign_id)
         return True
 
 
@@ -566,10 +894,37 @@ class AdRepository(BaseRepository):
 # =========================
 
 class UserService:
-    """سرویس مدیریت کاربران"""
+    """سرویس مدیریت کاربران
+    
+    ریپوزیتوری‌های دانلود و پرداخت توسط DomainManager تزریق می‌شوند تا همه
+    سرویس‌ها از یک نمونه مشترک (و داده‌های درون حافظه آن) استفاده کنند.
+    آمار سیستم در stats به صورت افزایشی نگه داشته می‌شود.
+    """
     
-    def __init__(self, user_repo: UserRepository):
+    def __init__(self, user_repo: UserRepository,
+                 download_repo: Optional['DownloadRepository'] = None,
+                 payment_repo: Optional['PaymentRepository'] = None):
         self.user_repo = user_repo
+        self.download_repo = download_repo or DownloadRepository(user_repo.data_dir, user_repo.storage)
+        self.payment_repo = payment_repo or PaymentRepository(user_repo.data_dir, user_repo.storage)
+        self.stats = StatsCounters()
+        self.rebuild_stats()
+    
+    def rebuild_stats(self):
+        """محاسبه کامل شمارنده‌های آمار (فقط هنگام راه‌اندازی)"""
+        self.stats.reset()
+        for user in self.user_repo.get_all_users():
+            self.stats.add('users', ts=datetime.fromisoformat(user.join_date).timestamp())
+        
+        since = datetime.now() - timedelta(days=self.stats.retention_days)
+        for download in self.download_repo.get_downloads_since(since):
+            ts = datetime.fromisoformat(download.requested_at).timestamp()
+            self.stats.add('downloads', ts=ts)
+        
+        for payment in self.payment_repo.get_payments_by_status(PaymentStatus.COMPLETED):
+            ts = datetime.fromisoformat(payment.confirmed_at or payment.created_at).timestamp()
+            self.stats.add('payments', ts=ts)
+            self.stats.add('revenue', payment.amount_usdt, ts=ts)
     
     def register_user(self, user_id: str, username: str, first_name: str, 
                      last_name: str = None) -> User:
@@ -592,7 +947,9 @@ class UserService:
             'last_seen': datetime.now().isoformat()
         }
         
-        return self.user_repo.create_user(user_data)
+        user = self.user_repo.create_user(user_data)
+        self.stats.add('users')
+        return user
     
     def get_user_profile(self, user_id: str) -> Optional[Dict]:
         """دریافت پروفایل کاربر"""
@@ -600,11 +957,8 @@ class UserService:
         if not user:
             return None
         
-        download_repo = DownloadRepository(self.user_repo.data_dir)
-        payment_repo = PaymentRepository(self.user_repo.data_dir)
-        
-        download_count = download_repo.count_user_downloads(user_id)
-        payment_count = len(payment_repo.get_user_payments(user_id))
+        download_count = self.download_repo.count_user_downloads(user_id)
+        payment_count = self.payment_repo.count_user_payments(user_id)
         
         return {
             'user': user.to_dict(),
@@ -640,8 +994,7 @@ class UserService:
         if user.is_premium():
             return True, "پریمیوم"
         
-        download_repo = DownloadRepository(self.user_repo.data_dir)
-        download_count = download_repo.count_user_downloads(user_id)
+        download_count = self.download_repo.count_user_downloads(user_id)
         
         if download_count < max_free_downloads:
             remaining = max_free_downloads - download_count
@@ -650,34 +1003,23 @@ class UserService:
             return False, f"دانلودهای رایگان شما به پایان رسیده است."
     
     def get_system_stats(self) -> Dict:
-        """دریافت آمار سیستم"""
-        total_users = self.user_repo.count_users()
-        premium_users = len(self.user_repo.get_premium_users())
+        """دریافت آمار سیستم
         
-        download_repo = DownloadRepository(self.user_repo.data_dir)
-        payment_repo = PaymentRepository(self.user_repo.data_dir)
-        
-        total_downloads = download_repo.count_downloads()
-        
-        # محاسبه درآمد
-        total_revenue = 0
-        for payment in payment_repo._payments.values():
-            if payment.status == PaymentStatus.COMPLETED:
-                total_revenue += payment.amount_usdt
-        
-        # کاربران امروز
-        today = datetime.now().date().isoformat()
-        today_users = sum(
-            1 for user in self.user_repo._users.values()
-            if datetime.fromisoformat(user.join_date).date().isoformat() == today
-        )
+        تعدادها از ایندکس‌ها و درآمد/آمار روزانه از شمارنده‌های افزایشی خوانده می‌شوند.
+        """
+        total_users = self.user_repo.count_users()
+        premium_users = self.user_repo.count_premium_users()
+        counters = self.stats.snapshot()
         
         return {
             'total_users': total_users,
             'premium_users': premium_users,
-            'total_downloads': total_downloads,
-            'total_revenue': total_revenue,
-            'today_users': today_users,
+            'total_downloads': self.download_repo.count_downloads(),
+            'total_payments': counters['total_payments'],
+            'total_revenue': counters['total_revenue'],
+            'today_users': counters['today_users'],
+            'today_downloads': counters['today_downloads'],
+            'today_revenue': counters['today_revenue'],
             'premium_percentage': (premium_users / total_users * 100) if total_users > 0 else 0
         }
 
@@ -688,35 +1030,16 @@ class DownloadService:
     def __init__(self, download_repo: DownloadRepository, user_service: UserService):
         self.download_repo = download_repo
         self.user_service = user_service
-        
-        # پلتفرم‌های پشتیبانی شده
-        self.supported_platforms = {
-            'youtube.com': 'YouTube',
-            'youtu.be': 'YouTube',
-            'instagram.com': 'Instagram',
-            'instagr.am': 'Instagram',
-            'tiktok.com': 'TikTok',
-            'twitter.com': 'Twitter',
-            'x.com': 'Twitter',
-            'facebook.com': 'Facebook',
-            'fb.watch': 'Facebook',
-            'reddit.com': 'Reddit',
-            'dailymotion.com': 'Dailymotion',
-            'vimeo.com': 'Vimeo',
-            'twitch.tv': 'Twitch'
-        }
     
     def validate_url(self, url: str) -> Tuple[bool, Optional[str]]:
         """اعتبارسنجی URL"""
         if not url.startswith(('http://', 'https://')):
             return False, "URL باید با http:// یا https:// شروع شود"
         
-        url_lower = url.lower()
-        for domain, platform in self.supported_platforms.items():
-            if domain in url_lower:
-                return True, platform
-        
-        return False, "پلتفرم پشتیبانی نمی‌شود"
+        platform = match_platform(url)
+        if platform is None:
+            return False, "پلتفرم پشتیبانی نمی‌شود"
+        return True, platform.label
     
     def create_download_request(self, user_id: str, url: str, 
                                check_limit: bool = True) -> Tuple[bool, Union[str, DownloadRequest]]:
@@ -734,6 +1057,7 @@ class DownloadService:
         
         # ایجاد درخواست دانلود
         download = self.download_repo.create_download(user_id, url, platform)
+        self.user_service.stats.add('downloads')
         logger.info(f"درخواست دانلود ایجاد شد: {download.id} برای کاربر {user_id}")
         
         return True, download
@@ -947,6 +1271,8 @@ class PaymentService:
             
             # تکمیل پرداخت
             self.payment_repo.complete_payment(payment_id)
+            self.user_service.stats.add('payments')
+            self.user_service.stats.add('revenue', payment.amount_usdt)
             
             logger.info(f"پرداخت {payment_id} تأیید شد و کاربر ارتقا یافت")
             return True, "پرداخت با موفقیت تأیید شد و اشتراک فعال گردید"
@@ -1099,20 +1425,22 @@ class AdService:
 class DomainManager:
     """مدیریت یکپارچه دامنه"""
     
-    def __init__(self, data_dir: Path):
+    def __init__(self, data_dir: Path, storage: Optional[BaseStorage] = None):
         self.data_dir = data_dir
+        self.storage = storage
         
         # ایجاد ریپوزیتوری‌ها
-        self.user_repo = UserRepository(data_dir)
-        self.download_repo = DownloadRepository(data_dir)
-        self.payment_repo = PaymentRepository(data_dir)
-        self.ad_repo = AdRepository(data_dir)
+        self.user_repo = UserRepository(data_dir, storage)
+        self.download_repo = DownloadRepository(data_dir, storage)
+        self.payment_repo = PaymentRepository(data_dir, storage)
+        self.ad_repo = AdRepository(data_dir, storage)
         
-        # ایجاد سرویس‌ها
-        self.user_service = UserService(self.user_repo)
+        # ایجاد سرویس‌ها (هر ریپوزیتوری یک نمونه مشترک بین همه سرویس‌ها دارد)
+        self.user_service = UserService(self.user_repo, self.download_repo, self.payment_repo)
         self.download_service = DownloadService(self.download_repo, self.user_service)
         self.payment_service = PaymentService(self.payment_repo, self.user_service)
         self.ad_service = AdService(self.ad_repo)
+        self.stats = self.user_service.stats
     
     def get_system_stats(self) -> Dict:
         """دریافت آمار کامل سیستم"""
@@ -1134,19 +1462,21 @@ class DomainManager:
         
         # پاکسازی دانلودهای قدیمی
         old_downloads = [
-            d_id for d_id, d in self.download_repo._downloads.items()
-            if datetime.fromisoformat(d.requested_at) < cutoff_date
-            and d.status == DownloadStatus.COMPLETED
+            d.id for d in self.download_repo.get_downloads_before(cutoff_date)
+            if d.status == DownloadStatus.COMPLETED
         ]
         
-        for d_id in old_downloads:
-            del self.download_repo._downloads[d_id]
-        
-        self.download_repo._save_downloads()
+        self.download_repo.delete_downloads(old_downloads)
         logger.info(f"پاکسازی {len(old_downloads)} دانلود قدیمی")
     
+    def flush(self):
+        """نوشتن snapshot های معلق و انتظار برای پایان ذخیره‌سازی فایل‌های JSON"""
+        for repo in (self.user_repo, self.download_repo, self.payment_repo, self.ad_repo):
+            repo.flush()
+    
     def backup_data(self, backup_dir: Path):
         """پشتیبان‌گیری از داده‌ها"""
+        self.flush()
         backup_dir.mkdir(exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
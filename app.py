@@ -14,10 +14,20 @@ import json
 import re
 import logging
 import asyncio
-import tempfile
-from typing import Dict, List, Optional, Tuple, Any
+import sys
+import time
+import copy
+import heapq
+import itertools
+import shutil
+import hashlib
+import importlib.util
+import threading
+from enum import IntEnum
+from typing import Dict, List, Optional, Set, Tuple, Any, Awaitable, Callable
 from datetime import datetime, timedelta
 from pathlib import Path
+from types import SimpleNamespace
 
 from telegram import (
     Update, 
@@ -35,14 +45,30 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from dotenv import load_dotenv
 
-# تلاش برای وارد کردن yt-dlp برای دانلود واقعی
-try:
-    import yt_dlp
-    YTDLP_AVAILABLE = True
-except ImportError:
-    YTDLP_AVAILABLE = False
+from core.base_storage import BaseStorage
+from core.json_storage import JournalStore, JsonStore
+from core.sqlite_storage import SQLiteStorage
+from core.stats import StatsCounters
+from core.bandwidth import BandwidthGovernor
+from core.callback_store import CallbackStore
+from core.download_worker import DownloadExecutor, DownloadTimeoutError
+from core.download_queue import DownloadJob, DownloadQueue, QueueFullError, UserLimitError
+from core.file_id_cache import FileIdCache
+from core.link_generator import canonical_key, canonicalize, match_platform
+from core.media_cache import MediaCache
+from core.metadata_probe import MetadataProbe, format_duration, format_size
+from core.single_flight import SingleFlight
+from core.progress import ChatThrottle, ProgressReporter
+from core.format_converter import ConversionPlan, FormatConverter
+from core.admin import DownloadRepository, DownloadStatus
+
+# yt-dlp فقط در پردازه‌های worker وارد می‌شود؛ اینجا تنها وجود آن بررسی می‌شود
+YTDLP_AVAILABLE = importlib.util.find_spec("yt_dlp") is not None
+if not YTDLP_AVAILABLE:
     print("⚠️ yt-dlp نصب نیست. دانلود واقعی غیرفعال است.")
     print("برای دانلود واقعی: pip install yt-dlp")
 
@@ -61,6 +87,18 @@ logger = logging.getLogger(__name__)
 # Configuration
 # =========================
 
+def load_config_file(path: Path) -> Dict[str, Any]:
+    """خواندن config.json (در صورت نبود یا خطا، دیکشنری خالی)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"خطا در خواندن {path}: {e}")
+        return {}
+
+
 class Config:
     """کلاس پیکربندی"""
     
@@ -73,6 +111,10 @@ class Config:
     # فعال/غیرفعال کردن دانلود واقعی
     ENABLE_REAL_DOWNLOAD = YTDLP_AVAILABLE
     
+    # تنظیمات فایل config.json
+    CONFIG_FILE = Path(os.getenv('CONFIG_FILE', Path(__file__).with_name('config.json')))
+    FILE_CONFIG = load_config_file(CONFIG_FILE)
+    
     # طرح‌های اشتراک
     PLANS = {
         "monthly": {
@@ -134,37 +176,144 @@ class Config:
     # محدودیت‌ها
     MAX_FREE_DOWNLOADS = 3
     
-    # پلتفرم‌های پشتیبانی شده
-    SUPPORTED_PLATFORMS = [
-        'youtube.com', 'youtu.be',
-        'instagram.com', 'instagr.am',
-        'tiktok.com',
-        'twitter.com', 'x.com',
-        'facebook.com', 'fb.watch',
-        'reddit.com',
-        'dailymotion.com',
-        'vimeo.com',
-        'twitch.tv',
-    ]
+    # ذخیره‌سازی (ژورنال افزایشی به جای بازنویسی کامل فایل‌ها)
+    JOURNAL_ENABLED = os.getenv('JOURNAL_ENABLED', '1') == '1'
+    JOURNAL_COMPACT_THRESHOLD = int(os.getenv('JOURNAL_COMPACT_THRESHOLD', 5000))
+    # fsync هر رکورد/دسته ژورنال (0: سریع‌تر، با خطر از دست رفتن آخرین تغییرات در قطع برق)
+    JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', '1') == '1'
+    FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', 5))
+    FLUSH_MAX_DIRTY = int(os.getenv('FLUSH_MAX_DIRTY', 500))
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')  # json, sqlite
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/bot.db')
+    
+    # دانلود در پردازه‌های جداگانه
+    DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', os.cpu_count() or 2))
+    DOWNLOAD_TIMEOUT = float(os.getenv('DOWNLOAD_TIMEOUT', 900))
+    DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', 'downloads')
+    PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', 60))
+    PROBE_WORKERS = int(os.getenv('PROBE_WORKERS', 2))
+    PROBE_CACHE_TTL = float(os.getenv('PROBE_CACHE_TTL', 1800))
+    DOWNLOAD_QUEUE_WORKERS = int(os.getenv('DOWNLOAD_QUEUE_WORKERS', DOWNLOAD_WORKERS))
+    DOWNLOAD_QUEUE_SIZE = int(os.getenv('DOWNLOAD_QUEUE_SIZE', 100))
+    MAX_DOWNLOADS_PER_USER = int(os.getenv('MAX_DOWNLOADS_PER_USER', 1))
+    
+    # نمایش پیشرفت دانلود (فاصله حداقل ویرایش پیام در هر گفتگو و حداقل تغییر درصد)
+    PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 3))
+    PROGRESS_MIN_PERCENT = float(os.getenv('PROGRESS_MIN_PERCENT', 5))
+    
+    # سرور Bot API محلی (ارسال فایل با مسیر روی دیسک و آپلود تا 2000MB)
+    BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '').rstrip('/')
+    BOT_API_LOCAL_MODE = os.getenv('BOT_API_LOCAL_MODE', '1' if BOT_API_BASE_URL else '0') == '1'
+    
+    # محدودیت آپلود Bot API و روش سازگار کردن فایل‌های بزرگ (fit, split, reencode)
+    UPLOAD_LIMIT = int(float(os.getenv('UPLOAD_LIMIT_MB', 2000 if BOT_API_LOCAL_MODE else 50)) * 1024 * 1024)
+    OVERSIZE_STRATEGY = os.getenv('OVERSIZE_STRATEGY', 'fit')
+    
+    # cache شناسه فایل‌های ارسال‌شده (ارسال مجدد بدون دانلود و آپلود)
+    FILE_CACHE_MAX_ENTRIES = int(os.getenv('FILE_CACHE_MAX_ENTRIES', 10000))
+    FILE_CACHE_TTL_DAYS = float(os.getenv('FILE_CACHE_TTL_DAYS', 30))
+    
+    # توکن‌های کوتاه دکمه‌های انتخاب کیفیت (به جای لینک در callback_data)
+    CALLBACK_TOKEN_TTL_HOURS = float(os.getenv('CALLBACK_TOKEN_TTL_HOURS', 24))
+    CALLBACK_TOKEN_PERSIST = os.getenv('CALLBACK_TOKEN_PERSIST', '1') == '1'
+    
+    # محدودیت پهنای باند کل (MB/s) و دانلودهای هم‌زمان هر پلتفرم (بخش bandwidth در config.json)
+    BANDWIDTH = FILE_CONFIG.get('bandwidth') or {}
+    
+    # کارهای دانلود ماندگار (ادامه پس از راه‌اندازی مجدد)
+    DOWNLOAD_MAX_ATTEMPTS = int(os.getenv('DOWNLOAD_MAX_ATTEMPTS', 3))
+    DOWNLOAD_JOBS_RETENTION_DAYS = float(os.getenv('DOWNLOAD_JOBS_RETENTION_DAYS', 7))
+    
+    # cache فایل‌های دانلود شده روی دیسک
+    MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', 'media_cache')
+    MEDIA_CACHE_MAX_BYTES = int(float(os.getenv('MEDIA_CACHE_MAX_GB', 5)) * 1024 ** 3)
+    MEDIA_CACHE_POLICY = os.getenv('MEDIA_CACHE_POLICY', 'lru')  # lru, lfu
+    
+    # وزن هر سطح اشتراک در صف دانلود (سهم نسبی از worker ها)
+    PRIORITY_WEIGHTS = {
+        "annual": 8,
+        "semi_annual": 6,
+        "quarterly": 4,
+        "monthly": 2,
+        "free": 1,
+    }
 
 
 # =========================
 # Data Models & Domain Logic
 # =========================
 
+class UserStatusCode(IntEnum):
+    """کد وضعیت کاربر (به جای رشته در هر رکورد)"""
+    FREE = 0
+    PREMIUM = 1
+
+
+def _to_epoch(value) -> Optional[int]:
+    """تبدیل تاریخ ISO (یا عدد) به ثانیه epoch"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def _from_epoch(ts: Optional[int]) -> Optional[str]:
+    """تبدیل ثانیه epoch به تاریخ ISO"""
+    return datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+
 class User:
-    """مدل کاربر"""
+    """مدل کاربر
+    
+    برای مصرف کم حافظه در تعداد بالای کاربران: بدون __dict__ (slots)، نام‌های
+    intern‌شده، تاریخ‌ها به صورت عدد صحیح epoch و وضعیت به صورت کد enum.
+    join_date و premium_expiry برای سازگاری همچنان به صورت رشته ISO خوانده می‌شوند.
+    """
+    
+    __slots__ = ('id', 'username', 'first_name', 'last_name',
+                 'join_ts', 'status_code', 'download_count', 'premium_expiry_ts')
     
     def __init__(self, user_id: str, username: str, first_name: str, 
                  last_name: str = None):
-        self.id = user_id
-        self.username = username
-        self.first_name = first_name
-        self.last_name = last_name
-        self.join_date = datetime.now().isoformat()
-        self.status = "free"  # free, premium
+        # users.json قدیمی شناسه را به صورت عدد ذخیره کرده است؛ کلیدها همیشه رشته‌اند
+        self.id = str(user_id)
+        self.username = _intern(username)
+        self.first_name = _intern(first_name)
+        self.last_name = _intern(last_name)
+        self.join_ts = int(time.time())
+        self.status_code = UserStatusCode.FREE  # free, premium
         self.download_count = 0
-        self.premium_expiry = None
+        self.premium_expiry_ts = None
+    
+    @property
+    def join_date(self) -> str:
+        return _from_epoch(self.join_ts)
+    
+    @join_date.setter
+    def join_date(self, value):
+        self.join_ts = _to_epoch(value)
+    
+    @property
+    def premium_expiry(self) -> Optional[str]:
+        return _from_epoch(self.premium_expiry_ts)
+    
+    @premium_expiry.setter
+    def premium_expiry(self, value):
+        self.premium_expiry_ts = _to_epoch(value)
+    
+    @property
+    def status(self) -> str:
+        return self.status_code.name.lower()
+    
+    @status.setter
+    def status(self, value: Optional[str]):
+        # مقدار خالی یا ناشناخته در داده‌های قدیمی: کاربر رایگان
+        self.status_code = UserStatusCode.__members__.get(str(value or 'free').upper(), UserStatusCode.FREE)
     
     def to_dict(self):
         return {
@@ -186,84 +335,343 @@ class User:
             data['first_name'],
             data.get('last_name')
         )
-        user.join_date = data.get('join_date', user.join_date)
+        if data.get('join_date'):
+            user.join_date = data['join_date']
         user.status = data.get('status', 'free')
         user.download_count = data.get('download_count', 0)
         user.premium_expiry = data.get('premium_expiry')
         return user
     
     def is_premium(self):
-        if self.status != 'premium' or not self.premium_expiry:
+        # مقایسه مستقیم epoch بدون parse کردن تاریخ
+        if self.status_code != UserStatusCode.PREMIUM or not self.premium_expiry_ts:
             return False
-        expiry = datetime.fromisoformat(self.premium_expiry)
-        return datetime.now() < expiry
+        return time.time() < self.premium_expiry_ts
     
     def activate_premium(self, days: int):
-        self.status = 'premium'
-        self.premium_expiry = (datetime.now() + timedelta(days=days)).isoformat()
+        self.status_code = UserStatusCode.PREMIUM
+        self.premium_expiry_ts = int(time.time()) + days * 86400
 
 
 class DataManager:
     """مدیریت داده‌ها"""
     
-    def __init__(self, data_dir: Path):
+    COLLECTIONS = ('users', 'downloads', 'payments', 'premium_users', 'daily_downloads')
+    
+    def __init__(self, data_dir: Path, journal_enabled: bool = False,
+                 compact_threshold: int = 5000, storage: Optional[BaseStorage] = None,
+                 journal_fsync: bool = True):
         self.data_dir = data_dir
         self.data_dir.mkdir(exist_ok=True)
-        self.users = self._load_data("users.json", {})
+        self.storage = storage
+        self.json_store = JsonStore(data_dir)
+        self._lock = threading.Lock()
+        self._journal = None
+        
+        # write-behind: رکوردهای تغییرکرده (collection, key) -> آخرین مقدار
+        self._write_behind = False
+        self._dirty: Dict[Tuple[str, str], Any] = {}
+        self._on_dirty = None
+        
+        # فراخوانی پس از ذخیره هر کاربر پریمیوم (برای زمان‌بندی انقضا)
+        self._premium_listener: Optional[Callable[['User'], None]] = None
+        
+        # آمار افزایشی سیستم (یک بار هنگام بارگذاری محاسبه و سپس با هر رویداد به‌روز می‌شود)
+        self.stats = StatsCounters()
+        self._premium_ids: Set[str] = set()
+        
+        # با storage داده‌ها در حافظه بارگذاری نمی‌شوند و فقط کاربران استفاده‌شده cache می‌شوند
+        if storage is not None:
+            self._migrate_json_to_storage()
+            self.downloads, self.payments, self.premium_users = {}, {}, {}
+            self.daily_downloads = {}
+            self._users_objs = {}
+            self._rebuild_stats()
+            return
+        
+        # دیکشنری خام کاربران فقط تا ساخت اشیای User نگه داشته می‌شود
+        users = self._load_data("users.json", {})
         self.downloads = self._load_data("downloads.json", {})
         self.payments = self._load_data("payments.json", {})
         self.premium_users = self._load_data("premium_users.json", {})
+        # تعداد دانلودهای هر روز (روز -> تعداد)؛ زمان دانلودها در رکورد کاربر ذخیره نمی‌شود
+        self.daily_downloads = self._load_data("daily_downloads.json", {})
+        
+        # ژورنال افزایشی: هر تغییر یک خط، snapshot فقط هنگام compaction
+        replayed = 0
+        if journal_enabled:
+            self._journal = JournalStore(data_dir, compact_threshold=compact_threshold,
+                                         fsync=journal_fsync)
+            replayed = self._journal.replay({
+                'users': users,
+                'downloads': self.downloads,
+                'payments': self.payments,
+                'premium_users': self.premium_users,
+                'daily_downloads': self.daily_downloads,
+            })
         
         # Convert dicts to User objects
         self._users_objs = {}
-        for user_id, user_data in self.users.items():
+        for user_id, user_data in users.items():
             try:
-                self._users_objs[user_id] = User.from_dict(user_data)
-            except:
-                pass
+                user = User.from_dict(user_data)
+                self._users_objs[user.id] = user
+            except Exception as e:
+                logger.error(f"خطا در بارگذاری کاربر {user_id}: {e}")
+        del users
+        self._rebuild_stats()
+        
+        if replayed:
+            logger.info(f"📒 {replayed} رکورد از ژورنال بازیابی شد")
+            self.save_all()
+    
+    def _rebuild_stats(self):
+        """محاسبه کامل آمار با یک پیمایش (فقط هنگام راه‌اندازی)"""
+        self.stats.reset()
+        self._premium_ids.clear()
+        for user in self._iter_users():
+            self.stats.add('users', ts=user.join_ts)
+            # مجموع از رکورد کاربران؛ bucket های روزانه از daily_downloads بازیابی می‌شوند
+            self.stats.add('downloads', user.download_count, daily=False)
+            if user.status_code == UserStatusCode.PREMIUM:
+                self._premium_ids.add(user.id)
+        self.stats.totals['premium_users'] = len(self._premium_ids)
+        
+        daily_downloads = (self.daily_downloads.items() if self.storage is None
+                           else self.storage.iter_all('daily_downloads'))
+        for day, count in daily_downloads:
+            self.stats.restore_day('downloads', day, count)
+        
+        for user_payments in self._iter_payments():
+            for payment in user_payments:
+                ts = _to_epoch(payment.get('date'))
+                self.stats.add('payments', ts=ts)
+                self.stats.add('revenue', payment.get('amount', 0), ts=ts)
+    
+    def _migrate_json_to_storage(self):
+        """انتقال یک‌باره فایل‌های JSON قدیمی به storage"""
+        if self.storage.count('users') > 0:
+            return
+        
+        with self.storage.batch():
+            for collection in self.COLLECTIONS:
+                data = self._load_data(f"{collection}.json", {})
+                if data:
+                    self.storage.put_many(collection, {str(k): v for k, v in data.items()})
+                    logger.info(f"🗄️ {len(data)} رکورد {collection} به storage منتقل شد")
     
     def _load_data(self, filename: str, default=None):
         try:
-            file_path = self.data_dir / filename
-            if file_path.exists():
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            data = self.json_store.load(filename)
+            if data is not None:
+                return data
         except Exception as e:
             logger.error(f"خطا در بارگذاری {filename}: {e}")
         return default if default is not None else {}
     
     def _save_data(self, filename: str, data):
         try:
-            file_path = self.data_dir / filename
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.json_store.save(filename, data)
         except Exception as e:
             logger.error(f"خطا در ذخیره {filename}: {e}")
     
-    def save_all(self):
-        """ذخیره تمام داده‌ها"""
+    def _snapshot(self) -> Dict[str, Dict]:
+        """ساخت snapshot کامل داده‌ها (روی thread حلقه رویداد اجرا شود)"""
         # Convert User objects back to dicts
-        self.users = {uid: user.to_dict() for uid, user in self._users_objs.items()}
+        # کپی عمیق: رکوردها پس از تحویل به thread نوشتن در حلقه رویداد تغییر می‌کنند
+        return {
+            'users': {uid: user.to_dict() for uid, user in self._users_objs.items()},
+            'downloads': copy.deepcopy(self.downloads),
+            'payments': copy.deepcopy(self.payments),
+            'premium_users': copy.deepcopy(self.premium_users),
+            'daily_downloads': dict(self.daily_downloads),
+        }
+    
+    def _write_snapshot(self, snapshot: Dict[str, Dict]):
+        """نوشتن snapshot و خالی کردن ژورنال"""
+        for collection, data in snapshot.items():
+            self._save_data(f"{collection}.json", data)
+        if self._journal:
+            self._journal.reset()
+    
+    def save_all(self):
+        """ذخیره تمام داده‌ها (snapshot کامل و خالی کردن ژورنال)"""
+        if self.storage is not None:
+            # تغییرات به صورت مستقیم در storage نوشته می‌شوند
+            self.flush()
+            return
         
-        self._save_data("users.json", self.users)
-        self._save_data("downloads.json", self.downloads)
-        self._save_data("payments.json", self.payments)
-        self._save_data("premium_users.json", self.premium_users)
+        # snapshot شامل تمام تغییرات معلق هم هست
+        self._dirty = {}
+        snapshot = self._snapshot()
+        with self._lock:
+            self._write_snapshot(snapshot)
         logger.debug("💾 داده‌ها ذخیره شدند")
     
+    def compact(self):
+        """compaction دوره‌ای: نوشتن snapshot فقط در صورت وجود تغییر"""
+        if self._journal and self._journal.entries == 0 and not self._dirty:
+            return
+        self.save_all()
+    
+    def enable_write_behind(self, on_dirty: Callable[[int], None] = None):
+        """فعال‌سازی write-behind: تغییرات فقط علامت‌گذاری و بعداً یک‌جا نوشته می‌شوند"""
+        self._write_behind = True
+        self._on_dirty = on_dirty
+    
+    def enable_expiry_tracking(self, listener: Callable[[User], None]):
+        """ثبت شنونده تغییرات کاربران پریمیوم"""
+        self._premium_listener = listener
+    
+    @property
+    def pending_count(self) -> int:
+        """تعداد رکوردهای تغییرکرده‌ی ذخیره‌نشده"""
+        return len(self._dirty)
+    
+    def _serialize(self, value):
+        """کپی مستقل رکورد برای نوشتن (پرداخت‌ها و اشتراک‌ها همان اشیای زنده حافظه هستند)"""
+        return value.to_dict() if isinstance(value, User) else copy.deepcopy(value)
+    
+    def _changed(self, collection: str, key: str, value):
+        """ثبت تغییر یک رکورد (فوری یا با تأخیر در حالت write-behind)"""
+        if self._write_behind:
+            self._dirty[(collection, key)] = value
+            if self._on_dirty:
+                self._on_dirty(len(self._dirty))
+            return
+        self._record(collection, key, self._serialize(value))
+    
+    def _record(self, collection: str, key: str, value):
+        """ثبت یک تغییر در storage یا ژورنال"""
+        if self.storage is not None:
+            self.storage.put(collection, key, value)
+        elif self._journal:
+            with self._lock:
+                self._journal.append(collection, key, value)
+    
+    def _commit(self):
+        """پایان یک تغییر: بدون ژورنال ذخیره کامل، با ژورنال فقط در صورت نیاز"""
+        if self.storage is not None or self._write_behind:
+            return
+        if self._journal is None or self._journal.needs_compaction():
+            self.save_all()
+    
+    def collect_changes(self) -> Optional[Tuple[List[Tuple[str, str, Any]], Optional[Dict]]]:
+        """جمع‌آوری تغییرات معلق برای نوشتن (روی thread حلقه رویداد اجرا شود)
+        
+        خروجی فقط شامل داده‌های سریال‌شده است تا نوشتن آن در thread دیگر امن باشد.
+        """
+        if not self._dirty:
+            return None
+        
+        dirty, self._dirty = self._dirty, {}
+        records = [(c, k, self._serialize(v)) for (c, k), v in dirty.items()]
+        
+        # بدون ژورنال (یا با رسیدن ژورنال به حد compaction) snapshot کامل نوشته می‌شود
+        snapshot = None
+        if self.storage is None:
+            if (self._journal is None or
+                    self._journal.entries + len(records) >= self._journal.compact_threshold):
+                snapshot = self._snapshot()
+        return records, snapshot
+    
+    def write_changes(self, changes: Tuple[List[Tuple[str, str, Any]], Optional[Dict]]):
+        """نوشتن تغییرات جمع‌آوری‌شده (قابل اجرا خارج از حلقه رویداد)"""
+        records, snapshot = changes
+        with self._lock:
+            if snapshot is not None:
+                self._write_snapshot(snapshot)
+            elif self.storage is not None:
+                with self.storage.batch():
+                    for collection, key, value in records:
+                        self.storage.put(collection, key, value)
+            else:
+                self._journal.append_many(records)
+        logger.debug(f"💾 {len(records)} رکورد تغییرکرده ذخیره شد")
+    
+    def restore_changes(self, changes: Tuple[List[Tuple[str, str, Any]], Optional[Dict]]):
+        """بازگرداندن تغییرات به صف پس از خطای نوشتن (تغییرات جدیدتر حفظ می‌شوند)"""
+        records, _ = changes
+        for collection, key, value in records:
+            self._dirty.setdefault((collection, key), value)
+    
+    def flush(self):
+        """نوشتن فوری و همگام تغییرات معلق (برای توقف بات)"""
+        changes = self.collect_changes()
+        if changes:
+            self.write_changes(changes)
+    
     def get_user(self, user_id: str) -> Optional[User]:
         """دریافت کاربر"""
-        return self._users_objs.get(str(user_id))
+        user_id = str(user_id)
+        user = self._users_objs.get(user_id)
+        if user is None and self.storage is not None:
+            data = self.storage.get('users', user_id)
+            if data:
+                user = User.from_dict(data)
+                self._users_objs[user_id] = user
+        return user
+    
+    def count_users(self) -> int:
+        """تعداد کاربران"""
+        if self.storage is not None:
+            return self.storage.count('users')
+        return len(self._users_objs)
+    
+    def _iter_users(self):
+        """پیمایش کاربران (با storage بدون بارگذاری همه در حافظه)"""
+        if self.storage is None:
+            yield from self._users_objs.values()
+            return
+        for user_id, data in self.storage.iter_all('users'):
+            user = self._users_objs.get(user_id)
+            yield user if user is not None else User.from_dict(data)
+    
+    def iter_premium_users(self):
+        """پیمایش کاربران با وضعیت پریمیوم (با storage از ایندکس status)"""
+        if self.storage is None:
+            for user in self._users_objs.values():
+                if user.status_code == UserStatusCode.PREMIUM:
+                    yield user
+            return
+        for user_id, data in self.storage.find('users', 'status', 'premium'):
+            user = self._users_objs.get(user_id)
+            yield user if user is not None else User.from_dict(data)
+    
+    def _iter_payments(self):
+        """پیمایش لیست پرداخت‌های هر کاربر"""
+        if self.storage is None:
+            yield from self.payments.values()
+            return
+        for _, user_payments in self.storage.iter_all('payments'):
+            yield user_payments
     
     def create_user(self, user: User):
         """ایجاد کاربر جدید"""
         self._users_objs[str(user.id)] = user
-        self.save_all()
+        self._changed('users', str(user.id), user)
+        self._commit()
+        self.stats.add('users', ts=user.join_ts)
+        self._track_premium(user)
     
     def update_user(self, user: User):
         """به‌روزرسانی کاربر"""
         self._users_objs[str(user.id)] = user
-        self.save_all()
+        self._changed('users', str(user.id), user)
+        self._commit()
+        self._track_premium(user)
+    
+    def _track_premium(self, user: User):
+        premium = user.status_code == UserStatusCode.PREMIUM
+        if premium != (user.id in self._premium_ids):
+            if premium:
+                self._premium_ids.add(user.id)
+            else:
+                self._premium_ids.discard(user.id)
+            self.stats.totals['premium_users'] = len(self._premium_ids)
+        
+        if self._premium_listener and premium:
+            self._premium_listener(user)
     
     def get_download_count(self, user_id: str) -> int:
         """تعداد دانلودهای کاربر"""
@@ -275,14 +683,33 @@ class DataManager:
         user = self.get_user(user_id)
         if user:
             user.download_count += 1
+            self.stats.add('downloads')
+            # شمارنده امروز هم ذخیره می‌شود تا پس از راه‌اندازی مجدد صفر نشود
+            today = datetime.now().date().isoformat()
+            count = self.stats.day(today)['downloads']
+            self.daily_downloads[today] = count
+            self._changed('daily_downloads', today, count)
             self.update_user(user)
     
-    def add_payment(self, user_id: str, plan_name: str, amount: float, txid: str):
+    def get_premium_record(self, user_id: str) -> Optional[Dict]:
+        """اطلاعات اشتراک کاربر (طرح، تاریخ فعال‌سازی و انقضا)"""
+        # اشتراک‌های ثبت‌شده در این اجرا (حتی با storage) در حافظه هستند
+        premium = self.premium_users.get(user_id)
+        if premium is None and self.storage is not None:
+            premium = self.storage.get('premium_users', user_id)
+        return premium
+    
+    def add_payment(self, user_id: str, plan_name: str, amount: float, txid: str,
+                    plan_id: str = None):
         """افزودن پرداخت"""
-        if user_id not in self.payments:
-            self.payments[user_id] = []
-        
-        self.payments[user_id].append({
+        # با storage هم لیست پرداخت‌های کاربر پس از اولین خواندن در حافظه می‌ماند؛
+        # خواندن دوباره از storage ممکن است تغییر جمع‌آوری‌شده‌ی هنوز نوشته‌نشده را نبیند
+        user_payments = self.payments.get(user_id)
+        if user_payments is None:
+            stored = self.storage.get('payments', user_id) if self.storage is not None else None
+            user_payments = self.payments[user_id] = stored or []
+        
+        user_payments.append({
             'plan': plan_name,
             'amount': amount,
             'txid': txid,
@@ -291,42 +718,190 @@ class DataManager:
         })
         
         # افزودن به پریمیوم
-        self.premium_users[user_id] = {
+        premium = {
             'plan': plan_name,
+            'plan_id': plan_id,
             'activated': datetime.now().isoformat(),
             'expiry': (datetime.now() + timedelta(days=30)).isoformat()
         }
+        # با storage هم cache حافظه به‌روز می‌شود
+        self.premium_users[user_id] = premium
         
-        self.save_all()
+        self._changed('payments', user_id, user_payments)
+        self._changed('premium_users', user_id, premium)
+        self._commit()
+        self.stats.add('payments')
+        self.stats.add('revenue', amount)
     
     def get_system_stats(self) -> Dict:
-        """دریافت آمار سیستم"""
-        total_users = len(self._users_objs)
-        premium_users = sum(1 for u in self._users_objs.values() if u.is_premium())
-        total_downloads = sum(u.download_count for u in self._users_objs.values())
-        total_payments = sum(len(p) for p in self.payments.values())
-        
-        # درآمد کل
-        total_revenue = 0
-        for user_payments in self.payments.values():
-            for payment in user_payments:
-                total_revenue += payment.get('amount', 0)
-        
-        # کاربران امروز
-        today = datetime.now().date().isoformat()
-        today_users = sum(
-            1 for user in self._users_objs.values()
-            if datetime.fromisoformat(user.join_date).date().isoformat() == today
-        )
+        """دریافت آمار سیستم (از شمارنده‌های افزایشی، بدون پیمایش داده‌ها)"""
+        return self.stats.snapshot()
+
+
+class WriteBehindFlusher:
+    """نوشتن تأخیری (write-behind) تغییرات DataManager
+    
+    تغییرات پشت سر هم روی یک رکورد در حافظه ادغام می‌شوند و هر interval ثانیه
+    (یا با رسیدن تعداد رکوردهای تغییرکرده به max_dirty) یک‌جا و خارج از
+    حلقه رویداد نوشته می‌شوند.
+    """
+    
+    def __init__(self, data_manager: DataManager, interval: float = 5.0, max_dirty: int = 500):
+        self.data_manager = data_manager
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.flush_count = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def notify(self, dirty_count: int):
+        """فراخوانی پس از هر تغییر؛ با رسیدن به آستانه، نوشتن زودتر انجام می‌شود"""
+        if dirty_count >= self.max_dirty and self._wakeup is not None:
+            self._wakeup.set()
+    
+    def start(self):
+        """شروع حلقه نوشتن (باید داخل حلقه رویداد فراخوانی شود)"""
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"💾 write-behind فعال شد (هر {self.interval} ثانیه یا {self.max_dirty} تغییر)")
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self):
+        """نوشتن تغییرات معلق در executor"""
+        async with self._flush_lock:
+            changes = self.data_manager.collect_changes()
+            if changes is None:
+                return
+            
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.data_manager.write_changes, changes)
+                self.flush_count += 1
+            except Exception as e:
+                logger.error(f"خطا در ذخیره تغییرات: {e}")
+                self.data_manager.restore_changes(changes)
+    
+    async def stop(self):
+        """توقف حلقه و نوشتن تغییرات باقی‌مانده"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+        else:
+            self.data_manager.flush()
+
+
+class PremiumExpiryScheduler:
+    """زمان‌بندی انقضای اشتراک‌های پریمیوم
+    
+    زمان انقضا (epoch) هر کاربر پریمیوم در یک heap نگه داشته می‌شود و حلقه
+    فقط تا نزدیک‌ترین انقضا می‌خوابد. در زمان انقضا وضعیت کاربر به رایگان
+    برمی‌گردد و در صورت تعریف notify به او اطلاع داده می‌شود.
+    """
+    
+    def __init__(self, data_manager: DataManager,
+                 notify: Callable[[User], Awaitable[None]] = None):
+        self.data_manager = data_manager
+        self.notify = notify
+        self.expired_count = 0
+        # (زمان انقضا، شماره ترتیب، شناسه کاربر)؛ شماره ترتیب از مقایسه شناسه‌ها جلوگیری می‌کند
+        self._heap: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        # آخرین زمان انقضای زمان‌بندی‌شده هر کاربر (ورودی‌های قدیمی heap نادیده گرفته می‌شوند)
+        self._scheduled: Dict[str, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def load(self):
+        """زمان‌بندی تمام کاربران پریمیوم موجود"""
+        for user in self.data_manager.iter_premium_users():
+            self.schedule(user)
+        logger.info(f"⏰ {len(self._scheduled)} اشتراک پریمیوم زمان‌بندی شد")
+    
+    def schedule(self, user: User):
+        """زمان‌بندی (یا به‌روزرسانی) انقضای یک کاربر"""
+        expiry_ts = user.premium_expiry_ts
+        if user.status_code != UserStatusCode.PREMIUM or not expiry_ts:
+            return
+        user_id = str(user.id)
+        if self._scheduled.get(user_id) == expiry_ts:
+            return
         
-        return {
-            'total_users': total_users,
-            'premium_users': premium_users,
-            'total_downloads': total_downloads,
-            'total_payments': total_payments,
-            'total_revenue': total_revenue,
-            'today_users': today_users
-        }
+        self._scheduled[user_id] = expiry_ts
+        heapq.heappush(self._heap, (expiry_ts, next(self._seq), user_id))
+        # انقضای جدید زودتر از نوبت فعلی است؛ حلقه باید بیدار شود
+        if self._wakeup is not None and self._heap[0][2] == user_id:
+            self._wakeup.set()
+    
+    def expire_due(self, now: float = None) -> List[User]:
+        """برگرداندن کاربران منقضی‌شده به وضعیت رایگان"""
+        now = time.time() if now is None else now
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expiry_ts, _seq, user_id = heapq.heappop(self._heap)
+            if self._scheduled.get(user_id) != expiry_ts:
+                continue
+            del self._scheduled[user_id]
+            
+            user = self.data_manager.get_user(user_id)
+            if (user is None or user.status_code != UserStatusCode.PREMIUM or
+                    user.premium_expiry_ts != expiry_ts):
+                continue
+            
+            user.status_code = UserStatusCode.FREE
+            self.data_manager.update_user(user)
+            expired.append(user)
+        
+        if expired:
+            self.expired_count += len(expired)
+            logger.info(f"⌛ اشتراک {len(expired)} کاربر منقضی شد")
+        return expired
+    
+    def start(self):
+        """شروع حلقه زمان‌بندی (باید داخل حلقه رویداد فراخوانی شود)"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self):
+        while True:
+            timeout = max(0, self._heap[0][0] - time.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            for user in self.expire_due():
+                if self.notify is None:
+                    continue
+                try:
+                    await self.notify(user)
+                except Exception as e:
+                    logger.warning(f"خطا در اطلاع‌رسانی انقضا به {user.id}: {e}")
+    
+    async def stop(self):
+        """توقف حلقه"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
 
 
 # =========================
@@ -361,17 +936,8 @@ class BaseController:
         return ReplyKeyboardMarkup([["❌ لغو"]], resize_keyboard=True)
     
     def is_valid_url(self, url: str) -> bool:
-        """بررسی اعتبار URL"""
-        url_lower = url.lower().strip()
-        
-        if not re.match(r'^https?://', url_lower):
-            return False
-        
-        for platform in self.config.SUPPORTED_PLATFORMS:
-            if platform in url_lower:
-                return True
-        
-        return False
+        """بررسی اعتبار URL (لینک http یا https با دامنه یک پلتفرم پشتیبانی شده)"""
+        return match_platform(url) is not None
     
     def validate_txid(self, txid: str) -> bool:
         """اعتبارسنجی TXID"""
@@ -471,8 +1037,8 @@ class UserController(BaseController):
 
 📊 **وضعیت:** {status}"""
         
-        if user_obj.premium_expiry:
-            expiry = datetime.fromisoformat(user_obj.premium_expiry)
+        if user_obj.premium_expiry_ts:
+            expiry = datetime.fromtimestamp(user_obj.premium_expiry_ts)
             text += f"\n📅 انقضا: {expiry.strftime('%Y-%m-%d')}"
         
         remaining = max(0, self.config.MAX_FREE_DOWNLOADS - user_obj.download_count)
@@ -505,6 +1071,24 @@ class UserController(BaseController):
         await self.profile(update, context)
 
 
+class ResumedQuery:
+    """جایگزین CallbackQuery برای کارهایی که پس از راه‌اندازی مجدد ادامه می‌یابند
+    
+    فقط بخش‌هایی که مسیر دانلود استفاده می‌کند (from_user، message و
+    edit_message_text) پیاده‌سازی شده‌اند.
+    """
+    
+    def __init__(self, bot, chat_id: int, message_id: int, user_id: str):
+        self._bot = bot
+        self.from_user = SimpleNamespace(id=int(user_id))
+        self.message = SimpleNamespace(chat_id=chat_id, message_id=message_id)
+    
+    async def edit_message_text(self, text: str, **kwargs):
+        return await self._bot.edit_message_text(
+            text, chat_id=self.message.chat_id, message_id=self.message.message_id, **kwargs
+        )
+
+
 class DownloadController(BaseController):
     """کنترلر دانلود"""
     
@@ -520,6 +1104,90 @@ class DownloadController(BaseController):
             'no_warnings': True,
             'extract_flat': False,
         }
+        
+        # محدودیت پهنای باند کل و دانلودهای هم‌زمان هر پلتفرم (config.json)
+        self.bandwidth = BandwidthGovernor.from_config(config.BANDWIDTH)
+        
+        # صف دانلود: تعداد دانلودهای هم‌زمان و سهم هر کاربر و هر پلتفرم محدود است
+        self.queue = DownloadQueue(
+            workers=config.DOWNLOAD_QUEUE_WORKERS,
+            max_size=config.DOWNLOAD_QUEUE_SIZE,
+            per_user_limit=config.MAX_DOWNLOADS_PER_USER,
+            weights=config.PRIORITY_WEIGHTS,
+            governor=self.bandwidth
+        )
+        
+        # فایل‌های قبلاً ارسال‌شده با file_id دوباره ارسال می‌شوند
+        self.file_cache = FileIdCache(
+            data_manager.data_dir,
+            max_entries=config.FILE_CACHE_MAX_ENTRIES,
+            ttl=config.FILE_CACHE_TTL_DAYS * 86400
+        )
+        
+        # لینک و اطلاعات آن با توکن کوتاه در callback_data دکمه‌ها (حداکثر 64 بایت)
+        self.callbacks = CallbackStore(
+            data_manager.data_dir if config.CALLBACK_TOKEN_PERSIST else None,
+            ttl=config.CALLBACK_TOKEN_TTL_HOURS * 3600
+        )
+        
+        # فایل‌های دانلود شده روی دیسک نگه داشته می‌شوند (ارسال مجدد و تلاش دوباره بدون دانلود)
+        self.media_cache = MediaCache(
+            Path(config.MEDIA_CACHE_DIR),
+            max_bytes=config.MEDIA_CACHE_MAX_BYTES,
+            policy=config.MEDIA_CACHE_POLICY
+        )
+        
+        # اجرای yt-dlp در پردازه‌های جداگانه تا حلقه رویداد مسدود نشود
+        self.executor = DownloadExecutor(
+            max_workers=config.DOWNLOAD_WORKERS,
+            timeout=config.DOWNLOAD_TIMEOUT,
+            output_root=Path(config.DOWNLOAD_DIR),
+            probe_timeout=config.PROBE_TIMEOUT,
+            probe_workers=config.PROBE_WORKERS,
+            governor=self.bandwidth
+        )
+        
+        # اطلاعات واقعی لینک (یک بار استخراج و در دانلود دوباره استفاده می‌شود)
+        self.probe = MetadataProbe(self.executor, self.ydl_opts, ttl=config.PROBE_CACHE_TTL)
+        
+        # انتخاب فرمت متناسب با محدودیت آپلود و تقسیم/تبدیل فایل‌های بزرگ
+        self.converter = FormatConverter(
+            upload_limit=config.UPLOAD_LIMIT,
+            strategy=config.OVERSIZE_STRATEGY,
+            work_root=Path(config.DOWNLOAD_DIR)
+        )
+        
+        # درخواست‌های هم‌زمان یک لینک و کیفیت فقط یک بار دانلود و آپلود می‌شوند
+        self.inflight = SingleFlight()
+        # گفتگوهای منتظر هر دانلود مشترک به ترتیب اتصال (فایل برای اولین منتظر باقی‌مانده آپلود می‌شود)
+        self._recipients: Dict[Tuple[str, str], List[int]] = {}
+        
+        # کارهای دانلود ماندگار (جدا از downloads.json داده‌های بات)
+        self.jobs = DownloadRepository(data_manager.data_dir / "jobs")
+        # شناسه کار صف -> شناسه رکورد دانلود
+        self._job_records: Dict[str, str] = {}
+        # هنگام توقف بات، فایل‌های .part برای ادامه دانلود نگه داشته می‌شوند
+        self.stopping = False
+        
+        # پیام‌های وضعیت منتظر پیشرفت هر دانلود در جریان
+        self.progress_throttle = ChatThrottle(config.PROGRESS_EDIT_INTERVAL)
+        self._progress: Dict[Tuple[str, str], Set[ProgressReporter]] = {}
+    
+    def get_user_tier(self, user_id: str) -> str:
+        """سطح کاربر در صف دانلود (شناسه طرح اشتراک فعال یا free)"""
+        user = self.data_manager.get_user(user_id)
+        if not user or not user.is_premium():
+            return "free"
+        
+        record = self.data_manager.get_premium_record(user_id) or {}
+        plan_id = record.get('plan_id')
+        if plan_id in self.config.PLANS:
+            return plan_id
+        # رکوردهای قدیمی فقط نام طرح را دارند
+        for plan_id, plan in self.config.PLANS.items():
+            if plan['name'] == record.get('plan'):
+                return plan_id
+        return "monthly"
     
     def can_user_download(self, user_id: str) -> Tuple[bool, str]:
         """بررسی امکان دانلود کاربر"""
@@ -587,96 +1255,253 @@ class DownloadController(BaseController):
             )
             return ConversationHandler.END
         
-        # افزایش تعداد دانلودها
-        self.data_manager.increment_downloads(user_id)
+        status_message = await update.message.reply_text("🔍 در حال بررسی لینک...")
+        
+        if not self.config.ENABLE_REAL_DOWNLOAD:
+            # شبیه‌سازی بررسی لینک
+            self.data_manager.increment_downloads(user_id)
+            await asyncio.sleep(1)
+            await status_message.edit_text(
+                "✅ **ویدئو یافت شد!**\n\n"
+                "👇 لطفاً کیفیت مورد نظر را انتخاب کنید:",
+                reply_markup=self._quality_keyboard(
+                    self.callbacks.put(url, user_id), dict.fromkeys(self.QUALITY_LABELS)
+                ),
+                parse_mode='Markdown'
+            )
+            return ConversationHandler.END
         
-        # شبیه‌سازی بررسی لینک
-        await update.message.reply_text("🔍 در حال بررسی لینک...")
-        await asyncio.sleep(1)
+        try:
+            media = await self.probe.probe(url)
+        except Exception as e:
+            logger.warning(f"خطا در بررسی لینک {url}: {e}")
+            await status_message.edit_text(
+                "❌ **اطلاعات این لینک دریافت نشد.**\n\n"
+                "ممکن است ویدئو خصوصی، حذف‌شده یا در دسترس نباشد.",
+                parse_mode='Markdown'
+            )
+            return ConversationHandler.END
         
-        # کیبورد انتخاب کیفیت
-        keyboard = [
-            [
-                InlineKeyboardButton("📹 360p", callback_data=f"quality_360_{url}"),
-                InlineKeyboardButton("📹 480p", callback_data=f"quality_480_{url}")
-            ],
-            [
-                InlineKeyboardButton("📹 720p (HD)", callback_data=f"quality_720_{url}"),
-                InlineKeyboardButton("📹 1080p (FHD)", callback_data=f"quality_1080_{url}")
-            ],
-            [
-                InlineKeyboardButton("🎵 MP3", callback_data=f"quality_mp3_{url}"),
-                InlineKeyboardButton("🎵 MP4", callback_data=f"quality_mp4_{url}")
-            ],
-            [InlineKeyboardButton("❌ لغو", callback_data="cancel_download")]
-        ]
+        if not media['qualities']:
+            await status_message.edit_text("❌ فرمت قابل دانلودی برای این لینک یافت نشد.")
+            return ConversationHandler.END
         
-        await update.message.reply_text(
-            "✅ **ویدئو یافت شد!**\n\n"
+        # افزایش تعداد دانلودها (فقط برای لینک‌های معتبر)
+        self.data_manager.increment_downloads(user_id)
+        
+        await status_message.edit_text(
+            f"✅ **ویدئو یافت شد!**\n\n"
+            f"📽️ **عنوان:** {escape_markdown(media['title'])}\n"
+            f"⏱️ **مدت:** {format_duration(media['duration'])}\n\n"
             "👇 لطفاً کیفیت مورد نظر را انتخاب کنید:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._quality_keyboard(
+                self.callbacks.put(url, user_id, media['qualities']), media['qualities']
+            ),
             parse_mode='Markdown'
         )
         
         return ConversationHandler.END
     
+    # برچسب دکمه‌های کیفیت به ترتیب نمایش
+    QUALITY_LABELS = {
+        "360": "📹 360p",
+        "480": "📹 480p",
+        "720": "📹 720p (HD)",
+        "1080": "📹 1080p (FHD)",
+        "mp3": "🎵 MP3",
+        "mp4": "🎵 MP4",
+    }
+    
+    # نام کیفیت در پیام‌های وضعیت
+    QUALITY_TEXTS = {
+        "360": "360p",
+        "480": "480p",
+        "720": "720p (HD)",
+        "1080": "1080p (Full HD)",
+        "mp3": "MP3",
+        "mp4": "MP4",
+    }
+    
+    def _quality_keyboard(self, token: str, qualities: Dict[str, Optional[float]]) -> InlineKeyboardMarkup:
+        """کیبورد انتخاب کیفیت (فقط کیفیت‌های موجود، با حجم تخمینی)
+        
+        callback_data به شکل quality_{کیفیت}_{توکن} است؛ لینک از CallbackStore خوانده می‌شود.
+        """
+        buttons = []
+        for quality, label in self.QUALITY_LABELS.items():
+            if quality not in qualities:
+                continue
+            if qualities[quality]:
+                label += f" ~{format_size(qualities[quality])}"
+            buttons.append(InlineKeyboardButton(label, callback_data=f"quality_{quality}_{token}"))
+        
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        keyboard.append([InlineKeyboardButton("❌ لغو", callback_data="cancel_download")])
+        return InlineKeyboardMarkup(keyboard)
+    
     async def select_quality(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """انتخاب کیفیت"""
         query = update.callback_query
-        await query.answer()
         
-        # استخراج کیفیت و URL از callback_data
-        data_parts = query.data.split('_')
-        quality = data_parts[1]  # 360, 480, 720, 1080, mp3, mp4
-        url = '_'.join(data_parts[2:])  # URL اصلی
+        # استخراج کیفیت و توکن از callback_data (quality_{کیفیت}_{توکن})
+        _prefix, quality, token = query.data.split('_', 2)
+        entry = self.callbacks.get(token)
+        if entry is None:
+            await query.answer(
+                "⌛ این دکمه منقضی شده است. لطفاً لینک را دوباره ارسال کنید.", show_alert=True
+            )
+            return
+        if entry['user_id'] != str(query.from_user.id):
+            await query.answer("⚠️ این دکمه مربوط به درخواست کاربر دیگری است.", show_alert=True)
+            return
+        
+        url = entry['url']
+        if entry['qualities'] is not None and quality not in entry['qualities']:
+            await query.answer("⚠️ این کیفیت برای این لینک موجود نیست.", show_alert=True)
+            return
+        
+        quality_text = self.QUALITY_TEXTS.get(quality, "پیش‌فرض")
+        
+        # فایل قبلاً ارسال شده است؛ بدون دانلود و آپلود دوباره ارسال می‌شود
+        cached = self.file_cache.get(url, quality)
+        answered = False
+        if cached:
+            await query.answer()
+            answered = True
+            if await self._send_cached(query, context, url, quality, quality_text, cached):
+                return
+        
+        user_id = str(query.from_user.id)
+        job_id = self._job_id(query, quality)
+        
+        # رکورد ماندگار کار (برای ادامه پس از راه‌اندازی مجدد)
+        download_id = None
+        if self.config.ENABLE_REAL_DOWNLOAD:
+            download_id = self.jobs.create_download(
+                user_id, url, canonicalize(url).platform, quality=quality,
+                chat_id=query.message.chat_id, message_id=query.message.message_id
+            ).id
+            self._job_records[job_id] = download_id
+        
+        # کار دانلود به صف اضافه می‌شود و handler بلافاصله برمی‌گردد
+        job = DownloadJob(
+            id=job_id,
+            user_id=user_id,
+            run=lambda: self._run_download(query, context, url, quality, quality_text, download_id),
+            tier=self.get_user_tier(user_id),
+            host=self.bandwidth.host_key(url)
+        )
+        try:
+            # همین لینک و کیفیت در حال دانلود است؛ بدون گرفتن worker به همان دانلود متصل می‌شود
+            if self.config.ENABLE_REAL_DOWNLOAD and self.inflight.in_flight(self._flight_key(url, quality)):
+                self.queue.attach(job)
+                position = 0
+            else:
+                position = await self.queue.submit(job)
+        except UserLimitError:
+            self._discard_record(job_id)
+            # پیام انتخاب کیفیت حفظ می‌شود تا کاربر بعداً دوباره انتخاب کند
+            limit_text = "⚠️ دانلود قبلی شما هنوز در حال انجام است. لطفاً پس از پایان آن دوباره تلاش کنید."
+            if answered:
+                await query.edit_message_text(limit_text)
+            else:
+                await query.answer(limit_text, show_alert=True)
+            return
+        except QueueFullError:
+            self._discard_record(job_id)
+            if not answered:
+                await query.answer()
+            await query.edit_message_text(
+                "⚠️ **صف دانلود در حال حاضر پر است.**\n\n"
+                "لطفاً چند دقیقه دیگر دوباره تلاش کنید.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]
+                ]),
+                parse_mode='Markdown'
+            )
+            return
         
-        quality_text = {
-            "360": "360p",
-            "480": "480p",
-            "720": "720p (HD)",
-            "1080": "1080p (Full HD)",
-            "mp3": "MP3",
-            "mp4": "MP4"
-        }.get(quality, "پیش‌فرض")
+        if not answered:
+            await query.answer()
+        if position > 0:
+            eta_minutes = max(1, round(self.queue.estimate_wait(position) / 60))
+            await query.edit_message_text(
+                f"🕒 **در صف دانلود**\n\n"
+                f"📦 کیفیت: {quality_text}\n"
+                f"🔢 جایگاه شما: {position}\n"
+                f"⏱️ زمان تقریبی انتظار: {eta_minutes} دقیقه",
+                reply_markup=self._cancel_markup(),
+                parse_mode='Markdown'
+            )
+    
+    def _discard_record(self, job_id: str):
+        """حذف رکورد کاری که در صف پذیرفته نشد"""
+        download_id = self._job_records.pop(job_id, None)
+        if download_id:
+            self.jobs.delete_downloads([download_id])
+    
+    @staticmethod
+    def _job_id(query, quality: str) -> str:
+        """شناسه کار دانلود (کاربر، پیام وضعیت و کیفیت آن)"""
+        return f"{query.from_user.id}:{query.message.message_id}:{quality}"
+    
+    @staticmethod
+    def _cancel_markup() -> InlineKeyboardMarkup:
+        """دکمه لغو زیر پیام وضعیت دانلود"""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("❌ لغو دانلود", callback_data="cancel_download")]
+        ])
+    
+    async def _run_download(self, query, context: ContextTypes.DEFAULT_TYPE,
+                            url: str, quality: str, quality_text: str,
+                            download_id: Optional[str] = None):
+        """اجرای دانلود (توسط worker صف دانلود)
         
-        await query.edit_message_text(f"⏳ در حال دانلود با کیفیت {quality_text}...")
+        لغو از طریق cancel_download با لغو task این متد انجام می‌شود؛ CancelledError
+        تا پردازه yt-dlp، ffmpeg و آپلود منتقل می‌شود و فایل‌های موقت حذف می‌شوند.
+        وضعیت رکورد download_id در هر مرحله ذخیره می‌شود؛ کاری که با توقف ربات
+        قطع شود در وضعیت PROCESSING می‌ماند و در راه‌اندازی بعدی ادامه می‌یابد.
+        """
+        await query.edit_message_text(
+            f"⏳ در حال دانلود با کیفیت {quality_text}...",
+            reply_markup=self._cancel_markup()
+        )
         
         try:
             if self.config.ENABLE_REAL_DOWNLOAD:
-                # دانلود واقعی با yt-dlp
-                downloaded_file = await self._download_with_ytdlp(url, quality)
-                
-                if downloaded_file:
-                    # ارسال فایل به کاربر
-                    with open(downloaded_file, 'rb') as file:
-                        if quality in ['mp3', 'mp4']:
-                            await context.bot.send_document(
-                                chat_id=query.from_user.id,
-                                document=file,
-                                caption=f"✅ دانلود با کیفیت {quality_text} کامل شد!"
-                            )
-                        else:
-                            await context.bot.send_video(
-                                chat_id=query.from_user.id,
-                                video=file,
-                                caption=f"✅ دانلود با کیفیت {quality_text} کامل شد!"
-                            )
-                    
-                    # حذف فایل موقت
-                    os.remove(downloaded_file)
-                    
-                    await query.edit_message_text(
-                        f"✅ **دانلود کامل شد!**\n\n"
-                        f"📦 کیفیت: {quality_text}\n"
-                        f"📁 فرمت: {'MP3' if quality == 'mp3' else 'MP4' if quality == 'mp4' else 'ویدئو'}\n\n"
-                        "👇 برای دانلود دیگر:",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("📥 دانلود دیگر", callback_data="download_again")],
-                            [InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]
-                        ])
+                # دانلود واقعی با yt-dlp (درخواست‌های هم‌زمان یکسان یک بار اجرا می‌شوند)
+                chat_id = query.from_user.id
+                key = self._flight_key(url, quality)
+                cancel_markup = self._cancel_markup()
+                reporter = ProgressReporter(
+                    lambda text: query.edit_message_text(text, reply_markup=cancel_markup),
+                    chat_id, quality_text,
+                    self.progress_throttle, min_percent=self.config.PROGRESS_MIN_PERCENT
+                )
+                watchers = self._progress.setdefault(key, set())
+                watchers.add(reporter)
+                if download_id:
+                    self.jobs.start_download(download_id, output_dir=self._partial_dir(url, quality))
+                try:
+                    delivered = await self._deliver_shared(
+                        context, chat_id, url, quality, quality_text, download_id
                     )
-                else:
-                    raise Exception("خطا در دانلود فایل")
+                    
+                    # فایل برای کاربر دیگری آپلود شده است؛ با file_id ارسال می‌شود
+                    if delivered['chat_id'] != chat_id:
+                        await self._send_file_ids(
+                            context, chat_id, delivered['kind'], delivered['file_ids'], quality_text
+                        )
+                finally:
+                    watchers.discard(reporter)
+                    if not watchers and self._progress.get(key) is watchers:
+                        del self._progress[key]
+                    # پیام نهایی نباید با ویرایش پیشرفت دیرهنگام جایگزین شود
+                    await reporter.close()
+                
+                if download_id:
+                    self.jobs.complete_download(download_id, None, delivered.get('file_size'))
+                await self._send_done_message(query, quality, quality_text)
             else:
                 # شبیه‌سازی دانلود
                 await asyncio.sleep(3)
@@ -697,6 +1522,8 @@ class DownloadController(BaseController):
                 
         except Exception as e:
             logger.error(f"خطا در دانلود: {e}")
+            if download_id:
+                self.jobs.fail_download(download_id, str(e))
             await query.edit_message_text(
                 f"❌ **خطا در دانلود!**\n\n"
                 f"خطا: {str(e)[:100]}\n\n"
@@ -706,49 +1533,358 @@ class DownloadController(BaseController):
                     [InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]
                 ])
             )
-    
-    async def _download_with_ytdlp(self, url: str, quality: str) -> Optional[str]:
-        """دانلود واقعی با yt-dlp"""
+        finally:
+            # لغو توسط کاربر یا توقف ربات وضعیت رکورد را تغییر نمی‌دهد
+            if self._job_records.get(self._job_id(query, quality)) == download_id:
+                self._job_records.pop(self._job_id(query, quality), None)
+    
+    def _flight_key(self, url: str, quality: str) -> Tuple[str, str]:
+        """کلید یکی‌سازی دانلودهای هم‌زمان"""
+        return canonical_key(url), quality
+    
+    def _partial_dir(self, url: str, quality: str) -> str:
+        """پوشه ثابت دانلود هر لینک و کیفیت (فایل‌های .part پس از راه‌اندازی مجدد ادامه می‌یابند)"""
+        digest = hashlib.sha1(repr(self._flight_key(url, quality)).encode('utf-8')).hexdigest()[:16]
+        return str(Path(self.config.DOWNLOAD_DIR) / f"job_{digest}")
+    
+    def _broadcast_progress(self, key: Tuple[str, str], state: Dict[str, Any]):
+        """ارسال وضعیت دانلود به پیام وضعیت تمام درخواست‌های متصل"""
+        for reporter in list(self._progress.get(key, ())):
+            reporter.update(state)
+    
+    async def _deliver_shared(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                              url: str, quality: str, quality_text: str,
+                              download_id: Optional[str] = None) -> Dict[str, Any]:
+        """دانلود و آپلود یک بار برای تمام درخواست‌های هم‌زمان یک لینک و کیفیت
+        
+        خروجی شامل kind، file_ids (یک شناسه برای هر بخش) و chat_id گفتگویی است
+        که فایل در آن آپلود شده (None اگر از cache آمده باشد). درخواستی که لغو
+        شود از فهرست گیرندگان حذف می‌شود تا فایل برای او آپلود نشود.
+        """
+        key = self._flight_key(url, quality)
+        recipients = self._recipients.setdefault(key, [])
+        recipients.append(chat_id)
         try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # تنظیمات بر اساس کیفیت
-                ydl_opts = self.ydl_opts.copy()
-                ydl_opts['outtmpl'] = os.path.join(tmpdir, '%(title)s.%(ext)s')
+            delivered, shared = await self.inflight.do(
+                key, lambda: self._download_and_upload(context, url, quality, quality_text, download_id)
+            )
+        finally:
+            recipients.remove(chat_id)
+            if not recipients and self._recipients.get(key) is recipients:
+                del self._recipients[key]
+        if shared:
+            logger.info(f"🔗 درخواست {chat_id} به دانلود در جریان {url} ({quality}) متصل شد")
+        return delivered
+    
+    def _upload_target(self, key: Tuple[str, str]) -> int:
+        """گفتگویی که فایل دانلود مشترک در آن آپلود می‌شود (اولین منتظر باقی‌مانده)"""
+        recipients = self._recipients.get(key)
+        if not recipients:
+            # تمام درخواست‌ها لغو شده‌اند؛ task مشترک هم در حال لغو است
+            raise asyncio.CancelledError()
+        return recipients[0]
+    
+    async def _download_and_upload(self, context: ContextTypes.DEFAULT_TYPE,
+                                   url: str, quality: str, quality_text: str,
+                                   download_id: Optional[str] = None) -> Dict[str, Any]:
+        """دانلود فایل و آپلود آن برای یکی از درخواست‌های منتظر"""
+        # دانلود همزمان دیگری درست پیش از این درخواست تمام شده است
+        cached = self.file_cache.get(url, quality)
+        if cached:
+            return {'kind': cached['kind'], 'file_ids': self._cached_file_ids(cached),
+                    'chat_id': None, 'file_size': cached.get('file_size')}
+        
+        # انتخاب فرمتی که در محدودیت آپلود جا شود (پیش از دانلود)
+        plan = self.converter.plan(self.probe.get_info(url), quality)
+        if plan.action != 'direct':
+            logger.info(f"📐 {url} ({quality}): {plan.action}، حجم تخمینی {format_size(plan.estimated_size)}")
+        
+        key = self._flight_key(url, quality)
+        partial_dir = self._partial_dir(url, quality)
+        
+        def on_progress(state: Dict[str, Any]):
+            self._broadcast_progress(key, state)
+            if download_id and state.get('tmpfilename'):
+                self.jobs.record_part(download_id, state['tmpfilename'])
+        
+        try:
+            downloaded_file = await self._download_with_ytdlp(
+                url, quality, plan=plan, progress=on_progress, output_dir=partial_dir
+            )
+        except asyncio.CancelledError:
+            # هنگام توقف ربات فایل‌های .part برای ادامه دانلود حفظ می‌شوند
+            if not self.stopping:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        if not downloaded_file:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise Exception("خطا در دانلود فایل")
+        
+        # فایل cache تا پایان آماده‌سازی و آپلود pin می‌ماند تا eviction آن را حذف نکند
+        try:
+            return await self._prepare_and_upload(context, key, downloaded_file, plan,
+                                                  url, quality, quality_text)
+        finally:
+            self.media_cache.unpin(downloaded_file)
+    
+    async def _prepare_and_upload(self, context: ContextTypes.DEFAULT_TYPE, key: str,
+                                  downloaded_file: str, plan: ConversionPlan,
+                                  url: str, quality: str, quality_text: str) -> Dict[str, Any]:
+        """تقسیم یا کدگذاری دوباره فایل در صورت نیاز و آپلود بخش‌ها"""
+        # فایل بزرگ‌تر از محدودیت آپلود تقسیم یا دوباره کدگذاری می‌شود
+        if os.path.getsize(downloaded_file) > self.converter.upload_limit:
+            self._broadcast_progress(key, {'phase': 'postprocess', 'postprocessor': 'FormatConverter'})
+        prepared = await self.converter.prepare(downloaded_file, plan)
+        
+        kind = 'document' if quality in ['mp3', 'mp4'] else 'video'
+        file_ids = []
+        file_size = 0
+        try:
+            chat_id = self._upload_target(key)
+            for index, part in enumerate(prepared.parts, 1):
+                # آپلود در یک درخواست انجام می‌شود؛ فقط مرحله و حجم نمایش داده می‌شود
+                self._broadcast_progress(key, {
+                    'phase': 'upload', 'total': prepared.sizes[index - 1],
+                    'part': index, 'parts': len(prepared.parts)
+                })
                 
-                if quality == 'mp3':
-                    ydl_opts['format'] = 'bestaudio/best'
-                    ydl_opts['postprocessors'] = [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }]
-                elif quality == 'mp4':
-                    ydl_opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4'
-                elif quality in ['360', '480', '720', '1080']:
-                    ydl_opts['format'] = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]'
+                # ارسال فایل به کاربر
+                message = await self._upload_file(
+                    context, chat_id, kind, part, quality_text, (index, len(prepared.parts))
+                )
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    
-                    # یافتن فایل دانلود شده
-                    downloaded_files = [f for f in os.listdir(tmpdir) if f.endswith(('.mp4', '.mp3', '.webm', '.mkv'))]
-                    
-                    if downloaded_files:
-                        return os.path.join(tmpdir, downloaded_files[0])
-                    
+                attachment = message.video or message.document or message.audio
+                if attachment is None:
+                    raise Exception("شناسه فایل ارسال‌شده دریافت نشد")
+                file_ids.append(attachment.file_id)
+                file_size += attachment.file_size or 0
+        finally:
+            prepared.cleanup()
+        
+        # ذخیره file_id برای درخواست‌های بعدی همین لینک و کیفیت
+        metadata = {'file_size': file_size}
+        if len(file_ids) > 1:
+            metadata['parts'] = file_ids
+        self.file_cache.put(url, quality, file_ids[0], kind, **metadata)
+        return {'kind': kind, 'file_ids': file_ids, 'chat_id': chat_id, 'file_size': file_size}
+    
+    async def _send_media(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                          kind: str, media, quality_text: str,
+                          part: Optional[Tuple[int, int]] = None):
+        """ارسال فایل (یا file_id) به کاربر"""
+        caption = f"✅ دانلود با کیفیت {quality_text} کامل شد!"
+        if part and part[1] > 1:
+            caption += f"\n📎 بخش {part[0]} از {part[1]}"
+        if kind == 'video':
+            return await context.bot.send_video(chat_id=chat_id, video=media, caption=caption)
+        if kind == 'audio':
+            return await context.bot.send_audio(chat_id=chat_id, audio=media, caption=caption)
+        return await context.bot.send_document(chat_id=chat_id, document=media, caption=caption)
+    
+    async def _upload_file(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, kind: str,
+                           file_path: str, quality_text: str, part: Tuple[int, int]):
+        """آپلود فایل از دیسک
+        
+        با سرور Bot API محلی (local_mode) فقط مسیر فایل ارسال می‌شود و سرور خودش
+        فایل را از دیسک می‌خواند؛ پوشه دانلود باید با همین مسیر برای سرور قابل دسترس باشد.
+        """
+        if context.bot.local_mode:
+            return await self._send_media(
+                context, chat_id, kind, Path(file_path).absolute(), quality_text, part=part
+            )
+        with open(file_path, 'rb') as file:
+            return await self._send_media(context, chat_id, kind, file, quality_text, part=part)
+    
+    @staticmethod
+    def _cached_file_ids(cached: Dict) -> List[str]:
+        """شناسه بخش‌های فایل ذخیره‌شده (فایل‌های تقسیم‌شده چند بخش دارند)"""
+        return cached.get('parts') or [cached['file_id']]
+    
+    async def _send_file_ids(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                             kind: str, file_ids: List[str], quality_text: str):
+        """ارسال تمام بخش‌های یک فایل با file_id"""
+        for index, file_id in enumerate(file_ids, 1):
+            await self._send_media(
+                context, chat_id, kind, file_id, quality_text, part=(index, len(file_ids))
+            )
+    
+    async def _send_done_message(self, query, quality: str, quality_text: str):
+        """پیام پایان دانلود"""
+        await query.edit_message_text(
+            f"✅ **دانلود کامل شد!**\n\n"
+            f"📦 کیفیت: {quality_text}\n"
+            f"📁 فرمت: {'MP3' if quality == 'mp3' else 'MP4' if quality == 'mp4' else 'ویدئو'}\n\n"
+            "👇 برای دانلود دیگر:",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📥 دانلود دیگر", callback_data="download_again")],
+                [InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]
+            ])
+        )
+    
+    async def _send_cached(self, query, context: ContextTypes.DEFAULT_TYPE, url: str,
+                           quality: str, quality_text: str, cached: Dict) -> bool:
+        """ارسال فایل از cache؛ False اگر تلگرام file_id را نپذیرد"""
+        try:
+            await self._send_file_ids(
+                context, query.from_user.id, cached['kind'],
+                self._cached_file_ids(cached), quality_text
+            )
+        except BadRequest as e:
+            logger.warning(f"file_id ذخیره‌شده برای {url} نامعتبر است: {e}")
+            self.file_cache.invalidate(url, quality)
+            return False
+        
+        await self._send_done_message(query, quality, quality_text)
+        return True
+    
+    def _build_ydl_opts(self, quality: str, plan: Optional[ConversionPlan] = None) -> Dict[str, Any]:
+        """تنظیمات yt-dlp بر اساس کیفیت (و فرمت انتخاب‌شده برای محدودیت آپلود)"""
+        ydl_opts = self.ydl_opts.copy()
+        
+        if quality == 'mp3':
+            ydl_opts['format'] = 'bestaudio/best'
+            ydl_opts['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': str(plan.audio_quality if plan and plan.audio_quality else 192),
+            }]
+        elif quality == 'mp4':
+            ydl_opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4'
+        elif quality in ['360', '480', '720', '1080']:
+            ydl_opts['format'] = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]'
+        
+        if plan and plan.format:
+            # فرمت مشخص با بازگشت به انتخابگر عادی در صورت تغییر فهرست فرمت‌ها
+            ydl_opts['format'] = f"{plan.format}/{ydl_opts.get('format', 'best')}"
+        
+        return ydl_opts
+    
+    async def _download_with_ytdlp(self, url: str, quality: str,
+                                   plan: Optional[ConversionPlan] = None,
+                                   progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                   output_dir: Optional[str] = None) -> Optional[str]:
+        """دانلود واقعی با yt-dlp در پردازه worker
+        
+        اگر همین لینک و کیفیت قبلاً دانلود شده باشد، فایل از cache دیسک برگردانده
+        می‌شود؛ در غیر این صورت فایل دانلود شده به cache منتقل می‌شود. فایل
+        برگردانده‌شده pin شده است و فراخواننده پس از پایان کار unpin می‌کند.
+        """
+        cached_path = self.media_cache.get(url, quality, pin=True)
+        if cached_path:
+            return cached_path
+        
+        try:
+            # اطلاعات استخراج‌شده در مرحله بررسی لینک دوباره استفاده می‌شود
+            result = await self.executor.download(
+                url, self._build_ydl_opts(quality, plan), info=self.probe.get_info(url),
+                progress=progress, output_dir=output_dir
+            )
+        except DownloadTimeoutError:
+            logger.warning(f"⏱️ مهلت دانلود {url} به پایان رسید")
+            return None
         except Exception as e:
             logger.error(f"خطا در yt-dlp: {e}")
+            return None
         
-        return None
+        loop = asyncio.get_running_loop()
+        put_future = loop.run_in_executor(
+            None, lambda: self.media_cache.put(url, quality, result['file_path'], pin=True,
+                                               title=result.get('title'))
+        )
+        # پوشه موقت دانلود پس از پایان انتقال به cache حذف می‌شود (حتی اگر دانلود لغو شود)
+        put_future.add_done_callback(lambda _future: self.executor.cleanup(result['file_path']))
+        try:
+            return await asyncio.shield(put_future)
+        except asyncio.CancelledError:
+            # فایلی که پس از لغو به cache منتقل شود استفاده نمی‌شود
+            put_future.add_done_callback(
+                lambda future: (not future.cancelled() and future.exception() is None
+                                and self.media_cache.unpin(future.result()))
+            )
+            raise
+        except Exception as e:
+            logger.error(f"خطا در ذخیره فایل در cache: {e}")
+            return None
+    
+    async def resume_jobs(self, bot) -> int:
+        """صف‌گذاری دوباره کارهای ناتمام پیش از راه‌اندازی مجدد
+        
+        دانلود از فایل .part باقی‌مانده در پوشه ثابت کار ادامه می‌یابد. کارهایی که
+        بیش از DOWNLOAD_MAX_ATTEMPTS بار شروع شده‌اند ناموفق ثبت می‌شوند.
+        """
+        # رکوردهای قدیمی تمام‌شده حذف می‌شوند
+        cutoff = datetime.now() - timedelta(days=self.config.DOWNLOAD_JOBS_RETENTION_DAYS)
+        expired = [d.id for d in self.jobs.get_downloads_before(cutoff) if d.is_finished]
+        if expired:
+            self.jobs.delete_downloads(expired)
+        
+        resumed = 0
+        for record in self.jobs.get_unfinished():
+            if record.attempts >= self.config.DOWNLOAD_MAX_ATTEMPTS:
+                self.jobs.fail_download(record.id, "تعداد تلاش‌ها به حداکثر رسید")
+                continue
+            if record.chat_id is None or record.message_id is None:
+                self.jobs.fail_download(record.id, "اطلاعات پیام وضعیت موجود نیست")
+                continue
+            if record.status is DownloadStatus.PROCESSING:
+                self.jobs.transition(record.id, DownloadStatus.PENDING)
+            
+            query = ResumedQuery(bot, record.chat_id, record.message_id, record.user_id)
+            context = SimpleNamespace(bot=bot)
+            quality = record.quality or "720"
+            quality_text = self.QUALITY_TEXTS.get(quality, "پیش‌فرض")
+            job_id = self._job_id(query, quality)
+            job = DownloadJob(
+                id=job_id,
+                user_id=record.user_id,
+                run=lambda q=query, c=context, r=record, qt=quality_text, qu=quality:
+                    self._run_download(q, c, r.url, qu, qt, r.id),
+                tier=self.get_user_tier(record.user_id),
+                host=self.bandwidth.host_key(record.url)
+            )
+            try:
+                await self.queue.submit(job, report_position=False)
+            except (UserLimitError, QueueFullError):
+                self.jobs.fail_download(record.id, "صف دانلود پر است")
+                continue
+            
+            self._job_records[job_id] = record.id
+            resumed += 1
+            try:
+                await query.edit_message_text(
+                    f"🔄 دانلود با کیفیت {quality_text} پس از راه‌اندازی مجدد ربات ادامه می‌یابد...",
+                    reply_markup=self._cancel_markup()
+                )
+            except Exception as e:
+                logger.debug(f"ویرایش پیام کار ازسرگرفته انجام نشد: {e}")
+        
+        if resumed:
+            logger.info(f"🔄 {resumed} دانلود ناتمام دوباره در صف قرار گرفت")
+        return resumed
     
     async def cancel_download(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """لغو دانلود"""
         query = update.callback_query
         await query.answer()
         
+        # لغو تمام کارهای این پیام (در صف، در حال اجرا یا متصل به دانلود مشترک)
+        prefix = f"{query.from_user.id}:{query.message.message_id}:"
+        job_ids = {job_id for job_id in self.queue.job_ids() if job_id.startswith(prefix)}
+        job_ids.update(job_id for job_id in self._job_records if job_id.startswith(prefix))
+        for job_id in job_ids:
+            download_id = self._job_records.pop(job_id, None)
+            if download_id:
+                self.jobs.cancel_download(download_id)
+            if self.queue.cancel(job_id):
+                logger.info(f"🛑 دانلود {job_id} توسط کاربر لغو شد")
+        
+        # ویرایش پیام فقط کیبورد inline می‌پذیرد
         await query.edit_message_text(
             "✅ دانلود لغو شد.",
-            reply_markup=self.get_reply_keyboard(query.from_user.id)
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📥 دانلود دیگر", callback_data="download_again")],
+                [InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]
+            ])
         )
     
     async def download_again(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -960,7 +2096,8 @@ class PaymentController(BaseController):
             user_id=user_id,
             plan_name=plan['name'],
             amount=plan['price_usdt'],
-            txid=txid
+            txid=txid,
+            plan_id=context.user_data.get('selected_plan')
         )
         
         # ارتقا کاربر به پریمیوم
@@ -1122,6 +2259,25 @@ class MenuController(BaseController):
 class AdminController(BaseController):
     """کنترلر ادمین"""
     
+    def __init__(self, data_manager: DataManager, config: Config,
+                 download_queue: Optional[DownloadQueue] = None,
+                 file_cache: Optional[FileIdCache] = None):
+        super().__init__(data_manager, config)
+        self.download_queue = download_queue
+        self.file_cache = file_cache
+    
+    def _queue_stats_text(self) -> str:
+        """صدک‌های زمان انتظار صف دانلود به تفکیک سطح"""
+        if self.download_queue is None:
+            return ""
+        
+        text = (f"\n\n📋 **صف دانلود:** {self.download_queue.waiting_count} در انتظار، "
+                f"{self.download_queue.running_count} در حال اجرا")
+        for tier, p in sorted(self.download_queue.wait_percentiles().items()):
+            text += (f"\n• {tier}: p50 {p['p50']:.0f}s | p90 {p['p90']:.0f}s | "
+                     f"p99 {p['p99']:.0f}s ({p['count']})")
+        return text
+    
     async def admin_panel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """پنل ادمین"""
         user = update.effective_user
@@ -1178,12 +2334,20 @@ class AdminController(BaseController):
 
 📥 **دانلودها:**
 • کل: {stats['total_downloads']}
+• امروز: {stats['today_downloads']}
 • متوسط هر کاربر: {stats['total_downloads'] / max(stats['total_users'], 1):.1f}
 
 💰 **مالی:**
 • پرداخت‌ها: {stats['total_payments']}
 • درآمد کل: {stats['total_revenue']} دلار
+• درآمد امروز: {stats['today_revenue']} دلار
 • متوسط هر پرداخت: {stats['total_revenue'] / max(stats['total_payments'], 1):.1f} دلار"""
+        stats_text += self._queue_stats_text()
+        if self.file_cache is not None:
+            cache = self.file_cache.stats()
+            stats_text += (f"\n\n🗂️ **cache فایل‌ها:** {cache['entries']} فایل، "
+                           f"نرخ برخورد {cache['hit_rate'] * 100:.0f}% "
+                           f"({cache['hits']}/{cache['hits'] + cache['misses']})")
         
         await query.edit_message_text(
             stats_text,
@@ -1287,7 +2451,8 @@ class ControllerManager:
         self.download = DownloadController(data_manager, config)
         self.payment = PaymentController(data_manager, config)
         self.menu = MenuController(data_manager, config)
-        self.admin = AdminController(data_manager, config)
+        self.admin = AdminController(data_manager, config,
+                                     self.download.queue, self.download.file_cache)
         self.text_handler = TextMessageController(
             data_manager, config,
             self.user, self.download,
@@ -1377,7 +2542,17 @@ class Router:
         
         # مدیر داده‌ها
         self.data_dir = Path("data")
-        self.data_manager = DataManager(self.data_dir)
+        self.storage = None
+        if self.config.STORAGE_BACKEND == 'sqlite':
+            self.data_dir.mkdir(exist_ok=True)
+            self.storage = SQLiteStorage(Path(self.config.SQLITE_PATH))
+        self.data_manager = DataManager(
+            self.data_dir,
+            journal_enabled=self.config.JOURNAL_ENABLED,
+            compact_threshold=self.config.JOURNAL_COMPACT_THRESHOLD,
+            storage=self.storage,
+            journal_fsync=self.config.JOURNAL_FSYNC
+        )
         
         # مدیر کنترلرها
         self.controller_manager = ControllerManager(self.data_manager, self.config)
@@ -1385,7 +2560,7 @@ class Router:
         # تنظیم ذخیره خودکار
         self._setup_auto_save()
         
-        logger.info(f"✅ Router راه‌اندازی شد - کاربران: {len(self.data_manager.users)}")
+        logger.info(f"✅ Router راه‌اندازی شد - کاربران: {self.data_manager.count_users()}")
         
         if self.config.ENABLE_REAL_DOWNLOAD:
             logger.info("✅ دانلود واقعی فعال است (yt-dlp)")
@@ -1393,17 +2568,64 @@ class Router:
             logger.warning("⚠️ دانلود واقعی غیرفعال است. برای فعال کردن: pip install yt-dlp")
     
     def _setup_auto_save(self):
-        """تنظیم ذخیره خودکار"""
-        import threading
-        import time
-        
-        def save_loop():
-            while True:
-                time.sleep(300)  # هر 5 دقیقه
-                self.data_manager.save_all()
+        """تنظیم ذخیره خودکار (write-behind روی حلقه رویداد بات)"""
+        self.flusher = WriteBehindFlusher(
+            self.data_manager,
+            interval=self.config.FLUSH_INTERVAL,
+            max_dirty=self.config.FLUSH_MAX_DIRTY
+        )
+        self.data_manager.enable_write_behind(self.flusher.notify)
         
-        thread = threading.Thread(target=save_loop, daemon=True)
-        thread.start()
+        # انقضای خودکار اشتراک‌ها
+        self.expiry_scheduler = PremiumExpiryScheduler(
+            self.data_manager,
+            notify=self._notify_premium_expired
+        )
+        self.expiry_scheduler.load()
+        self.data_manager.enable_expiry_tracking(self.expiry_scheduler.schedule)
+        
+        previous_post_init = self.app.post_init
+        previous_post_shutdown = self.app.post_shutdown
+        
+        async def post_init(app: Application):
+            if previous_post_init:
+                await previous_post_init(app)
+            self.flusher.start()
+            self.expiry_scheduler.start()
+            self.controller_manager.download.queue.start()
+            await self.controller_manager.download.resume_jobs(app.bot)
+        
+        async def post_shutdown(app: Application):
+            await self.expiry_scheduler.stop()
+            # کارهای قطع‌شده برای ادامه در راه‌اندازی بعدی حفظ می‌شوند
+            self.controller_manager.download.stopping = True
+            await self.controller_manager.download.queue.stop()
+            # دانلودهای مشترک لغوشده ممکن است هنوز منتظر توقف پردازه worker باشند
+            await self.controller_manager.download.inflight.cancel_all()
+            self.controller_manager.download.executor.shutdown()
+            self.controller_manager.download.jobs.flush()
+            self.controller_manager.download.file_cache.flush()
+            self.controller_manager.download.callbacks.flush()
+            self.controller_manager.download.media_cache.flush()
+            await self.flusher.stop()
+            if previous_post_shutdown:
+                await previous_post_shutdown(app)
+        
+        self.app.post_init = post_init
+        self.app.post_shutdown = post_shutdown
+    
+    async def _notify_premium_expired(self, user: User):
+        """اطلاع‌رسانی پایان اشتراک به کاربر"""
+        await self.app.bot.send_message(
+            chat_id=int(user.id),
+            text="⌛ **اشتراک پریمیوم شما به پایان رسید.**\n\n"
+                 "برای تمدید از منوی «💎 خرید اشتراک» استفاده کنید.",
+            parse_mode='Markdown'
+        )
+    
+    def flush_data(self):
+        """نوشتن همگام تمام تغییرات معلق (هنگام توقف)"""
+        self.data_manager.flush()
     
     def register_routes(self):
         """ثبت مسیرها"""
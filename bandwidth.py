@@ -0,0 +1,153 @@
+"""
+bandwidth.py - محدودیت پهنای باند کل و اتصال‌های هم‌زمان هر پلتفرم برای دانلودها
+
+سطل توکن (SharedTokenBucket) در حافظه مشترک بین پردازه‌های worker قرار دارد و
+hook پیشرفت yt-dlp پس از هر بلوک دریافتی به اندازه حجم آن توکن برمی‌دارد؛ اگر
+توکن کافی نباشد، همان thread دانلود صبر می‌کند. ratelimit و
+concurrent_fragment_downloads هر دانلود هم از همین تنظیمات گرفته می‌شوند.
+"""
+
+import time
+import logging
+import multiprocessing
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+from core.link_generator import match_platform
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# بیشترین زمان یک بار صبر در hook (برای بررسی به‌موقع لغو و مهلت دانلود)
+MAX_WAIT = 1.0
+
+
+class SharedTokenBucket:
+    """سطل توکن مشترک بین پردازه‌ها (بایت بر ثانیه)
+
+    وضعیت در multiprocessing.Array نگه داشته می‌شود و فقط هنگام ساخت پردازه
+    (initializer در ProcessPoolExecutor) قابل انتقال است، نه به عنوان آرگومان کار.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, mp_context=None):
+        ctx = mp_context or multiprocessing.get_context('spawn')
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        # [توکن‌های موجود، زمان آخرین به‌روزرسانی]
+        self._state = ctx.Array('d', [self.burst, time.time()])
+
+    def consume(self, amount: float) -> float:
+        """برداشتن amount توکن و برگرداندن زمان لازم برای صبر (ثانیه)"""
+        with self._state.get_lock():
+            now = time.time()
+            tokens = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate) - amount
+            self._state[0] = tokens
+            self._state[1] = now
+        return -tokens / self.rate if tokens < 0 else 0.0
+
+
+def throttle_hook(bucket: SharedTokenBucket, should_stop: Callable[[], bool] = lambda: False) -> Callable:
+    """hook پیشرفت yt-dlp که سرعت دانلود را با سطل توکن مشترک محدود می‌کند
+
+    should_stop (لغو یا پایان مهلت) بین صبرهای کوتاه بررسی می‌شود.
+    """
+    # فایل -> حجم دریافت‌شده در فراخوانی قبلی
+    received: Dict[str, float] = {}
+
+    def on_download(status):
+        if status.get('status') != 'downloading':
+            return
+        name = status.get('tmpfilename') or status.get('filename') or ''
+        downloaded = status.get('downloaded_bytes') or 0
+        previous = received.get(name, 0)
+        received[name] = downloaded
+        if downloaded <= previous:
+            return
+
+        wait = bucket.consume(downloaded - previous)
+        while wait > 0 and not should_stop():
+            step = min(wait, MAX_WAIT)
+            time.sleep(step)
+            wait -= step
+
+    return on_download
+
+
+class BandwidthGovernor:
+    """محدودیت پهنای باند کل و تعداد دانلودهای هم‌زمان هر پلتفرم
+
+    rate و burst بر حسب بایت بر ثانیه هستند (0 یعنی بدون محدودیت).
+    host_limits سقف دانلود هم‌زمان هر پلتفرم (مانند youtube) یا دامنه را
+    تعیین می‌کند و default_host_limit برای بقیه اعمال می‌شود (0 یعنی بدون سقف).
+    صف دانلود پیش از دادن worker به هر کار با has_capacity و acquire جای
+    پلتفرم آن را می‌گیرد تا کارهای پلتفرم پر، worker ها را معطل نکنند.
+    """
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None,
+                 host_limits: Optional[Dict[str, int]] = None, default_host_limit: int = 0,
+                 concurrent_fragments: int = 1):
+        self.rate = rate
+        self.bucket = SharedTokenBucket(rate, burst) if rate > 0 else None
+        self.host_limits = {key.lower(): limit for key, limit in (host_limits or {}).items()}
+        self.default_host_limit = default_host_limit
+        self.concurrent_fragments = max(1, concurrent_fragments)
+        self._active: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, section: Dict[str, Any]) -> 'BandwidthGovernor':
+        """ساخت از بخش bandwidth در config.json (مقادیر سرعت بر حسب MB/s)"""
+        host_limits = dict(section.get('host_concurrency') or {})
+        default_host_limit = int(host_limits.pop('default', 0))
+        return cls(
+            rate=float(section.get('global_rate_mb', 0)) * MB,
+            burst=float(section.get('burst_mb', 0)) * MB or None,
+            host_limits={key: int(limit) for key, limit in host_limits.items()},
+            default_host_limit=default_host_limit,
+            concurrent_fragments=int(section.get('concurrent_fragments', 1)),
+        )
+
+    @staticmethod
+    def host_key(url: str) -> str:
+        """کلید محدودیت هم‌زمانی لینک (نام پلتفرم یا دامنه)"""
+        platform = match_platform(url)
+        if platform is not None:
+            return platform.value
+        return (urlsplit(url.strip()).hostname or '').lower()
+
+    def host_limit(self, key: str) -> int:
+        """سقف دانلود هم‌زمان پلتفرم (0 یعنی بدون سقف)"""
+        return self.host_limits.get(key, self.default_host_limit)
+
+    def has_capacity(self, key: str) -> bool:
+        """آیا دانلود دیگری از این پلتفرم می‌تواند شروع شود؟"""
+        limit = self.host_limit(key)
+        return limit <= 0 or self._active.get(key, 0) < limit
+
+    def acquire(self, key: str):
+        """ثبت شروع دانلود از این پلتفرم (پس از بررسی has_capacity)"""
+        self._active[key] = self._active.get(key, 0) + 1
+
+    def release(self, key: str):
+        self._active[key] -= 1
+        if not self._active[key]:
+            del self._active[key]
+
+    def apply(self, ydl_opts: Dict[str, Any]) -> Dict[str, Any]:
+        """افزودن ratelimit و concurrent_fragment_downloads به تنظیمات yt-dlp
+
+        یک دانلود به تنهایی بیش از سرعت کل مجاز نمی‌گیرد؛ تقسیم سرعت بین
+        دانلودهای هم‌زمان با سطل توکن مشترک در پردازه‌های worker انجام می‌شود.
+        """
+        opts = dict(ydl_opts)
+        opts.setdefault('concurrent_fragment_downloads', self.concurrent_fragments)
+        if self.rate > 0:
+            opts['ratelimit'] = int(min(opts.get('ratelimit') or self.rate, self.rate))
+        return opts
+
+    def stats(self) -> Dict[str, Any]:
+        """دانلودهای در جریان هر پلتفرم"""
+        return {
+            'rate': self.rate,
+            'active': dict(self._active),
+        }
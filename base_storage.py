@@ -0,0 +1,60 @@
+"""
+base_storage.py - رابط پایه لایه ذخیره‌سازی
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+# فیلدهایی که موتورهای ذخیره‌سازی باید روی آن‌ها ایندکس داشته باشند
+INDEXED_FIELDS = ('user_id', 'status', 'requested_at', 'is_active')
+
+
+class BaseStorage(ABC):
+    """رابط پایه ذخیره‌سازی
+
+    داده‌ها در مجموعه‌ها (collection) با کلید رشته‌ای نگهداری می‌شوند.
+    مقدار هر رکورد یک ساختار قابل تبدیل به JSON است.
+    """
+
+    @abstractmethod
+    def get(self, collection: str, key: str) -> Optional[Any]:
+        """دریافت یک رکورد"""
+
+    @abstractmethod
+    def put(self, collection: str, key: str, record: Any):
+        """ذخیره (درج یا جایگزینی) یک رکورد"""
+
+    @abstractmethod
+    def put_many(self, collection: str, items: Dict[str, Any]):
+        """ذخیره گروهی رکوردها در یک تراکنش"""
+
+    @abstractmethod
+    def delete(self, collection: str, key: str) -> bool:
+        """حذف یک رکورد"""
+
+    @abstractmethod
+    def iter_all(self, collection: str) -> Iterator[Tuple[str, Any]]:
+        """پیمایش تمام رکوردهای یک مجموعه"""
+
+    @abstractmethod
+    def count(self, collection: str, field: str = None, value: Any = None) -> int:
+        """تعداد رکوردها (در صورت نیاز با شرط روی یک فیلد ایندکس‌شده)"""
+
+    @abstractmethod
+    def find(self, collection: str, field: str, value: Any) -> List[Tuple[str, Any]]:
+        """جستجو روی یک فیلد ایندکس‌شده"""
+
+    @abstractmethod
+    def find_range(self, collection: str, field: str, start: Any = None,
+                   end: Any = None) -> List[Tuple[str, Any]]:
+        """جستجوی بازه‌ای روی یک فیلد ایندکس‌شده (start <= value < end)"""
+
+    @contextmanager
+    def batch(self):
+        """گروه‌بندی چند عملیات نوشتن در یک تراکنش"""
+        yield self
+
+    def close(self):
+        """بستن اتصال"""
@@ -0,0 +1,88 @@
+"""
+platform_matcher.py - بنچمارک تشخیص پلتفرم لینک‌ها
+
+اجرا:
+    python -m core.benchmarks.platform_matcher [تعداد تکرار]
+
+روش قبلی (کوچک کردن لینک، regex و جستجوی زیررشته‌ای تمام دامنه‌ها) با
+match_platform (جستجوی پسوندهای دامنه در دیکشنری) مقایسه می‌شود. ورودی ترکیبی
+از لینک‌های پشتیبانی شده، لینک‌های دیگر و پیام‌های متنی معمولی است، مانند آنچه
+handle_text دریافت می‌کند.
+"""
+
+import re
+import sys
+import timeit
+
+from core.link_generator import PlatformMatcher, PLATFORM_HOSTS, match_platform
+
+LEGACY_PLATFORMS = [
+    'youtube.com', 'youtu.be',
+    'instagram.com', 'instagr.am',
+    'tiktok.com',
+    'twitter.com', 'x.com',
+    'facebook.com', 'fb.watch',
+    'reddit.com',
+    'dailymotion.com',
+    'vimeo.com',
+    'twitch.tv',
+]
+
+SAMPLES = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=abc",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "https://www.instagram.com/reel/Cx1abcDEF/?igshid=xyz",
+    "https://vm.tiktok.com/ZMabc123/",
+    "https://x.com/user/status/1234567890123456789",
+    "https://vimeo.com/123456789",
+    "https://www.twitch.tv/videos/987654321",
+    "https://example.com/some/article?utm_source=telegram",
+    "https://evil.example/?q=youtube.com",
+    "سلام، چطور می‌توانم اشتراک بخرم؟",
+    "این لینک کار نمی‌کند",
+    "📥 دانلود",
+]
+
+
+def legacy_is_valid_url(url: str) -> bool:
+    """پیاده‌سازی قبلی BaseController.is_valid_url"""
+    url_lower = url.lower().strip()
+
+    if not re.match(r'^https?://', url_lower):
+        return False
+
+    for platform in LEGACY_PLATFORMS:
+        if platform in url_lower:
+            return True
+
+    return False
+
+
+def _run(check, number: int) -> float:
+    """میانگین زمان هر فراخوانی (میکروثانیه)"""
+    total = timeit.timeit(lambda: [check(url) for url in SAMPLES], number=number)
+    return total / (number * len(SAMPLES)) * 1e6
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+
+    # matcher بدون cache: هزینه واقعی اولین برخورد با هر دامنه
+    uncached = PlatformMatcher(PLATFORM_HOSTS, cache_size=0)
+
+    legacy = _run(legacy_is_valid_url, number)
+    matcher_cold = _run(uncached.match, number)
+    matcher = _run(match_platform, number)
+
+    accepted_legacy = sum(legacy_is_valid_url(url) for url in SAMPLES)
+    accepted = sum(match_platform(url) is not None for url in SAMPLES)
+
+    print(f"🔁 تعداد تکرار: {number:,} × {len(SAMPLES)} ورودی")
+    print(f"🐢 جستجوی زیررشته‌ای قبلی: {legacy:.2f} µs ({accepted_legacy} لینک پذیرفته شد)")
+    print(f"⚡ match_platform بدون cache: {matcher_cold:.2f} µs")
+    print(f"⚡ match_platform: {matcher:.2f} µs ({accepted} لینک پذیرفته شد)")
+    print(f"📈 افزایش سرعت: {legacy / matcher:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+user_memory.py - بنچمارک مصرف حافظه هر کاربر در DataManager
+
+اجرا:
+    python -m core.benchmarks.user_memory [تعداد کاربران]
+
+حالت قبلی (شیء User با __dict__ و تاریخ‌های ISO به همراه دیکشنری خام
+تکراری users) با ذخیره‌سازی فشرده فعلی (slots، نام‌های intern‌شده، epoch و
+کد وضعیت) مقایسه می‌شود.
+"""
+
+import sys
+import gc
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+from core.app import User
+
+FIRST_NAMES = ['Ali', 'Reza', 'Sara', 'Maryam', 'Mohammad', 'Zahra', 'Hossein', 'Fatemeh']
+
+
+class LegacyUser:
+    """مدل کاربر قبلی (برای مقایسه)"""
+    
+    def __init__(self, user_id, username, first_name, last_name=None):
+        self.id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.join_date = datetime.now().isoformat()
+        self.status = "free"
+        self.download_count = 0
+        self.premium_expiry = None
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'join_date': self.join_date,
+            'status': self.status,
+            'download_count': self.download_count,
+            'premium_expiry': self.premium_expiry
+        }
+
+
+def _records(count: int):
+    """تولید رکوردهای JSON مانند آنچه از users.json خوانده می‌شود"""
+    rnd = random.Random(42)
+    base = datetime(2024, 1, 1)
+    for i in range(count):
+        premium = i % 10 == 0
+        yield {
+            'id': str(100000000 + i),
+            'username': f'user{i}',
+            # رشته‌های تازه، همانند خروجی json.loads
+            'first_name': ''.join(rnd.choice(FIRST_NAMES)),
+            'last_name': None,
+            'join_date': (base + timedelta(seconds=rnd.randrange(10 ** 7))).isoformat(),
+            'status': 'premium' if premium else 'free',
+            'download_count': rnd.randrange(5),
+            'premium_expiry': (base + timedelta(days=400)).isoformat() if premium else None,
+        }
+
+
+def _measure(build, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = build(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    gc.collect()
+    return (after - before) / count
+
+
+def build_legacy(count: int):
+    """دیکشنری خام users به همراه _users_objs (رفتار قبلی DataManager)"""
+    users = {}
+    objs = {}
+    for data in _records(count):
+        users[data['id']] = data
+        user = LegacyUser(data['id'], data['username'], data['first_name'], data['last_name'])
+        user.join_date = data['join_date']
+        user.status = data['status']
+        user.download_count = data['download_count']
+        user.premium_expiry = data['premium_expiry']
+        objs[data['id']] = user
+    return users, objs
+
+
+def build_compact(count: int):
+    """فقط اشیای User فشرده (رفتار فعلی DataManager)"""
+    objs = {}
+    for data in _records(count):
+        user = User.from_dict(data)
+        objs[user.id] = user
+    return objs
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    legacy = _measure(build_legacy, count)
+    compact = _measure(build_compact, count)
+    
+    print(f"👥 تعداد کاربران: {count:,}")
+    print(f"📦 حالت قبلی: {legacy:,.0f} بایت به ازای هر کاربر "
+          f"({legacy * count / 2 ** 20:,.0f} MiB)")
+    print(f"🗜️ حالت فشرده: {compact:,.0f} بایت به ازای هر کاربر "
+          f"({compact * count / 2 ** 20:,.0f} MiB)")
+    print(f"📉 کاهش: {(1 - compact / legacy) * 100:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
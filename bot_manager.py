@@ -24,26 +24,43 @@ import asyncio
 from typing import Optional
 
 from telegram.ext import Application
-from core.app import Router
+from core.app import Config, Router
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class BotManager:
     def __init__(self, token: str = None, mode: str = 'polling', 
-                 webhook_url: Optional[str] = None):
+                 webhook_url: Optional[str] = None,
+                 base_url: Optional[str] = None, local_mode: Optional[bool] = None):
         self.token = token or os.getenv('BOT_TOKEN')
         if not self.token:
             raise ValueError("❌ توکن بات یافت نشد.")
         
         self.mode = mode
         self.webhook_url = webhook_url
+        
+        # سرور Bot API (پیش‌فرض: سرور عمومی تلگرام)
+        self.base_url = (base_url if base_url is not None else Config.BOT_API_BASE_URL).rstrip('/')
+        self.local_mode = Config.BOT_API_LOCAL_MODE if local_mode is None else local_mode
         self.app = self._build_app()
         self.router = Router(self.app)
         self._setup_graceful_shutdown()
     
     def _build_app(self) -> Application:
-        return Application.builder().token(self.token).build()
+        builder = Application.builder().token(self.token)
+        
+        if self.base_url:
+            # سرور Bot API محلی: http://host:8081/bot<token>/method
+            builder = (
+                builder
+                .base_url(f"{self.base_url}/bot")
+                .base_file_url(f"{self.base_url}/file/bot")
+                .local_mode(self.local_mode)
+            )
+            print(f"🏠 سرور Bot API: {self.base_url} (local_mode={self.local_mode})")
+        
+        return builder.build()
     
     def _setup_graceful_shutdown(self):
         for sig in (signal.SIGINT, signal.SIGTERM):
@@ -52,9 +69,9 @@ class BotManager:
     def _signal_handler(self, signum, frame):
         print(f"\n🛑 دریافت سیگنال توقف ({signum})...")
         
-        # ذخیره داده‌ها
+        # ذخیره تغییرات معلق write-behind
         if hasattr(self, 'router') and hasattr(self.router, 'data_manager'):
-            self.router.data_manager.save_all()
+            self.router.flush_data()
         
         # توقف بات
         if self.app.running:
@@ -0,0 +1,142 @@
+"""
+callback_store.py - نگهداری لینک‌ها با توکن کوتاه برای callback_data دکمه‌ها
+
+تلگرام callback_data را به 64 بایت محدود می‌کند؛ به جای لینک، یک توکن کوتاه در
+دکمه قرار می‌گیرد و لینک، کاربر و کیفیت‌های موجود لینک در این store نگه داشته
+می‌شوند.
+"""
+
+import time
+import secrets
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from core.json_storage import JsonStore, JournalStore
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackStore:
+    """نگاشت توکن کوتاه -> (لینک، کاربر، کیفیت‌های موجود) با انقضای زمانی
+
+    ورودی‌ها پس از ttl ثانیه از زمان ساخت منقضی می‌شوند و با رسیدن به
+    max_entries قدیمی‌ترین ورودی‌ها حذف می‌شوند. اگر data_dir داده شود،
+    ورودی‌ها ذخیره می‌شوند تا دکمه‌ها پس از راه‌اندازی مجدد هم کار کنند: هر
+    توکن جدید یک خط به ژورنال اضافه می‌کند و فایل کامل فقط هنگام compaction
+    (هر compact_threshold توکن)، بارگذاری و توقف نوشته می‌شود.
+    """
+
+    def __init__(self, data_dir: Optional[Path] = None, filename: str = "callback_tokens.json",
+                 ttl: float = 86400, max_entries: int = 50000, token_bytes: int = 6,
+                 compact_threshold: int = 10000):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.token_bytes = token_bytes
+        self.json_store = JsonStore(data_dir, indent=None) if data_dir is not None else None
+        self.journal = None
+        if data_dir is not None:
+            # توکن از دست رفته فقط یعنی ارسال دوباره لینک؛ fsync برای هر لینک لازم نیست
+            self.journal = JournalStore(
+                data_dir, filename=f"{Path(filename).stem}.journal",
+                compact_threshold=compact_threshold, fsync=False
+            )
+        self.hits = 0
+        self.misses = 0
+        # ترتیب ورودی‌ها همان ترتیب ساخت است (قدیمی‌ترین در ابتدا)
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._load()
+
+    def _load(self):
+        if self.json_store is None:
+            return
+        try:
+            data = self.json_store.load(self.filename, {})
+            replayed = self.journal.replay({'tokens': data})
+        except Exception as e:
+            logger.error(f"خطا در بارگذاری {self.filename}: {e}")
+            return
+
+        now = time.time()
+        for token, entry in sorted(data.items(), key=lambda item: item[1].get('created_at', 0)):
+            if now - entry.get('created_at', 0) < self.ttl:
+                # ورودی‌های قدیمی تمام اطلاعات لینک را در metadata داشتند
+                if 'metadata' in entry:
+                    metadata = entry.pop('metadata')
+                    entry['qualities'] = list(metadata['qualities']) if metadata else None
+                self._entries[token] = entry
+        self._prune(now)
+        logger.info(f"🔑 {len(self._entries)} توکن دکمه بارگذاری شد")
+
+        # ژورنال در فایل اصلی ادغام می‌شود (توکن‌های منقضی هم حذف می‌شوند)
+        if replayed:
+            self.flush()
+
+    def _save(self, token: str):
+        if self.journal is None:
+            return
+        try:
+            self.journal.append('tokens', token, self._entries[token])
+            if self.journal.needs_compaction():
+                self.flush()
+        except Exception as e:
+            logger.error(f"خطا در ذخیره {self.filename}: {e}")
+
+    def _prune(self, now: float):
+        """حذف ورودی‌های منقضی و مازاد از ابتدای صف"""
+        while self._entries:
+            token, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - entry['created_at'] < self.ttl:
+                break
+            del self._entries[token]
+
+    def put(self, url: str, user_id: str, qualities: Optional[Iterable[str]] = None) -> str:
+        """ذخیره لینک و برگرداندن توکن (8 نویسه برای token_bytes=6)
+
+        qualities کیفیت‌های موجود لینک است (None یعنی بدون محدودیت).
+        """
+        token = secrets.token_urlsafe(self.token_bytes)
+        while token in self._entries:
+            token = secrets.token_urlsafe(self.token_bytes)
+
+        now = time.time()
+        self._entries[token] = {
+            'url': url,
+            'user_id': str(user_id),
+            'qualities': list(qualities) if qualities is not None else None,
+            'created_at': now,
+        }
+        self._prune(now)
+        self._save(token)
+        return token
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """دریافت ورودی توکن (None اگر وجود نداشته یا منقضی شده باشد)"""
+        entry = self._entries.get(token)
+        if entry is not None and time.time() - entry['created_at'] >= self.ttl:
+            del self._entries[token]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        """آمار توکن‌ها"""
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def flush(self):
+        """نوشتن همگام تمام توکن‌ها و خالی کردن ژورنال (compaction و توقف)"""
+        if self.json_store is None:
+            return
+        self._prune(time.time())
+        self.json_store.save(self.filename, dict(self._entries))
+        self.journal.reset()
@@ -0,0 +1,34 @@
+"""
+conftest.py - fixture های مشترک تست‌ها
+"""
+
+import pytest
+
+
+@pytest.fixture(params=["json", "journal", "sqlite"])
+def manager_factory(request, tmp_path):
+    """ساخت DataManager روی همان داده‌ها
+
+    factory(previous) تغییرات معلق previous را می‌نویسد و DataManager تازه‌ای
+    می‌سازد (شبیه‌سازی راه‌اندازی مجدد ربات).
+    """
+    pytest.importorskip("telegram")
+    from core.app import DataManager
+    from core.sqlite_storage import SQLiteStorage
+
+    storages = []
+
+    def factory(previous=None):
+        if previous is not None:
+            previous.flush()
+            if previous.storage is not None:
+                previous.storage.close()
+        if request.param == "sqlite":
+            storage = SQLiteStorage(tmp_path / "bot.db")
+            storages.append(storage)
+            return DataManager(tmp_path, storage=storage)
+        return DataManager(tmp_path, journal_enabled=request.param == "journal")
+
+    yield factory
+    for storage in storages:
+        storage.close()
@@ -17,6 +17,7 @@ from telegram import (
     ReplyKeyboardMarkup,
     KeyboardButton
 )
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
@@ -26,6 +27,9 @@ from telegram.ext import (
     ContextTypes,
 )
 
+from core.link_generator import match_platform
+from core.metadata_probe import MetadataProbe, format_duration, format_size
+
 logger = logging.getLogger(__name__)
 
 
@@ -61,17 +65,8 @@ class BaseController:
         return ReplyKeyboardMarkup([["❌ لغو"]], resize_keyboard=True)
     
     def is_valid_url(self, url: str) -> bool:
-        """بررسی اعتبار URL"""
-        url_lower = url.lower().strip()
-        
-        if not re.match(r'^https?://', url_lower):
-            return False
-        
-        for platform in self.config.SUPPORTED_PLATFORMS:
-            if platform in url_lower:
-                return True
-        
-        return False
+        """بررسی اعتبار URL (لینک http یا https با دامنه یک پلتفرم پشتیبانی شده)"""
+        return match_platform(url) is not None
     
     def validate_txid(self, txid: str) -> bool:
         """اعتبارسنجی TXID"""
@@ -257,9 +252,37 @@ class UserController(BaseController):
 class DownloadController(BaseController):
     """کنترلر دانلود"""
     
-    def __init__(self, domain_manager, config):
+    QUALITY_LABELS = {
+        '360': "📹 360p",
+        '480': "📹 480p",
+        '720': "📹 720p (HD)",
+        '1080': "📹 1080p (FHD)",
+        'mp3': "🎵 MP3",
+        'mp4': "🎵 MP4",
+    }
+    
+    def __init__(self, domain_manager, config, probe: Optional[MetadataProbe] = None):
         super().__init__(domain_manager, config)
         self.WAITING_LINK = 1
+        
+        # بررسی واقعی لینک با probe مشترک (همان pool پردازه‌های DownloadController در app.py)؛
+        # بدون آن بررسی لینک شبیه‌سازی می‌شود
+        self.probe = probe
+    
+    def _quality_keyboard(self, qualities: Dict[str, Optional[float]]) -> InlineKeyboardMarkup:
+        """کیبورد انتخاب کیفیت (فقط کیفیت‌های موجود)"""
+        buttons = []
+        for quality, label in self.QUALITY_LABELS.items():
+            if quality not in qualities:
+                continue
+            size = qualities[quality]
+            if size:
+                label = f"{label} ~{format_size(size)}"
+            buttons.append(InlineKeyboardButton(label, callback_data=f"quality_{quality}"))
+        
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        keyboard.append([InlineKeyboardButton("❌ لغو", callback_data="cancel_download")])
+        return InlineKeyboardMarkup(keyboard)
     
     async def download_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور /download"""
@@ -350,35 +373,40 @@ class DownloadController(BaseController):
                     'platform': 'YouTube'
                 })()
             
-            # شبیه‌سازی بررسی لینک
-            await update.message.reply_text("🔍 در حال بررسی لینک...")
-            await asyncio.sleep(2)
+            status_message = await update.message.reply_text("🔍 در حال بررسی لینک...")
             
-            # کیبورد انتخاب کیفیت
-            keyboard = [
-                [
-                    InlineKeyboardButton("📹 360p", callback_data="quality_360"),
-                    InlineKeyboardButton("📹 480p", callback_data="quality_480")
-                ],
-                [
-                    InlineKeyboardButton("📹 720p (HD)", callback_data="quality_720"),
-                    InlineKeyboardButton("📹 1080p (FHD)", callback_data="quality_1080")
-                ],
-                [
-                    InlineKeyboardButton("🎵 MP3", callback_data="quality_mp3"),
-                    InlineKeyboardButton("🎵 MP4", callback_data="quality_mp4")
-                ],
-                [InlineKeyboardButton("❌ لغو", callback_data="cancel_download")]
-            ]
+            if self.probe is None:
+                # شبیه‌سازی بررسی لینک
+                await asyncio.sleep(2)
+                await status_message.edit_text(
+                    "✅ **ویدئو یافت شد!**\n\n"
+                    "📽️ **عنوان:** نمونه ویدئو آموزشی\n"
+                    "⏱️ **مدت:** ۵:۳۰ دقیقه\n"
+                    "📊 **حجم:** ~150MB\n"
+                    "🎬 **فرمت:** MP4\n\n"
+                    "👇 لطفاً کیفیت مورد نظر را انتخاب کنید:",
+                    reply_markup=self._quality_keyboard(dict.fromkeys(self.QUALITY_LABELS)),
+                    parse_mode='Markdown'
+                )
+                return ConversationHandler.END
             
-            await update.message.reply_text(
+            try:
+                media = await self.probe.probe(url)
+            except Exception as e:
+                logger.error(f"خطا در بررسی لینک {url}: {e}")
+                await status_message.edit_text("❌ بررسی لینک ناموفق بود. لطفاً دوباره تلاش کنید.")
+                return ConversationHandler.END
+            
+            if not media['qualities']:
+                await status_message.edit_text("❌ فرمت قابل دانلودی برای این لینک یافت نشد.")
+                return ConversationHandler.END
+            
+            await status_message.edit_text(
                 "✅ **ویدئو یافت شد!**\n\n"
-                "📽️ **عنوان:** نمونه ویدئو آموزشی\n"
-                "⏱️ **مدت:** ۵:۳۰ دقیقه\n"
-                "📊 **حجم:** ~150MB\n"
-                "🎬 **فرمت:** MP4\n\n"
+                f"📽️ **عنوان:** {escape_markdown(media['title'])}\n"
+                f"⏱️ **مدت:** {format_duration(media['duration'])}\n\n"
                 "👇 لطفاً کیفیت مورد نظر را انتخاب کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=self._quality_keyboard(media['qualities']),
                 parse_mode='Markdown'
             )
             
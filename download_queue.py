@@ -0,0 +1,389 @@
+"""
+download_queue.py - صف محدود کارهای دانلود با تعداد worker ثابت و سقف هم‌زمانی هر کاربر
+
+ترتیب اجرا بر اساس سطح اشتراک (اولویت وزن‌دار) و در هر سطح به صورت نوبتی
+بین کاربران (fair queuing) تعیین می‌شود.
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from core.bandwidth import BandwidthGovernor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """صف دانلود پر است"""
+
+
+class UserLimitError(Exception):
+    """کاربر به سقف دانلودهای هم‌زمان رسیده است"""
+
+
+@dataclass
+class DownloadJob:
+    """یک کار دانلود در صف"""
+    id: str
+    user_id: str
+    run: Callable[[], Awaitable[Any]]
+    tier: str = "free"
+    # کلید سقف هم‌زمانی پلتفرم (BandwidthGovernor.host_key)؛ None یعنی بدون سقف
+    host: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+
+
+class FairScheduler:
+    """زمان‌بند وزن‌دار بین سطح‌ها و نوبتی بین کاربران هر سطح
+    
+    بین سطح‌ها از stride scheduling استفاده می‌شود: هر سطح پس از هر نوبت به
+    اندازه 1/weight جلو می‌رود و سطح غیرخالی با کمترین مقدار انتخاب می‌شود؛
+    بنابراین سطح با وزن ۴ چهار برابر سطح با وزن ۱ نوبت می‌گیرد و هیچ سطحی
+    کاملاً گرسنه نمی‌ماند. در هر سطح کاربران به نوبت یک کار اجرا می‌کنند.
+    اگر ready داده شود، کارهای غیرآماده (مثلاً پلتفرم پر) رد می‌شوند و نوبت
+    صاحبانشان حفظ می‌شود.
+    """
+    
+    def __init__(self, weights: Dict[str, float] = None, default_tier: str = "free"):
+        self.weights = weights or {}
+        self.default_tier = default_tier
+        # سطح -> (کاربر -> کارهای در انتظار) به ترتیب نوبت
+        self._tiers: Dict[str, 'OrderedDict[str, Deque[DownloadJob]]'] = {}
+        self._pass: Dict[str, float] = {}
+        self._vtime = 0.0
+        self._size = 0
+        # شناسه کار -> جایگاه در ترتیب اجرا؛ با هر تغییر صف باطل می‌شود
+        self._positions: Optional[Dict[str, int]] = None
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def __iter__(self) -> Iterator[DownloadJob]:
+        """پیمایش کارهای در انتظار (بدون ترتیب اجرا)"""
+        for users in self._tiers.values():
+            for jobs in users.values():
+                yield from jobs
+    
+    def weight(self, tier: str) -> float:
+        return self.weights.get(tier, self.weights.get(self.default_tier, 1))
+    
+    def push(self, job: DownloadJob):
+        """افزودن کار"""
+        users = self._tiers.get(job.tier)
+        if not users:
+            users = self._tiers[job.tier] = OrderedDict()
+            # سطحی که خالی بوده برای مدت بیکاری اعتبار جمع نمی‌کند
+            self._pass[job.tier] = max(self._pass.get(job.tier, 0.0), self._vtime)
+        users.setdefault(job.user_id, deque()).append(job)
+        self._size += 1
+        self._positions = None
+    
+    @staticmethod
+    def _first_ready(jobs: Deque[DownloadJob], ready) -> Optional[DownloadJob]:
+        if ready is None:
+            return jobs[0] if jobs else None
+        return next((job for job in jobs if ready(job)), None)
+    
+    def _select(self, tiers, passes, ready=None) -> Optional[str]:
+        best = None
+        for tier, users in tiers.items():
+            if ready is not None and not any(self._first_ready(jobs, ready) for jobs in users.values()):
+                continue
+            if users and (best is None or
+                          (passes[tier], -self.weight(tier)) < (passes[best], -self.weight(best))):
+                best = tier
+        return best
+    
+    def _take(self, tiers, passes, ready=None) -> Tuple[DownloadJob, float]:
+        tier = self._select(tiers, passes, ready)
+        vtime = passes[tier]
+        passes[tier] = vtime + 1.0 / self.weight(tier)
+        
+        users = tiers[tier]
+        for user_id, jobs in users.items():
+            job = self._first_ready(jobs, ready)
+            if job is not None:
+                break
+        jobs.remove(job)
+        if jobs:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+        return job, vtime
+    
+    def has_ready(self, ready: Callable[[DownloadJob], bool] = None) -> bool:
+        """آیا کار آماده‌ای در صف هست؟"""
+        return self._select(self._tiers, self._pass, ready) is not None
+    
+    def pop(self, ready: Callable[[DownloadJob], bool] = None) -> DownloadJob:
+        """برداشتن کار بعدی (اولین کار آماده در ترتیب نوبت)"""
+        job, self._vtime = self._take(self._tiers, self._pass, ready)
+        self._size -= 1
+        self._positions = None
+        return job
+    
+    def order(self) -> List[DownloadJob]:
+        """ترتیب اجرای کارهای فعلی (روی کپی وضعیت شبیه‌سازی می‌شود)"""
+        tiers = {
+            tier: OrderedDict((user_id, deque(jobs)) for user_id, jobs in users.items())
+            for tier, users in self._tiers.items()
+        }
+        passes = dict(self._pass)
+        return [self._take(tiers, passes)[0] for _ in range(self._size)]
+    
+    def positions(self) -> Dict[str, int]:
+        """جایگاه هر کار در ترتیب اجرا (از ۱)
+        
+        شبیه‌سازی order() فقط یک بار پس از هر تغییر صف انجام می‌شود و
+        پرس‌وجوهای بعدی از همان نتیجه استفاده می‌کنند.
+        """
+        if self._positions is None:
+            self._positions = {job.id: index for index, job in enumerate(self.order(), 1)}
+        return self._positions
+    
+    def remove(self, job_id: str) -> Optional[DownloadJob]:
+        """حذف یک کار در انتظار"""
+        for users in self._tiers.values():
+            for user_id, jobs in users.items():
+                for job in jobs:
+                    if job.id == job_id:
+                        jobs.remove(job)
+                        if not jobs:
+                            del users[user_id]
+                        self._size -= 1
+                        self._positions = None
+                        return job
+        return None
+    
+    def clear(self) -> List[DownloadJob]:
+        """حذف تمام کارها"""
+        jobs = [job for users in self._tiers.values() for queue in users.values() for job in queue]
+        self._tiers.clear()
+        self._size = 0
+        self._positions = None
+        return jobs
+
+
+class DownloadQueue:
+    """صف دانلود
+    
+    حداکثر max_size کار در انتظار می‌ماند و workers کار به صورت هم‌زمان اجرا
+    می‌شوند. هر کاربر حداکثر per_user_limit کار (در صف یا در حال اجرا) دارد.
+    زمان انتظار بر اساس میانگین متحرک مدت اجرای کارها تخمین زده می‌شود و
+    زمان انتظار واقعی هر سطح برای محاسبه صدک‌ها نگه داشته می‌شود. با governor،
+    کاری که پلتفرمش به سقف دانلود هم‌زمان رسیده worker نمی‌گیرد و کارهای
+    بعدی صف به جای آن اجرا می‌شوند.
+    """
+    
+    # تعداد نمونه‌های زمان انتظار نگه‌داشته‌شده برای هر سطح
+    WAIT_SAMPLES = 1000
+    
+    def __init__(self, workers: int = 2, max_size: int = 100, per_user_limit: int = 1,
+                 default_duration: float = 60.0, weights: Dict[str, float] = None,
+                 governor: Optional[BandwidthGovernor] = None):
+        self.workers = workers
+        self.governor = governor
+        self.max_size = max_size
+        self.per_user_limit = per_user_limit
+        self.avg_duration = default_duration
+        self.completed_count = 0
+        self._waiting = FairScheduler(weights)
+        self._wait_times: Dict[str, Deque[float]] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._running = 0
+        # شناسه کار -> task در حال اجرای آن (برای لغو)
+        self._active: Dict[str, asyncio.Task] = {}
+        self._not_empty: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    @property
+    def waiting_count(self) -> int:
+        return len(self._waiting)
+    
+    @property
+    def running_count(self) -> int:
+        return self._running
+    
+    def user_in_flight(self, user_id: str) -> int:
+        """تعداد کارهای در صف یا در حال اجرای کاربر"""
+        return self._in_flight.get(user_id, 0)
+    
+    async def submit(self, job: DownloadJob, report_position: bool = True) -> Optional[int]:
+        """افزودن کار به صف و برگرداندن جایگاه آن (۰ یعنی worker آزاد است و فوراً شروع می‌شود)
+        
+        با report_position=False جایگاه محاسبه نمی‌شود (افزودن دسته‌ای کارها).
+        """
+        if self.user_in_flight(job.user_id) >= self.per_user_limit:
+            raise UserLimitError(f"حداکثر {self.per_user_limit} دانلود هم‌زمان مجاز است")
+        if len(self._waiting) >= self.max_size:
+            raise QueueFullError("صف دانلود پر است")
+        
+        self._in_flight[job.user_id] = self.user_in_flight(job.user_id) + 1
+        self._waiting.push(job)
+        position = None
+        if report_position:
+            position = max(0, self.position(job.id) - (self.workers - self._running))
+        
+        async with self._not_empty:
+            self._not_empty.notify()
+        return position
+    
+    def attach(self, job: DownloadJob) -> asyncio.Task:
+        """اجرای فوری کاری که به دانلود در جریان دیگری متصل می‌شود
+        
+        چنین کاری worker نمی‌گیرد (دانلود توسط کار دیگری انجام می‌شود) ولی مانند
+        submit در سقف هم‌زمانی کاربر شمرده می‌شود و با cancel قابل لغو است.
+        """
+        if self.user_in_flight(job.user_id) >= self.per_user_limit:
+            raise UserLimitError(f"حداکثر {self.per_user_limit} دانلود هم‌زمان مجاز است")
+        
+        self._in_flight[job.user_id] = self.user_in_flight(job.user_id) + 1
+        job.started_at = time.monotonic()
+        task = asyncio.get_running_loop().create_task(job.run())
+        self._active[job.id] = task
+        task.add_done_callback(lambda _task: self._finish_attached(job, _task))
+        return task
+    
+    def _finish_attached(self, job: DownloadJob, task: asyncio.Task):
+        if self._active.get(job.id) is task:
+            del self._active[job.id]
+        self._release(job.user_id)
+        if task.cancelled():
+            logger.info(f"🛑 کار دانلود {job.id} در حین اجرا لغو شد")
+        elif task.exception() is not None:
+            logger.error(f"خطا در اجرای کار دانلود {job.id}: {task.exception()}")
+    
+    def job_ids(self) -> List[str]:
+        """شناسه کارهای در صف و در حال اجرا"""
+        return [job.id for job in self._waiting] + list(self._active)
+    
+    def position(self, job_id: str) -> Optional[int]:
+        """جایگاه کار در ترتیب اجرا (از ۱)؛ None اگر در صف نباشد"""
+        return self._waiting.positions().get(job_id)
+    
+    def cancel(self, job_id: str) -> bool:
+        """لغو کار در صف یا در حال اجرا؛ False اگر کاری با این شناسه نباشد"""
+        job = self._waiting.remove(job_id)
+        if job is not None:
+            self._release(job.user_id)
+            logger.info(f"🛑 کار دانلود {job_id} پیش از شروع لغو شد")
+            return True
+        
+        task = self._active.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+            return True
+        return False
+    
+    def estimate_wait(self, position: int) -> float:
+        """تخمین زمان انتظار (ثانیه) برای کاری با جایگاه position در صف"""
+        if position <= 0:
+            return 0.0
+        rounds = -(-position // self.workers)
+        return rounds * self.avg_duration
+    
+    def start(self):
+        """شروع worker ها (باید داخل حلقه رویداد فراخوانی شود)"""
+        self._not_empty = asyncio.Condition()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"📋 صف دانلود با {self.workers} worker آماده است (ظرفیت {self.max_size})")
+    
+    def _ready(self, job: DownloadJob) -> bool:
+        return self.governor is None or job.host is None or self.governor.has_capacity(job.host)
+    
+    async def _next_job(self) -> DownloadJob:
+        async with self._not_empty:
+            await self._not_empty.wait_for(lambda: self._waiting.has_ready(self._ready))
+            job = self._waiting.pop(self._ready)
+            # جای پلتفرم پیش از گرفتن worker رزرو می‌شود
+            if self.governor is not None and job.host is not None:
+                self.governor.acquire(job.host)
+            return job
+    
+    async def _release_host(self, job: DownloadJob):
+        if self.governor is None or job.host is None:
+            return
+        self.governor.release(job.host)
+        # کار در انتظار همین پلتفرم اکنون می‌تواند شروع شود
+        async with self._not_empty:
+            self._not_empty.notify()
+    
+    async def _worker(self, index: int):
+        while True:
+            job = await self._next_job()
+            self._running += 1
+            job.started_at = time.monotonic()
+            self._record_wait(job.tier, job.started_at - job.enqueued_at)
+            # کار در task جداگانه اجرا می‌شود تا لغو آن worker را متوقف نکند
+            task = asyncio.get_running_loop().create_task(job.run())
+            self._active[job.id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                logger.info(f"🛑 کار دانلود {job.id} در حین اجرا لغو شد")
+            except Exception as e:
+                logger.error(f"خطا در اجرای کار دانلود {job.id}: {e}", exc_info=True)
+            finally:
+                self._active.pop(job.id, None)
+                self._running -= 1
+                self._release(job.user_id)
+                duration = time.monotonic() - job.started_at
+                # میانگین متحرک نمایی برای تخمین زمان انتظار
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+                self.completed_count += 1
+                await self._release_host(job)
+    
+    def _record_wait(self, tier: str, seconds: float):
+        samples = self._wait_times.get(tier)
+        if samples is None:
+            samples = self._wait_times[tier] = deque(maxlen=self.WAIT_SAMPLES)
+        samples.append(seconds)
+    
+    def wait_percentiles(self) -> Dict[str, Dict[str, float]]:
+        """صدک‌های زمان انتظار در صف (ثانیه) به تفکیک سطح"""
+        result = {}
+        for tier, samples in self._wait_times.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            pick = lambda p: ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+            result[tier] = {
+                'count': len(ordered),
+                'p50': pick(50),
+                'p90': pick(90),
+                'p99': pick(99),
+            }
+        return result
+    
+    def _release(self, user_id: str):
+        count = self._in_flight.get(user_id, 0) - 1
+        if count > 0:
+            self._in_flight[user_id] = count
+        else:
+            self._in_flight.pop(user_id, None)
+    
+    async def stop(self):
+        """توقف worker ها (کارهای در صف لغو می‌شوند)
+        
+        کارهای در حال اجرا (از جمله کارهای متصل با attach) لغو می‌شوند و تا پایان
+        پاک‌سازی آن‌ها صبر می‌شود.
+        """
+        for task in self._tasks:
+            task.cancel()
+        # کارهایی که با لغو worker در حال لغو هستند دوباره لغو نمی‌شوند تا پاک‌سازی‌شان قطع نشود
+        active = list(self._active.values())
+        for task in active:
+            if not task.cancelling():
+                task.cancel()
+        await asyncio.gather(*self._tasks, *active, return_exceptions=True)
+        self._tasks = []
+        for job in self._waiting.clear():
+            self._release(job.user_id)
@@ -0,0 +1,437 @@
+"""
+download_worker.py - اجرای yt-dlp در پردازه‌های جداگانه (خارج از حلقه رویداد بات)
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from core.bandwidth import BandwidthGovernor, SharedTokenBucket, throttle_hook
+
+try:
+    import yt_dlp
+    YTDLP_AVAILABLE = True
+except ImportError:
+    YTDLP_AVAILABLE = False
+
+# توقف فوری ffmpeg هنگام لغو دانلود (بدون psutil، لغو پس از پایان پردازش اعمال می‌شود)
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MEDIA_EXTENSIONS = ('.mp4', '.mp3', '.webm', '.mkv', '.m4a')
+
+# حداقل فاصله ارسال پیشرفت از پردازه worker (ثانیه)
+PROGRESS_INTERVAL = 1.0
+
+# فاصله بررسی درخواست لغو در پردازه worker (ثانیه)
+CANCEL_POLL_INTERVAL = 0.5
+
+
+# سطل توکن پهنای باند مشترک (در پردازه worker توسط _init_worker مقداردهی می‌شود)
+_bandwidth_bucket: Optional[SharedTokenBucket] = None
+
+
+def _init_worker(bucket: Optional[SharedTokenBucket]):
+    """initializer پردازه‌های worker"""
+    global _bandwidth_bucket
+    _bandwidth_bucket = bucket
+
+
+class DownloadTimeoutError(Exception):
+    """مهلت دانلود به پایان رسید"""
+
+
+class DownloadCancelledError(Exception):
+    """دانلود توسط کاربر لغو شد"""
+
+
+def _kill_children():
+    """توقف پردازه‌های فرزند پردازه worker (ffmpeg و دانلودکننده‌های خارجی)"""
+    if not PSUTIL_AVAILABLE:
+        return
+    for child in psutil.Process().children(recursive=True):
+        try:
+            child.kill()
+        except psutil.Error:
+            pass
+
+
+def _watch_cancel(cancel_event, cancelled: threading.Event, finished: threading.Event):
+    """انتظار برای درخواست لغو از پردازه بات (داخل پردازه worker)"""
+    while not finished.is_set():
+        try:
+            if cancel_event.wait(CANCEL_POLL_INTERVAL):
+                cancelled.set()
+                _kill_children()
+                return
+        except Exception:
+            # ارتباط با Manager قطع شده است
+            return
+
+
+def run_probe(url: str, ydl_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """استخراج اطلاعات لینک بدون دانلود (داخل پردازه worker اجرا می‌شود)"""
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp نصب نیست")
+    
+    opts = dict(ydl_opts)
+    opts['skip_download'] = True
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        # فقط داده‌های قابل تبدیل به JSON/pickle برگردانده می‌شوند
+        return ydl.sanitize_info(info)
+
+
+def _progress_hooks(progress_queue, job_id: int) -> Tuple[Callable, Callable]:
+    """hook های yt-dlp برای ارسال پیشرفت به پردازه بات از طریق صف Manager"""
+    last_sent = [0.0]
+    
+    def send(message: Dict[str, Any]):
+        message['job'] = job_id
+        try:
+            progress_queue.put(message)
+        except Exception:
+            # خطای ارسال پیشرفت نباید دانلود را متوقف کند
+            pass
+    
+    def on_download(status):
+        now = time.monotonic()
+        if status.get('status') == 'downloading' and now - last_sent[0] < PROGRESS_INTERVAL:
+            return
+        last_sent[0] = now
+        send({
+            'phase': 'download',
+            'status': status.get('status'),
+            'tmpfilename': status.get('tmpfilename'),
+            'downloaded': status.get('downloaded_bytes'),
+            'total': status.get('total_bytes') or status.get('total_bytes_estimate'),
+            'speed': status.get('speed'),
+            'eta': status.get('eta'),
+        })
+    
+    def on_postprocess(status):
+        if status.get('status') == 'started':
+            send({
+                'phase': 'postprocess',
+                'status': 'started',
+                'postprocessor': status.get('postprocessor'),
+            })
+    
+    return on_download, on_postprocess
+
+
+def run_ytdlp(url: str, ydl_opts: Dict[str, Any], output_dir: str,
+              deadline: float, info: Optional[Dict[str, Any]] = None,
+              progress_queue=None, job_id: int = 0, cancel_event=None) -> Dict[str, Any]:
+    """دانلود با yt-dlp (داخل پردازه worker اجرا می‌شود)
+    
+    مهلت دانلود و درخواست لغو (cancel_event) داخل خود پردازه با hook های
+    yt-dlp بررسی می‌شوند تا دانلود یا پردازش ffmpeg واقعاً متوقف شود. اگر
+    info (خروجی run_probe) داده شود، استخراج دوباره انجام نمی‌شود. در صورت
+    وجود progress_queue، پیشرفت دانلود و پردازش با شناسه job_id در آن قرار می‌گیرد.
+    """
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp نصب نیست")
+    
+    cancelled = threading.Event()
+    finished = threading.Event()
+    if cancel_event is not None:
+        threading.Thread(
+            target=_watch_cancel, args=(cancel_event, cancelled, finished), daemon=True
+        ).start()
+    
+    def check_deadline(_status):
+        if cancelled.is_set():
+            raise DownloadCancelledError("دانلود لغو شد")
+        if time.time() > deadline:
+            raise DownloadTimeoutError("مهلت دانلود به پایان رسید")
+    
+    progress_hooks = [check_deadline]
+    postprocessor_hooks = [check_deadline]
+    if _bandwidth_bucket is not None:
+        # سهم این دانلود از پهنای باند کل (صبر در همین thread دانلود)
+        progress_hooks.append(throttle_hook(
+            _bandwidth_bucket, lambda: cancelled.is_set() or time.time() > deadline
+        ))
+    if progress_queue is not None:
+        on_download, on_postprocess = _progress_hooks(progress_queue, job_id)
+        progress_hooks.append(on_download)
+        postprocessor_hooks.append(on_postprocess)
+    
+    opts = dict(ydl_opts)
+    opts['outtmpl'] = os.path.join(output_dir, '%(title)s.%(ext)s')
+    opts['progress_hooks'] = list(opts.get('progress_hooks', [])) + progress_hooks
+    opts['postprocessor_hooks'] = list(opts.get('postprocessor_hooks', [])) + postprocessor_hooks
+    
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            if info is not None:
+                info = ydl.process_ie_result(info, download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
+    finally:
+        finished.set()
+    
+    if cancelled.is_set():
+        raise DownloadCancelledError("دانلود لغو شد")
+    
+    file_path = _downloaded_file(info, output_dir)
+    if file_path is None:
+        raise RuntimeError("فایل دانلود شده یافت نشد")
+    
+    return {
+        'file_path': file_path,
+        'file_size': os.path.getsize(file_path),
+        'title': (info or {}).get('title'),
+        'duration': (info or {}).get('duration'),
+    }
+
+
+def _downloaded_file(info: Optional[Dict[str, Any]], output_dir: str) -> Optional[str]:
+    """مسیر فایل نهایی گزارش‌شده توسط yt-dlp (پس از ادغام و پردازش)
+    
+    اگر yt-dlp مسیر را گزارش نکند، بزرگ‌ترین فایل رسانه‌ای کامل پوشه انتخاب
+    می‌شود (فایل‌های .part، تصویر بندانگشتی و زیرنویس نادیده گرفته می‌شوند).
+    """
+    info = info or {}
+    candidates = [d.get('filepath') for d in info.get('requested_downloads') or []]
+    candidates += [info.get('filepath'), info.get('_filename')]
+    for path in candidates:
+        if path and os.path.isfile(path):
+            return path
+    
+    media = [
+        os.path.join(output_dir, name) for name in os.listdir(output_dir)
+        if name.endswith(MEDIA_EXTENSIONS)
+    ]
+    media = [path for path in media if os.path.isfile(path)]
+    return max(media, key=os.path.getsize, default=None)
+
+
+class DownloadExecutor:
+    """اجرای دانلودها در ProcessPoolExecutor با مهلت زمانی
+    
+    هر دانلود در پوشه موقت جداگانه‌ای زیر output_root انجام می‌شود و پس از
+    ارسال فایل باید با cleanup حذف شود. در صورت وجود governor، سرعت کل
+    دانلودها محدود می‌شود (سقف هم‌زمانی هر پلتفرم را صف دانلود اعمال می‌کند).
+    """
+    
+    # فرصت اضافه برای پایان پردازه پس از رسیدن به مهلت داخلی
+    TIMEOUT_GRACE = 30
+    
+    # فرصت توقف پردازه worker پس از لغو، پیش از حذف پوشه موقت
+    CANCEL_GRACE = 10
+    
+    def __init__(self, max_workers: int = 2, timeout: float = 900,
+                 output_root: Path = Path("downloads"), probe_timeout: float = 60,
+                 governor: Optional[BandwidthGovernor] = None, probe_workers: int = 2):
+        self.max_workers = max_workers
+        self.probe_workers = probe_workers
+        self.governor = governor
+        self.timeout = timeout
+        self.probe_timeout = probe_timeout
+        self.output_root = output_root
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # بررسی لینک‌ها pool جداگانه دارد تا پشت دانلودهای طولانی منتظر نماند
+        self._probe_pool: Optional[ProcessPoolExecutor] = None
+        
+        # پیشرفت دانلودها از پردازه‌های worker از طریق صف Manager دریافت می‌شود
+        self._manager = None
+        self._manager_lock = threading.Lock()
+        self._progress_queue = None
+        self._progress_thread: Optional[threading.Thread] = None
+        self._progress_callbacks: Dict[int, Tuple[asyncio.AbstractEventLoop, Callable]] = {}
+        self._job_ids = itertools.count(1)
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: پردازه‌های جدید thread ها و قفل‌های پردازه بات را به ارث نمی‌برند
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.governor.bucket if self.governor else None,)
+            )
+            logger.info(f"⚙️ pool دانلود با {self.max_workers} پردازه ایجاد شد")
+        return self._pool
+    
+    def _get_probe_pool(self) -> ProcessPoolExecutor:
+        if self._probe_pool is None:
+            self._probe_pool = ProcessPoolExecutor(
+                max_workers=self.probe_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"⚙️ pool بررسی لینک با {self.probe_workers} پردازه ایجاد شد")
+        return self._probe_pool
+    
+    def _get_manager(self):
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context('spawn').Manager()
+            return self._manager
+    
+    def _get_progress_queue(self):
+        if self._progress_queue is None:
+            self._progress_queue = self._get_manager().Queue()
+            self._progress_thread = threading.Thread(
+                target=self._relay_progress, args=(self._progress_queue,),
+                name="download-progress", daemon=True
+            )
+            self._progress_thread.start()
+        return self._progress_queue
+    
+    def _relay_progress(self, progress_queue):
+        """انتقال پیام‌های پیشرفت از صف به callback ها در حلقه رویداد"""
+        while True:
+            try:
+                message = progress_queue.get()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+            
+            entry = self._progress_callbacks.get(message.pop('job', None))
+            if entry is None:
+                continue
+            loop, callback = entry
+            try:
+                loop.call_soon_threadsafe(callback, message)
+            except RuntimeError:
+                # حلقه رویداد بسته شده است
+                pass
+    
+    async def probe(self, url: str, ydl_opts: Dict[str, Any]) -> Dict[str, Any]:
+        """استخراج اطلاعات لینک در پردازه worker بررسی لینک"""
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._get_probe_pool(), run_probe, url, ydl_opts)
+            return await asyncio.wait_for(future, timeout=self.probe_timeout)
+        except asyncio.TimeoutError:
+            raise DownloadTimeoutError("مهلت بررسی لینک به پایان رسید")
+        except BrokenProcessPool:
+            self._probe_pool = None
+            raise
+    
+    async def download(self, url: str, ydl_opts: Dict[str, Any],
+                       info: Optional[Dict[str, Any]] = None,
+                       progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       output_dir: Optional[str] = None) -> Dict[str, Any]:
+        """دانلود در پردازه worker و انتظار ناهمگام برای نتیجه
+        
+        progress (در صورت وجود) با هر پیام پیشرفت در حلقه رویداد فراخوانی می‌شود.
+        اگر output_dir داده شود (پوشه ثابت برای ادامه دانلود از فایل‌های .part)،
+        مسئولیت حذف آن با فراخوانی‌کننده است؛ در غیر این صورت پوشه موقت ساخته و
+        در صورت خطا یا لغو حذف می‌شود.
+        """
+        self.output_root.mkdir(parents=True, exist_ok=True)
+        owns_dir = output_dir is None
+        if owns_dir:
+            output_dir = tempfile.mkdtemp(prefix="dl_", dir=str(self.output_root))
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+        discard = (lambda: shutil.rmtree(output_dir, ignore_errors=True)) if owns_dir else (lambda: None)
+        
+        loop = asyncio.get_running_loop()
+        job_id = next(self._job_ids)
+        progress_queue = None
+        if progress is not None:
+            progress_queue = self._get_progress_queue()
+            self._progress_callbacks[job_id] = (loop, progress)
+        # رویداد لغو مشترک بین پردازه بات و پردازه worker
+        cancel_event = await loop.run_in_executor(None, lambda: self._get_manager().Event())
+        job = None
+        if self.governor is not None:
+            ydl_opts = self.governor.apply(ydl_opts)
+        deadline = time.time() + self.timeout
+        try:
+            job = self._get_pool().submit(
+                run_ytdlp, url, ydl_opts, output_dir, deadline, info,
+                progress_queue, job_id, cancel_event
+            )
+            return await asyncio.wait_for(
+                asyncio.wrap_future(job), timeout=self.timeout + self.TIMEOUT_GRACE
+            )
+        except asyncio.CancelledError:
+            # لغو: توقف پردازه worker و سپس حذف فایل‌های نیمه‌کاره
+            await self._stop_job(job, cancel_event, output_dir if owns_dir else None)
+            discard()
+            raise
+        except asyncio.TimeoutError:
+            # مهلت داخلی پردازه اعمال نشده (مثلاً ffmpeg بدون hook)؛ پردازه مثل لغو متوقف می‌شود
+            await self._stop_job(job, cancel_event, output_dir if owns_dir else None)
+            discard()
+            raise DownloadTimeoutError("مهلت دانلود به پایان رسید")
+        except BrokenProcessPool:
+            # پردازه worker از کار افتاده؛ pool در درخواست بعدی دوباره ساخته می‌شود
+            self._pool = None
+            discard()
+            raise
+        except BaseException:
+            discard()
+            raise
+        finally:
+            self._progress_callbacks.pop(job_id, None)
+    
+    async def _stop_job(self, job, cancel_event, output_dir: Optional[str]):
+        """لغو کار در صف pool یا درخواست توقف از پردازه worker در حال اجرا"""
+        if job is not None and not job.cancel():
+            cancel_event.set()
+            await self._wait_stopped(job, output_dir)
+    
+    async def _wait_stopped(self, job, output_dir: Optional[str]):
+        """انتظار محدود برای توقف کار لغوشده در پردازه worker"""
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), self.CANCEL_GRACE)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            # پردازه هنوز در حال اجراست؛ پوشه پس از پایان آن حذف می‌شود
+            if output_dir is not None:
+                job.add_done_callback(lambda _job: shutil.rmtree(output_dir, ignore_errors=True))
+        except Exception:
+            pass
+    
+    def cleanup(self, file_path: str):
+        """حذف فایل دانلود شده و پوشه موقت آن"""
+        job_dir = Path(file_path).parent
+        if job_dir.parent.resolve() == self.output_root.resolve():
+            shutil.rmtree(job_dir, ignore_errors=True)
+        elif os.path.exists(file_path):
+            os.remove(file_path)
+    
+    def shutdown(self):
+        """توقف pool ها (دانلودها و بررسی‌های در صف لغو می‌شوند)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._probe_pool is not None:
+            self._probe_pool.shutdown(wait=False, cancel_futures=True)
+            self._probe_pool = None
+        
+        if self._progress_queue is not None:
+            try:
+                self._progress_queue.put(None)
+            except Exception:
+                pass
+            self._progress_thread.join(timeout=2)
+            self._progress_queue = None
+            self._progress_thread = None
+        
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,130 @@
+"""
+file_id_cache.py - cache شناسه فایل‌های ارسال‌شده تلگرام (file_id) بر اساس لینک و کیفیت
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from core.json_storage import JsonStore, JournalStore
+from core.link_generator import canonical_key
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """cache پایدار (لینک، کیفیت) -> file_id تلگرام
+    
+    با برخورد به cache، همان file_id دوباره ارسال می‌شود و دانلود و آپلود
+    تکرار نمی‌شود. ورودی‌ها پس از ttl ثانیه منقضی و با رسیدن به max_entries
+    به ترتیب LRU حذف می‌شوند. هر تغییر یک خط به ژورنال اضافه می‌کند و فایل
+    کامل فقط هنگام compaction، بارگذاری و توقف نوشته می‌شود.
+    """
+    
+    def __init__(self, data_dir: Path, filename: str = "file_id_cache.json",
+                 max_entries: int = 10000, ttl: float = 30 * 86400,
+                 compact_threshold: int = 5000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.json_store = JsonStore(data_dir, indent=None)
+        # file_id از دست رفته فقط یعنی یک دانلود دوباره؛ fsync برای هر آپلود لازم نیست
+        self.journal = JournalStore(
+            data_dir, filename=f"{Path(filename).stem}.journal",
+            compact_threshold=compact_threshold, fsync=False
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._load()
+    
+    @staticmethod
+    def make_key(url: str, quality: str) -> str:
+        return f"{canonical_key(url)}|{quality}"
+    
+    def _load(self):
+        try:
+            data = self.json_store.load(self.filename, {})
+            replayed = self.journal.replay({'files': data})
+        except Exception as e:
+            logger.error(f"خطا در بارگذاری {self.filename}: {e}")
+            return
+        
+        now = time.time()
+        # ترتیب ذخیره‌شده همان ترتیب LRU است
+        for key, entry in data.items():
+            if now - entry.get('created_at', 0) < self.ttl:
+                self._entries[key] = entry
+        logger.info(f"🗂️ {len(self._entries)} فایل در cache شناسه فایل‌ها")
+        
+        # ژورنال در فایل اصلی ادغام می‌شود (ورودی‌های منقضی هم حذف می‌شوند)
+        if replayed:
+            self.flush()
+    
+    def _save(self, key: str, op: str = 'set'):
+        try:
+            self.journal.append('files', key, self._entries.get(key), op)
+            if self.journal.needs_compaction():
+                self.flush()
+        except Exception as e:
+            logger.error(f"خطا در ذخیره {self.filename}: {e}")
+    
+    def get(self, url: str, quality: str) -> Optional[Dict[str, Any]]:
+        """دریافت file_id ذخیره‌شده (در صورت وجود و عدم انقضا)"""
+        key = self.make_key(url, quality)
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry['created_at'] >= self.ttl:
+            del self._entries[key]
+            entry = None
+        
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        entry['hits'] = entry.get('hits', 0) + 1
+        self.hits += 1
+        return entry
+    
+    def put(self, url: str, quality: str, file_id: str, kind: str, **metadata):
+        """ذخیره file_id پس از آپلود موفق (kind: video, document, audio)"""
+        key = self.make_key(url, quality)
+        self._entries[key] = {
+            'file_id': file_id,
+            'kind': kind,
+            'created_at': time.time(),
+            'hits': 0,
+            **metadata
+        }
+        self._entries.move_to_end(key)
+        self._save(key)
+        
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._save(evicted, 'del')
+    
+    def invalidate(self, url: str, quality: str):
+        """حذف ورودی (مثلاً وقتی تلگرام file_id را نمی‌پذیرد)"""
+        key = self.make_key(url, quality)
+        if self._entries.pop(key, None) is not None:
+            self._save(key, 'del')
+    
+    def stats(self) -> Dict[str, Any]:
+        """آمار cache"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+    
+    def flush(self):
+        """نوشتن همگام تمام ورودی‌ها و خالی کردن ژورنال (compaction و توقف)"""
+        self.json_store.save(self.filename, dict(self._entries))
+        self.journal.reset()
@@ -0,0 +1,300 @@
+"""
+format_converter.py - سازگار کردن حجم فایل‌ها با محدودیت آپلود Bot API
+
+پیش از دانلود، با اطلاعات بررسی لینک فرمتی انتخاب می‌شود که در محدودیت آپلود
+جا شود؛ اگر فایل دانلودشده باز هم بزرگ‌تر باشد، با ffmpeg به چند بخش قابل پخش
+تقسیم یا با بیت‌ریت کمتر دوباره کدگذاری می‌شود.
+"""
+
+import os
+import shutil
+import asyncio
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metadata_probe import estimate_size
+
+logger = logging.getLogger(__name__)
+
+# محدودیت آپلود فایل در Bot API عمومی
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# فضای اضافه برای سربار container و درخواست multipart
+SIZE_MARGIN = 0.95
+
+STRATEGIES = ('fit', 'split', 'reencode')
+
+AUDIO_BITRATES = (192, 160, 128, 96, 64)
+
+# کمترین بیت‌ریت تصویر قابل قبول برای کدگذاری مجدد (kbps)
+MIN_VIDEO_BITRATE = 300
+REENCODE_AUDIO_BITRATE = 128
+
+FFMPEG_AVAILABLE = shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+class ConversionError(Exception):
+    """خطا در تبدیل یا تقسیم فایل"""
+
+
+@dataclass
+class ConversionPlan:
+    """نتیجه برنامه‌ریزی پیش از دانلود
+
+    format: انتخابگر فرمت yt-dlp (None یعنی انتخابگر پیش‌فرض کیفیت)
+    audio_quality: بیت‌ریت mp3 (kbps) برای FFmpegExtractAudio
+    action: direct (بدون تغییر)، fit (فرمت/بیت‌ریت کوچک‌تر)، split یا reencode
+    """
+    action: str = 'direct'
+    format: Optional[str] = None
+    audio_quality: Optional[int] = None
+    estimated_size: Optional[float] = None
+    height: Optional[int] = None
+
+
+@dataclass
+class PreparedUpload:
+    """فایل(های) آماده آپلود"""
+    parts: List[str]
+    work_dir: Optional[str] = None
+    converted: bool = False
+    sizes: List[int] = field(default_factory=list)
+
+    def cleanup(self):
+        """حذف فایل‌های موقت تبدیل (فایل اصلی دست نمی‌خورد)"""
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+
+
+class FormatConverter:
+    """انتخاب فرمت مناسب و تقسیم/کدگذاری مجدد فایل‌های بزرگ
+
+    strategy:
+      fit      - اگر کیفیت درخواستی جا نشود، کیفیت پایین‌تر انتخاب و در غیر این صورت تقسیم می‌شود
+      split    - کیفیت حفظ و فایل بزرگ به چند بخش تقسیم می‌شود
+      reencode - کیفیت تصویر حفظ و با بیت‌ریت کمتر کدگذاری می‌شود (در صورت عدم امکان، تقسیم)
+    """
+
+    def __init__(self, upload_limit: int = TELEGRAM_UPLOAD_LIMIT, strategy: str = 'fit',
+                 work_root: Path = Path("downloads"), split_attempts: int = 3):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy نامعتبر است: {strategy}")
+        self.upload_limit = upload_limit
+        self.strategy = strategy
+        self.work_root = work_root
+        self.split_attempts = split_attempts
+
+    @property
+    def target_size(self) -> float:
+        return self.upload_limit * SIZE_MARGIN
+
+    # ---------- پیش از دانلود ----------
+
+    def plan(self, info: Optional[Dict[str, Any]], quality: str) -> ConversionPlan:
+        """انتخاب فرمت بر اساس اطلاعات بررسی لینک"""
+        if not info:
+            return ConversionPlan()
+        if quality == 'mp3':
+            return self._plan_audio(info)
+        return self._plan_video(info, quality)
+
+    def _plan_audio(self, info: Dict[str, Any]) -> ConversionPlan:
+        duration = info.get('duration')
+        if not duration:
+            return ConversionPlan()
+
+        for bitrate in AUDIO_BITRATES:
+            size = bitrate * 1000 / 8 * duration
+            if size <= self.target_size:
+                action = 'direct' if bitrate == AUDIO_BITRATES[0] else 'fit'
+                if action == 'fit' and self.strategy == 'split':
+                    break
+                return ConversionPlan(action=action, audio_quality=bitrate, estimated_size=size)
+
+        return ConversionPlan(action='split', audio_quality=AUDIO_BITRATES[0],
+                              estimated_size=AUDIO_BITRATES[0] * 1000 / 8 * duration)
+
+    def _plan_video(self, info: Dict[str, Any], quality: str) -> ConversionPlan:
+        duration = info.get('duration')
+        formats = info.get('formats') or []
+        max_height = int(quality) if quality.isdigit() else None
+
+        videos = [
+            f for f in formats
+            if f.get('vcodec') not in (None, 'none') and f.get('height') and f.get('format_id')
+            and (max_height is None or f['height'] <= max_height)
+            and (quality != 'mp4' or f.get('ext') == 'mp4')
+        ]
+        audios = [
+            f for f in formats
+            if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none') and f.get('format_id')
+            and (quality != 'mp4' or f.get('ext') == 'm4a')
+        ]
+        if not videos:
+            return ConversionPlan()
+
+        # بهترین صدای موجود؛ حجم آن به حجم هر فرمت تصویر بدون صدا اضافه می‌شود
+        audio = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=None)
+        audio_size = (estimate_size(audio, duration) or 0) if audio else 0
+
+        candidates: List[Tuple[int, float, str]] = []
+        for fmt in videos:
+            size = estimate_size(fmt, duration)
+            if size is None:
+                continue
+            selector = fmt['format_id']
+            if fmt.get('acodec') in (None, 'none'):
+                if audio is None:
+                    continue
+                size += audio_size
+                selector = f"{fmt['format_id']}+{audio['format_id']}"
+            candidates.append((fmt['height'], size, selector))
+
+        if not candidates:
+            return ConversionPlan()
+
+        # بهترین کیفیت ابتدا (در ارتفاع یکسان، فرمت بزرگ‌تر = بیت‌ریت بیشتر)
+        candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+        best_height, best_size, best_selector = candidates[0]
+        if best_size <= self.target_size:
+            return ConversionPlan(action='direct', estimated_size=best_size, height=best_height)
+
+        if self.strategy == 'fit':
+            fitting = [c for c in candidates if c[1] <= self.target_size]
+            if fitting:
+                height, size, selector = fitting[0]
+                return ConversionPlan(action='fit', format=selector, estimated_size=size,
+                                      height=height)
+
+        action = 'split'
+        if self.strategy == 'reencode' and duration and self._video_bitrate(duration) >= MIN_VIDEO_BITRATE:
+            action = 'reencode'
+        return ConversionPlan(action=action, format=best_selector, estimated_size=best_size,
+                              height=best_height)
+
+    def _video_bitrate(self, duration: float) -> int:
+        """بیت‌ریت تصویر (kbps) برای رسیدن به حجم هدف"""
+        total_kbps = self.target_size * 8 / 1000 / duration
+        return int(total_kbps - REENCODE_AUDIO_BITRATE)
+
+    # ---------- پس از دانلود ----------
+
+    async def prepare(self, file_path: str, plan: Optional[ConversionPlan] = None) -> PreparedUpload:
+        """آماده‌سازی فایل برای آپلود (تقسیم یا کدگذاری مجدد در صورت نیاز)"""
+        size = os.path.getsize(file_path)
+        if size <= self.upload_limit:
+            return PreparedUpload(parts=[file_path], sizes=[size])
+
+        if not FFMPEG_AVAILABLE:
+            raise ConversionError("حجم فایل بیشتر از محدودیت آپلود است و ffmpeg نصب نیست")
+
+        duration = await probe_duration(file_path)
+        if not duration:
+            raise ConversionError("مدت فایل برای تقسیم مشخص نشد")
+
+        self.work_root.mkdir(parents=True, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix="cv_", dir=str(self.work_root))
+        prepared = PreparedUpload(parts=[], work_dir=work_dir, converted=True)
+        try:
+            reencode = (
+                (plan is not None and plan.action == 'reencode') or
+                (plan is None and self.strategy == 'reencode')
+            )
+            is_audio = Path(file_path).suffix.lower() in ('.mp3', '.m4a')
+            if reencode and not is_audio and self._video_bitrate(duration) >= MIN_VIDEO_BITRATE:
+                prepared.parts = [await self._reencode(file_path, duration, work_dir)]
+
+            if not prepared.parts or os.path.getsize(prepared.parts[0]) > self.upload_limit:
+                prepared.parts = await self._split(file_path, size, duration, work_dir)
+        except BaseException:
+            prepared.cleanup()
+            raise
+
+        prepared.sizes = [os.path.getsize(part) for part in prepared.parts]
+        logger.info(f"✂️ فایل {Path(file_path).name} ({size} بایت) به "
+                    f"{len(prepared.parts)} بخش آماده آپلود تبدیل شد")
+        return prepared
+
+    async def _split(self, file_path: str, size: int, duration: float,
+                     work_dir: str) -> List[str]:
+        """تقسیم بدون کدگذاری مجدد (copy) به بخش‌های مستقل قابل پخش
+
+        برش فقط روی keyframe انجام می‌شود، پس اندازه بخش‌ها بررسی و در صورت
+        نیاز با طول کوتاه‌تر دوباره تقسیم می‌شود.
+        """
+        suffix = Path(file_path).suffix or '.mp4'
+        segment_time = duration * self.target_size / size
+
+        for attempt in range(self.split_attempts):
+            for name in os.listdir(work_dir):
+                if name.startswith('part_'):
+                    os.remove(os.path.join(work_dir, name))
+
+            pattern = os.path.join(work_dir, f"part_%03d{suffix}")
+            await run_ffmpeg(
+                '-i', file_path, '-map', '0', '-c', 'copy',
+                '-f', 'segment', '-segment_time', f"{segment_time:.2f}",
+                '-reset_timestamps', '1', pattern
+            )
+            parts = sorted(
+                os.path.join(work_dir, name) for name in os.listdir(work_dir)
+                if name.startswith('part_')
+            )
+            largest = max((os.path.getsize(p) for p in parts), default=0)
+            if parts and largest <= self.upload_limit:
+                return parts
+
+            segment_time *= 0.8 * self.upload_limit / max(largest, 1)
+            logger.info(f"✂️ بخش‌ها بزرگ‌تر از محدودیت بودند؛ تقسیم دوباره (تلاش {attempt + 2})")
+
+        raise ConversionError("تقسیم فایل به بخش‌های کوچک‌تر از محدودیت آپلود ممکن نشد")
+
+    async def _reencode(self, file_path: str, duration: float, work_dir: str) -> str:
+        """کدگذاری مجدد H.264/AAC با بیت‌ریت متناسب با حجم هدف"""
+        bitrate = self._video_bitrate(duration)
+        output = os.path.join(work_dir, Path(file_path).stem + ".mp4")
+        await run_ffmpeg(
+            '-i', file_path,
+            '-c:v', 'libx264', '-preset', 'veryfast',
+            '-b:v', f"{bitrate}k", '-maxrate', f"{bitrate}k", '-bufsize', f"{bitrate * 2}k",
+            '-c:a', 'aac', '-b:a', f"{REENCODE_AUDIO_BITRATE}k",
+            '-movflags', '+faststart', output
+        )
+        return output
+
+
+async def _run(*args: str) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        message = stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise ConversionError(f"{args[0]} ناموفق بود: {message[-1] if message else process.returncode}")
+    return stdout
+
+
+async def run_ffmpeg(*args: str):
+    """اجرای ffmpeg بدون مسدود کردن حلقه رویداد"""
+    await _run('ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *args)
+
+
+async def probe_duration(file_path: str) -> Optional[float]:
+    """مدت فایل با ffprobe"""
+    output = await _run(
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1', file_path
+    )
+    try:
+        return float(output.strip())
+    except ValueError:
+        return None
@@ -0,0 +1,271 @@
+"""
+json_storage.py - ذخیره‌سازی ناهمگام و اتمیک فایل‌های JSON و ژورنال افزایشی تغییرات
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+# encoder سریع‌تر در صورت نصب بودن ujson
+try:
+    import ujson
+    UJSON_AVAILABLE = True
+except ImportError:
+    UJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# thread های مخصوص I/O فایل‌ها تا حلقه رویداد هنگام نوشتن مسدود نشود
+_io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="json-io")
+
+
+def dumps(data: Any, indent: Optional[int] = None) -> str:
+    """تبدیل به JSON با ujson (در صورت وجود) و بازگشت به json استاندارد"""
+    if UJSON_AVAILABLE:
+        try:
+            return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False,
+                               indent=indent or 0)
+        except (TypeError, OverflowError):
+            pass
+    if indent is None:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(data, ensure_ascii=False, indent=indent)
+
+
+def loads(text: str) -> Any:
+    """خواندن JSON"""
+    if UJSON_AVAILABLE:
+        try:
+            return ujson.loads(text)
+        except ValueError:
+            pass
+    return json.loads(text)
+
+
+def write_text_atomic(file_path: Path, text: str):
+    """نوشتن اتمیک فایل (فایل موقت + fsync + جایگزینی)
+    
+    در صورت توقف ناگهانی، فایل قبلی سالم باقی می‌ماند.
+    """
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    
+    # ثبت جایگزینی در پوشه (در ویندوز پشتیبانی نمی‌شود)
+    try:
+        dir_fd = os.open(str(file_path.parent), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_json_atomic(file_path: Path, data: Any, indent: Optional[int] = 2):
+    """نوشتن فایل JSON به صورت اتمیک"""
+    write_text_atomic(file_path, dumps(data, indent))
+
+
+class JsonStore:
+    """ذخیره‌ساز JSON اتمیک با نوشتن خارج از حلقه رویداد
+    
+    هر نوشتن شماره ترتیب دارد؛ اگر نوشتن جدیدتری برای همان فایل زمان‌بندی یا
+    انجام شده باشد، نوشتن قدیمی‌تر انجام نمی‌شود تا داده کهنه جایگزین داده جدید نشود.
+    """
+    
+    def __init__(self, data_dir: Path, indent: Optional[int] = 2):
+        self.data_dir = data_dir
+        self.indent = indent
+        self._lock = threading.Lock()
+        self._file_locks: Dict[str, threading.Lock] = {}
+        self._seq = 0
+        self._scheduled: Dict[str, int] = {}
+        self._written: Dict[str, int] = {}
+        self._futures: Set[Future] = set()
+    
+    def load(self, filename: str, default: Any = None) -> Any:
+        """بارگذاری فایل JSON"""
+        file_path = self.data_dir / filename
+        if not file_path.exists():
+            return default
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return loads(f.read())
+    
+    def _next_seq(self, filename: str) -> int:
+        with self._lock:
+            self._seq += 1
+            self._scheduled[filename] = self._seq
+            if filename not in self._file_locks:
+                self._file_locks[filename] = threading.Lock()
+            return self._seq
+    
+    def _write(self, filename: str, data: Any, seq: int) -> bool:
+        # نوشتن جدیدتری در صف است؛ این نسخه لازم نیست
+        if seq < self._scheduled.get(filename, 0):
+            return False
+        
+        text = dumps(data, self.indent)
+        with self._file_locks[filename]:
+            if seq <= self._written.get(filename, 0):
+                return False
+            write_text_atomic(self.data_dir / filename, text)
+            self._written[filename] = seq
+        return True
+    
+    def save(self, filename: str, data: Any):
+        """ذخیره همگام و اتمیک"""
+        self._write(filename, data, self._next_seq(filename))
+    
+    def submit(self, filename: str, data: Any) -> Future:
+        """زمان‌بندی ذخیره در thread های I/O
+        
+        data نباید پس از فراخوانی تغییر کند (یک کپی/دیکشنری تازه ارسال شود).
+        """
+        future = _io_executor.submit(self._write, filename, data, self._next_seq(filename))
+        self._futures.add(future)
+        future.add_done_callback(self._on_done)
+        return future
+    
+    async def save_async(self, filename: str, data: Any):
+        """ذخیره ناهمگام و اتمیک"""
+        await asyncio.wrap_future(self.submit(filename, data))
+    
+    def save_background(self, filename: str, data: Any):
+        """ذخیره در پس‌زمینه اگر حلقه رویداد در حال اجرا باشد، در غیر این صورت همگام"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.save(filename, data)
+            return
+        self.submit(filename, data)
+    
+    def _on_done(self, future: Future):
+        self._futures.discard(future)
+        error = future.exception()
+        if error is not None:
+            logger.error(f"خطا در ذخیره فایل JSON: {error}")
+    
+    def flush(self, timeout: Optional[float] = None):
+        """انتظار برای پایان تمام نوشتن‌های در جریان"""
+        pending = list(self._futures)
+        if pending:
+            wait(pending, timeout=timeout)
+    
+    async def drain(self):
+        """انتظار ناهمگام برای پایان نوشتن‌های در جریان"""
+        pending = list(self._futures)
+        if pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pending),
+                                 return_exceptions=True)
+
+
+class JournalStore:
+    """ژورنال افزایشی (append-only) تغییرات
+
+    هر تغییر به صورت یک خط JSON فشرده به انتهای فایل اضافه می‌شود و
+    snapshot کامل فقط هنگام compaction نوشته می‌شود.
+
+    با fsync=True هر append (یا هر دسته در append_many) پیش از بازگشت روی دیسک
+    نوشته می‌شود و رکورد تأییدشده با قطع برق هم از دست نمی‌رود. با fsync=False
+    فقط بافر پایتون خالی می‌شود: سریع‌تر است، ولی رکوردهایی که هنوز در cache
+    سیستم‌عامل هستند ممکن است با خاموشی ناگهانی سیستم از بین بروند.
+    """
+
+    def __init__(self, data_dir: Path, filename: str = "data.journal",
+                 compact_threshold: int = 5000, fsync: bool = True):
+        self.path = data_dir / filename
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.entries = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def replay(self, collections: Dict[str, Dict]) -> int:
+        """اعمال رکوردهای ژورنال روی داده‌های snapshot"""
+        if not self.path.exists():
+            return 0
+
+        applied = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = loads(line)
+                except ValueError:
+                    # خط ناقص انتهای فایل (توقف ناگهانی هنگام نوشتن)
+                    logger.warning(f"⚠️ رکورد ناقص در ژورنال نادیده گرفته شد: {self.path}")
+                    break
+
+                target = collections.get(record.get('c'))
+                if target is None:
+                    continue
+
+                # رکورد بازنویسی‌شده به انتها منتقل می‌شود (ترتیب آخرین نوشتن، مثلاً برای LRU)
+                target.pop(record['k'], None)
+                if record.get('op') != 'del':
+                    target[record['k']] = record['v']
+                applied += 1
+
+        self.entries = applied
+        return applied
+
+    @staticmethod
+    def _line(collection: str, key: str, value: Any, op: str) -> str:
+        record = {'op': op, 'c': collection, 'k': key}
+        if op != 'del':
+            record['v'] = value
+        return dumps(record) + '\n'
+
+    def _write_lines(self, lines: List[str]):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.writelines(lines)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.entries += len(lines)
+
+    def append(self, collection: str, key: str, value: Any = None, op: str = 'set'):
+        """افزودن یک رکورد به ژورنال"""
+        self._write_lines([self._line(collection, key, value, op)])
+
+    def append_many(self, records: Iterable[Tuple[str, str, Any]]):
+        """افزودن دسته‌ای رکوردها (collection، key، value) با یک fsync"""
+        lines = [self._line(collection, key, value, 'set') for collection, key, value in records]
+        if lines:
+            self._write_lines(lines)
+
+    def needs_compaction(self) -> bool:
+        """آیا ژورنال به حد compaction رسیده است؟"""
+        return self.entries >= self.compact_threshold
+
+    def reset(self):
+        """خالی کردن ژورنال پس از نوشتن snapshot"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+            self.entries = 0
+
+    def close(self):
+        """بستن فایل ژورنال"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,273 @@
+"""
+link_generator.py - یکسان‌سازی لینک‌ها به کلید پایدار (پلتفرم، شناسه رسانه)
+
+یک ویدئو با شکل‌های مختلف لینک می‌رسد (youtu.be/X، youtube.com/watch?v=X&si=...،
+m.youtube.com/shorts/X، لینک‌های دارای utm و igshid و ...). canonicalize همه این
+شکل‌ها را به یک MediaKey تبدیل می‌کند تا cacheها، یکی‌سازی دانلودها و آمار بر اساس
+محتوای واقعی کار کنند. برای لینک‌هایی که شکل آن‌ها شناخته‌شده نیست، لینک
+یکسان‌سازی‌شده (دامنه کوچک، بدون fragment و پارامترهای ردیابی) شناسه رسانه است.
+
+match_platform پلتفرم لینک را فقط از روی دامنه آن تشخیص می‌دهد (دامنه یا یکی
+از زیردامنه‌های آن)؛ لینکی مانند https://evil.example/?q=youtube.com پذیرفته نمی‌شود.
+"""
+
+import re
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, Dict, NamedTuple, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# پارامترهای ردیابی که در محتوای لینک تأثیری ندارند
+TRACKING_PREFIXES = ('utm_',)
+TRACKING_PARAMS = frozenset({'fbclid', 'gclid', 'igshid', 'igsh', 'si', 'feature', 'ref', 'ref_src', 'mibextid'})
+
+# پیشوندهای زیردامنه که محتوای متفاوتی ندارند
+_HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'music.')
+
+
+class Platform(Enum):
+    """پلتفرم‌های پشتیبانی شده"""
+    YOUTUBE = "youtube"
+    INSTAGRAM = "instagram"
+    TIKTOK = "tiktok"
+    TWITTER = "twitter"
+    FACEBOOK = "facebook"
+    REDDIT = "reddit"
+    DAILYMOTION = "dailymotion"
+    VIMEO = "vimeo"
+    TWITCH = "twitch"
+    
+    @property
+    def label(self) -> str:
+        """نام نمایشی پلتفرم"""
+        return PLATFORM_LABELS[self]
+
+
+PLATFORM_LABELS = {
+    Platform.YOUTUBE: "YouTube",
+    Platform.INSTAGRAM: "Instagram",
+    Platform.TIKTOK: "TikTok",
+    Platform.TWITTER: "Twitter",
+    Platform.FACEBOOK: "Facebook",
+    Platform.REDDIT: "Reddit",
+    Platform.DAILYMOTION: "Dailymotion",
+    Platform.VIMEO: "Vimeo",
+    Platform.TWITCH: "Twitch",
+}
+
+# دامنه -> پلتفرم (زیردامنه‌ها مانند m.، vm. و clips. هم پذیرفته می‌شوند)
+PLATFORM_HOSTS = {
+    'youtube.com': Platform.YOUTUBE,
+    'youtu.be': Platform.YOUTUBE,
+    'youtube-nocookie.com': Platform.YOUTUBE,
+    'instagram.com': Platform.INSTAGRAM,
+    'instagr.am': Platform.INSTAGRAM,
+    'tiktok.com': Platform.TIKTOK,
+    'twitter.com': Platform.TWITTER,
+    'x.com': Platform.TWITTER,
+    'facebook.com': Platform.FACEBOOK,
+    'fb.watch': Platform.FACEBOOK,
+    'reddit.com': Platform.REDDIT,
+    'redd.it': Platform.REDDIT,
+    'dailymotion.com': Platform.DAILYMOTION,
+    'dai.ly': Platform.DAILYMOTION,
+    'vimeo.com': Platform.VIMEO,
+    'twitch.tv': Platform.TWITCH,
+}
+
+# scheme و دامنه لینک (بدون اطلاعات کاربری و پورت)
+_URL_HOST = re.compile(r'\s*https?://(?:[^/?#@]*@)?([^/?#:\s]+)', re.IGNORECASE)
+
+_YOUTUBE_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_YOUTUBE_PATH = re.compile(r'^/(?:shorts|embed|live|v|e)/([A-Za-z0-9_-]{11})(?:/|$)')
+_INSTAGRAM_PATH = re.compile(r'^/(?:[^/]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)')
+_TIKTOK_PATH = re.compile(r'^/(?:@[^/]+/(?:video|photo)|v|embed(?:/v2)?)/(\d+)')
+_TWITTER_PATH = re.compile(r'^/(?:[^/]+|i(?:/web)?)/status(?:es)?/(\d+)')
+_FACEBOOK_PATH = re.compile(r'^/(?:[^/]+/videos/(?:[^/]+/)?|reel/)(\d+)')
+_REDDIT_PATH = re.compile(r'^/(?:r/[^/]+/)?comments/([a-z0-9]+)', re.IGNORECASE)
+_DAILYMOTION_PATH = re.compile(r'^/(?:embed/)?video/([a-z0-9]+)', re.IGNORECASE)
+_VIMEO_PATH = re.compile(r'^/(?:video/|(?:[^/]+/)*)(\d+)(?:/|$)')
+_TWITCH_CLIP_PATH = re.compile(r'^/(?:[^/]+/clip/)?([A-Za-z0-9_-]+)')
+_TWITCH_VIDEO_PATH = re.compile(r'^/(?:videos|[^/]+/v)/(\d+)')
+
+
+class PlatformMatcher:
+    """تشخیص پلتفرم از روی دامنه با جستجوی پسوندها در دیکشنری
+    
+    برای دامنه a.b.youtube.com فقط پسوندهای a.b.youtube.com، b.youtube.com،
+    youtube.com و com جستجو می‌شوند؛ هزینه مستقل از تعداد دامنه‌هاست و نتیجه
+    هر دامنه در cache نگه داشته می‌شود.
+    """
+    
+    def __init__(self, hosts: Dict[str, Platform], cache_size: int = 1024):
+        self._hosts = {host.lower().strip('.'): platform for host, platform in hosts.items()}
+        self.match_host = lru_cache(maxsize=cache_size)(self._match_host)
+    
+    def _match_host(self, host: str) -> Optional[Platform]:
+        """پلتفرم دامنه (None برای دامنه‌های پشتیبانی‌نشده)"""
+        host = host.lower().rstrip('.')
+        hosts = self._hosts
+        while True:
+            platform = hosts.get(host)
+            if platform is not None:
+                return platform
+            dot = host.find('.')
+            if dot < 0:
+                return None
+            host = host[dot + 1:]
+    
+    def match(self, url: str) -> Optional[Platform]:
+        """پلتفرم لینک http یا https (None برای لینک نامعتبر یا پشتیبانی‌نشده)"""
+        found = _URL_HOST.match(url)
+        if found is None:
+            return None
+        return self.match_host(found.group(1))
+
+
+_MATCHER = PlatformMatcher(PLATFORM_HOSTS)
+
+
+def match_platform(url: str) -> Optional[Platform]:
+    """پلتفرم لینک http یا https (None برای لینک نامعتبر یا پشتیبانی‌نشده)"""
+    return _MATCHER.match(url)
+
+
+def platform_for_host(host: str) -> Optional[Platform]:
+    """پلتفرم دامنه (None برای دامنه‌های پشتیبانی‌نشده)"""
+    return _MATCHER.match_host(host)
+
+
+class MediaKey(NamedTuple):
+    """کلید پایدار یک رسانه"""
+    platform: str
+    media_id: str
+
+    def __str__(self) -> str:
+        return f"{self.platform}:{self.media_id}"
+
+
+def normalize_host(host: str) -> str:
+    """دامنه کوچک بدون پورت و پیشوندهای www.، m. و ..."""
+    host = host.lower().rsplit('@', 1)[-1].split(':', 1)[0].rstrip('.')
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+def _clean_query(query: str) -> Dict[str, str]:
+    return {
+        k: v for k, v in parse_qsl(query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith(TRACKING_PREFIXES)
+    }
+
+
+def _normalized_url(host: str, path: str, query: str) -> str:
+    """یکسان‌سازی عمومی لینک (برای شکل‌های ناشناخته)"""
+    return urlunsplit(('https', host, path.rstrip('/'), urlencode(sorted(_clean_query(query).items())), ''))
+
+
+def _match(pattern: re.Pattern, path: str) -> Optional[str]:
+    found = pattern.match(path)
+    return found.group(1) if found else None
+
+
+def _youtube(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'youtu.be':
+        video_id = path.strip('/').split('/', 1)[0]
+        return video_id if _YOUTUBE_ID.match(video_id) else None
+    if path.rstrip('/') in ('/watch', '/watch_videos'):
+        video_id = _clean_query(query).get('v', '')
+        return video_id if _YOUTUBE_ID.match(video_id) else None
+    if path.rstrip('/') == '/playlist':
+        playlist = _clean_query(query).get('list')
+        return f"playlist/{playlist}" if playlist else None
+    return _match(_YOUTUBE_PATH, path)
+
+
+def _instagram(host: str, path: str, query: str) -> Optional[str]:
+    return _match(_INSTAGRAM_PATH, path)
+
+
+def _tiktok(host: str, path: str, query: str) -> Optional[str]:
+    # لینک‌های کوتاه بدون درخواست شبکه قابل تبدیل به شناسه ویدئو نیستند
+    if host in ('vm.tiktok.com', 'vt.tiktok.com') or path.startswith('/t/'):
+        code = path.strip('/').split('/')[-1]
+        return f"short/{code}" if code else None
+    return _match(_TIKTOK_PATH, path)
+
+
+def _twitter(host: str, path: str, query: str) -> Optional[str]:
+    return _match(_TWITTER_PATH, path)
+
+
+def _facebook(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'fb.watch':
+        code = path.strip('/').split('/', 1)[0]
+        return f"short/{code}" if code else None
+    if path.rstrip('/') in ('/watch', '/video.php'):
+        return _clean_query(query).get('v') or None
+    return _match(_FACEBOOK_PATH, path)
+
+
+def _reddit(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'redd.it':
+        post_id = path.strip('/').split('/', 1)[0]
+        return post_id.lower() or None
+    post_id = _match(_REDDIT_PATH, path)
+    return post_id.lower() if post_id else None
+
+
+def _dailymotion(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'dai.ly':
+        return path.strip('/').split('/', 1)[0] or None
+    return _match(_DAILYMOTION_PATH, path)
+
+
+def _vimeo(host: str, path: str, query: str) -> Optional[str]:
+    return _match(_VIMEO_PATH, path)
+
+
+def _twitch(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'clips.twitch.tv' or '/clip/' in path:
+        slug = _match(_TWITCH_CLIP_PATH, path)
+        return f"clip/{slug}" if slug else None
+    video_id = _match(_TWITCH_VIDEO_PATH, path)
+    return f"video/{video_id}" if video_id else None
+
+
+# پلتفرم -> استخراج شناسه رسانه از (دامنه، مسیر، query)
+_EXTRACTORS: Dict[Platform, Callable[[str, str, str], Optional[str]]] = {
+    Platform.YOUTUBE: _youtube,
+    Platform.INSTAGRAM: _instagram,
+    Platform.TIKTOK: _tiktok,
+    Platform.TWITTER: _twitter,
+    Platform.FACEBOOK: _facebook,
+    Platform.REDDIT: _reddit,
+    Platform.DAILYMOTION: _dailymotion,
+    Platform.VIMEO: _vimeo,
+    Platform.TWITCH: _twitch,
+}
+
+
+@lru_cache(maxsize=4096)
+def canonicalize(url: str) -> MediaKey:
+    """تبدیل لینک به کلید پایدار (پلتفرم، شناسه رسانه)
+
+    نتیجه برای لینک‌های تکراری از cache برگردانده می‌شود؛ لینک نامعتبر یا
+    پلتفرم ناشناخته با platform='other' و لینک یکسان‌سازی‌شده برگردانده می‌شود.
+    """
+    parts = urlsplit(url.strip())
+    host = normalize_host(parts.netloc)
+    platform = _MATCHER.match_host(host) if host else None
+    if platform is None:
+        return MediaKey('other', _normalized_url(host, parts.path, parts.query))
+    media_id = _EXTRACTORS[platform](host, parts.path, parts.query)
+    if media_id:
+        return MediaKey(platform.value, media_id)
+    return MediaKey(platform.value, _normalized_url(host, parts.path, parts.query))
+
+
+def canonical_key(url: str) -> str:
+    """کلید متنی لینک برای cacheها و یکی‌سازی (platform:media_id)"""
+    return str(canonicalize(url))
@@ -0,0 +1,271 @@
+"""
+media_cache.py - cache محتوامحور فایل‌های دانلود شده روی دیسک با سقف حجم
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from core.json_storage import JsonStore
+from core.link_generator import canonical_key
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """cache فایل‌های دانلود شده
+    
+    هر فایل با hash محتوایش (sha256) در objects/ ذخیره می‌شود و index کلید
+    (لینک، کیفیت) را به hash نگاشت می‌کند؛ فایل‌های یکسان برای کلیدهای مختلف
+    فقط یک بار ذخیره می‌شوند. با عبور حجم کل از max_bytes، کلیدها به ترتیب
+    LRU (یا LFU) حذف و فایل‌های بدون ارجاع پاک می‌شوند.
+    
+    index به صورت اتمیک نوشته می‌شود و هنگام راه‌اندازی با محتوای واقعی پوشه
+    تطبیق داده می‌شود (فایل‌های یتیم و ورودی‌های بدون فایل حذف می‌شوند).
+    
+    فایلی که با pin=True از get یا put گرفته شده تا فراخوانی unpin (پایان
+    آماده‌سازی و آپلود) حذف نمی‌شود: eviction از آن رد می‌شود و حذف آن با
+    invalidate تا آزاد شدن آخرین pin به تعویق می‌افتد.
+    """
+    
+    INDEX_FILE = "index.json"
+    
+    def __init__(self, root: Path, max_bytes: int = 5 * 1024 ** 3, policy: str = "lru"):
+        self.root = root
+        self.objects_dir = root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.json_store = JsonStore(root, indent=None)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        # کلید -> {'hash', 'ext', 'size', 'last_access', 'hits', ...}
+        self._index: Dict[str, Dict[str, Any]] = {}
+        # hash -> تعداد کلیدهای ارجاع‌دهنده
+        self._refs: Dict[str, int] = {}
+        # مسیر فایل -> تعداد کارهای در حال استفاده از آن
+        self._pins: Dict[str, int] = {}
+        # فایل‌های بدون ارجاعی که تا آزاد شدن pin حذف نمی‌شوند
+        self._deferred: Set[str] = set()
+        self.total_bytes = 0
+        self._rebuild()
+    
+    @staticmethod
+    def make_key(url: str, quality: str) -> str:
+        return f"{canonical_key(url)}|{quality}"
+    
+    @staticmethod
+    def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """hash محتوای فایل"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _object_path(self, file_hash: str, ext: str) -> Path:
+        return self.objects_dir / file_hash[:2] / f"{file_hash}{ext}"
+    
+    def _rebuild(self):
+        """بارگذاری index و تطبیق آن با فایل‌های موجود روی دیسک"""
+        try:
+            index = self.json_store.load(self.INDEX_FILE, {}) or {}
+        except Exception as e:
+            logger.error(f"خطا در بارگذاری index cache فایل‌ها، بازسازی از صفر: {e}")
+            index = {}
+        
+        # فایل‌های واقعی موجود روی دیسک
+        on_disk: Dict[str, Path] = {}
+        for path in self.objects_dir.glob("*/*"):
+            if path.name.endswith(".tmp"):
+                # کپی ناقص پیش از توقف ناگهانی
+                path.unlink(missing_ok=True)
+                continue
+            on_disk[path.name] = path
+        
+        dropped = 0
+        for key, entry in index.items():
+            path = self._object_path(entry.get('hash', ''), entry.get('ext', ''))
+            if path.name in on_disk and path.stat().st_size == entry.get('size'):
+                self._index[key] = entry
+                self._refs[entry['hash']] = self._refs.get(entry['hash'], 0) + 1
+            else:
+                dropped += 1
+        
+        # فایل‌هایی که در index نیستند قابل دسترسی نیستند و حذف می‌شوند
+        referenced = {self._object_path(e['hash'], e['ext']).name for e in self._index.values()}
+        orphans = [p for name, p in on_disk.items() if name not in referenced]
+        for path in orphans:
+            path.unlink(missing_ok=True)
+        
+        sizes = {}
+        for entry in self._index.values():
+            sizes[entry['hash']] = entry['size']
+        self.total_bytes = sum(sizes.values())
+        
+        if dropped or orphans:
+            logger.warning(f"🧹 cache فایل‌ها بازسازی شد: {dropped} ورودی نامعتبر، {len(orphans)} فایل یتیم")
+            self._save_index()
+        logger.info(f"💽 cache فایل‌ها: {len(self._index)} ورودی، {self.total_bytes / 1024 ** 2:.0f}MB")
+    
+    def _save_index(self):
+        try:
+            self.json_store.save(self.INDEX_FILE, self._index)
+        except Exception as e:
+            logger.error(f"خطا در ذخیره index cache فایل‌ها: {e}")
+    
+    def _pin(self, path: str) -> str:
+        self._pins[path] = self._pins.get(path, 0) + 1
+        return path
+    
+    def unpin(self, path: str):
+        """آزاد کردن فایلی که با pin=True گرفته شده است"""
+        with self._lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+                return
+            self._pins.pop(path, None)
+            if path in self._deferred:
+                self._deferred.discard(path)
+                self._unlink(Path(path))
+    
+    def get(self, url: str, quality: str, pin: bool = False) -> Optional[str]:
+        """مسیر فایل ذخیره‌شده برای (لینک، کیفیت)"""
+        key = self.make_key(url, quality)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                path = self._object_path(entry['hash'], entry['ext'])
+                if path.exists():
+                    entry['last_access'] = time.time()
+                    entry['hits'] = entry.get('hits', 0) + 1
+                    self.hits += 1
+                    return self._pin(str(path)) if pin else str(path)
+                # فایل خارج از cache حذف شده است
+                self._remove_key(key)
+                self._save_index()
+            self.misses += 1
+            return None
+    
+    def put(self, url: str, quality: str, src_path: str, pin: bool = False, **metadata) -> str:
+        """انتقال فایل دانلود شده به cache و برگرداندن مسیر جدید آن
+        
+        hash کردن فایل زمان‌بر است؛ از حلقه رویداد با run_in_executor فراخوانی شود.
+        """
+        file_hash = self.hash_file(src_path)
+        ext = os.path.splitext(src_path)[1]
+        size = os.path.getsize(src_path)
+        target = self._object_path(file_hash, ext)
+        
+        with self._lock:
+            if target.exists():
+                # محتوای یکسان قبلاً ذخیره شده است
+                os.remove(src_path)
+            else:
+                target.parent.mkdir(exist_ok=True)
+                tmp_path = target.with_name(target.name + ".tmp")
+                shutil.move(src_path, tmp_path)
+                os.replace(tmp_path, target)
+            
+            key = self.make_key(url, quality)
+            if key in self._index:
+                self._remove_key(key, delete_unreferenced=False)
+            
+            if self._refs.get(file_hash, 0) == 0:
+                self.total_bytes += size
+            self._refs[file_hash] = self._refs.get(file_hash, 0) + 1
+            self._index[key] = {
+                'hash': file_hash,
+                'ext': ext,
+                'size': size,
+                'last_access': time.time(),
+                'hits': 0,
+                **metadata
+            }
+            
+            if pin:
+                self._pin(str(target))
+            self._evict(keep=key)
+            self._save_index()
+        return str(target)
+    
+    def _remove_key(self, key: str, delete_unreferenced: bool = True):
+        entry = self._index.pop(key)
+        file_hash = entry['hash']
+        refs = self._refs.get(file_hash, 0) - 1
+        if refs > 0:
+            self._refs[file_hash] = refs
+            return
+        
+        self._refs.pop(file_hash, None)
+        self.total_bytes -= entry['size']
+        if not delete_unreferenced:
+            return
+        path = self._object_path(file_hash, entry['ext'])
+        if str(path) in self._pins:
+            self._deferred.add(str(path))
+        else:
+            self._unlink(path)
+    
+    def _unlink(self, path: Path):
+        # همان محتوا پس از زمان‌بندی حذف دوباره ذخیره شده است
+        if path.name[:64] in self._refs:
+            return
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            # فایل در حال استفاده است؛ هنگام بازسازی بعدی حذف می‌شود
+            logger.warning(f"خطا در حذف فایل cache {path.name}: {e}")
+    
+    def _evict(self, keep: str = None):
+        """حذف ورودی‌ها تا رسیدن حجم کل به زیر سقف"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        
+        if self.policy == "lfu":
+            score = lambda item: (item[1].get('hits', 0), item[1]['last_access'])
+        else:
+            score = lambda item: item[1]['last_access']
+        
+        for key, entry in sorted(self._index.items(), key=score):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == keep or str(self._object_path(entry['hash'], entry['ext'])) in self._pins:
+                continue
+            self._remove_key(key)
+            self.evictions += 1
+    
+    def invalidate(self, url: str, quality: str):
+        """حذف یک ورودی"""
+        key = self.make_key(url, quality)
+        with self._lock:
+            if key in self._index:
+                self._remove_key(key)
+                self._save_index()
+    
+    def stats(self) -> Dict[str, Any]:
+        """آمار cache"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._index),
+            'objects': len(self._refs),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+    
+    def flush(self):
+        """ذخیره index (برای ثبت آخرین زمان‌های دسترسی هنگام توقف)"""
+        with self._lock:
+            self._save_index()
@@ -0,0 +1,148 @@
+"""
+metadata_probe.py - بررسی واقعی لینک (عنوان، مدت و کیفیت‌های موجود) با cache
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.download_worker import DownloadExecutor
+from core.link_generator import canonical_key
+from core.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+VIDEO_HEIGHTS = (360, 480, 720, 1080)
+
+# بیت‌ریت خروجی mp3 (برای تخمین حجم)
+MP3_BITRATE = 192_000
+
+
+def estimate_size(fmt: Dict[str, Any], duration: Optional[float]) -> Optional[float]:
+    """حجم یک فرمت (دقیق، تقریبی یا محاسبه از بیت‌ریت)"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return fmt['tbr'] * 1000 / 8 * duration
+    return None
+
+
+def format_size(size: Optional[float]) -> str:
+    """نمایش حجم"""
+    if not size:
+        return "نامشخص"
+    if size >= 1024 ** 3:
+        return f"{size / 1024 ** 3:.1f}GB"
+    return f"{size / 1024 ** 2:.1f}MB"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """نمایش مدت"""
+    if not seconds:
+        return "نامشخص"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def summarize_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    """خلاصه اطلاعات: عنوان، مدت و کیفیت‌های موجود با حجم تخمینی"""
+    duration = info.get('duration')
+    formats = info.get('formats') or [info]
+    
+    videos = [f for f in formats if f.get('vcodec') not in (None, 'none') and f.get('height')]
+    audios = [f for f in formats
+              if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    
+    best_audio = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=None)
+    audio_bytes = estimate_size(best_audio, duration) if best_audio else 0
+    
+    def video_size(candidates: List[Dict]) -> Optional[float]:
+        best = max(candidates, key=lambda f: (f['height'], estimate_size(f, duration) or 0))
+        size = estimate_size(best, duration)
+        if size and best.get('acodec') in (None, 'none'):
+            size += audio_bytes or 0
+        return size
+    
+    qualities: Dict[str, Optional[float]] = {}
+    max_height = max((f['height'] for f in videos), default=0)
+    for height in VIDEO_HEIGHTS:
+        candidates = [f for f in videos if f['height'] <= height]
+        if candidates and max_height >= height:
+            qualities[str(height)] = video_size(candidates)
+    
+    if best_audio or any(f.get('acodec') not in (None, 'none') for f in formats):
+        qualities['mp3'] = MP3_BITRATE / 8 * duration if duration else None
+    
+    mp4_videos = [f for f in videos if f.get('ext') == 'mp4']
+    if mp4_videos:
+        qualities['mp4'] = video_size(mp4_videos)
+    
+    return {
+        'title': info.get('title') or "بدون عنوان",
+        'duration': duration,
+        'uploader': info.get('uploader'),
+        'qualities': qualities,
+    }
+
+
+class MetadataProbe:
+    """بررسی لینک با extract_info(download=False) در پردازه worker
+    
+    نتیجه برای هر لینک یکسان‌سازی‌شده تا ttl ثانیه نگه داشته می‌شود و هنگام
+    دانلود دوباره استفاده می‌شود تا استخراج دو بار انجام نشود. چون لینک‌های
+    مستقیم فرمت‌ها پس از مدتی منقضی می‌شوند، ttl کوتاه انتخاب شود.
+    """
+    
+    def __init__(self, executor: DownloadExecutor, ydl_opts: Dict[str, Any] = None,
+                 ttl: float = 1800, max_entries: int = 256):
+        self.executor = executor
+        self.ydl_opts = dict(ydl_opts or {'quiet': True, 'no_warnings': True})
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # لینک -> (زمان، info کامل، خلاصه)
+        self._cache: 'OrderedDict[str, Tuple[float, Dict, Dict]]' = OrderedDict()
+        # بررسی‌های در جریان (درخواست‌های هم‌زمان یک لینک فقط یک بار بررسی می‌شوند)
+        self._inflight = SingleFlight()
+    
+    def _fresh(self, key: str) -> Optional[Tuple[float, Dict, Dict]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+    
+    def get_info(self, url: str) -> Optional[Dict[str, Any]]:
+        """info کامل ذخیره‌شده برای استفاده در دانلود"""
+        entry = self._fresh(canonical_key(url))
+        return entry[1] if entry else None
+    
+    async def probe(self, url: str) -> Dict[str, Any]:
+        """خلاصه اطلاعات لینک (از cache یا با بررسی جدید)"""
+        key = canonical_key(url)
+        entry = self._fresh(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[2]
+        
+        summary, _shared = await self._inflight.do(key, lambda: self._fetch(key, url))
+        return summary
+    
+    async def _fetch(self, key: str, url: str) -> Dict[str, Any]:
+        self.misses += 1
+        info = await self.executor.probe(url, self.ydl_opts)
+        summary = summarize_info(info)
+        self._cache[key] = (time.time(), info, summary)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return summary
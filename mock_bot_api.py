@@ -0,0 +1,276 @@
+"""
+mock_bot_api.py - سرور ساختگی Bot API برای آزمایش حالت سرور محلی
+
+رفتار سرور محلی Bot API را شبیه‌سازی می‌کند: فایل‌ها با مسیر file:// از دیسک
+خوانده می‌شوند (تا 2000MB) و آپلود multipart تا 50MB پذیرفته می‌شود. تمام
+درخواست‌ها در calls ثبت می‌شوند.
+
+اجرا:
+    python -m core.mock_bot_api --port 8081
+    BOT_API_BASE_URL=http://127.0.0.1:8081 python main_local.py
+"""
+
+import json
+import time
+import logging
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+LOCAL_FILE_LIMIT = 2000 * 1024 * 1024
+UPLOAD_FILE_LIMIT = 50 * 1024 * 1024
+
+# متد ارسال -> (نام پارامتر فایل، نوع پیوست در Message)
+MEDIA_METHODS = {
+    'sendvideo': ('video', 'video'),
+    'senddocument': ('document', 'document'),
+    'sendaudio': ('audio', 'audio'),
+}
+
+
+class BotAPIError(Exception):
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+class MockBotAPI:
+    """وضعیت و منطق سرور ساختگی (مستقل از HTTP)"""
+
+    def __init__(self):
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._file_id = 0
+
+    def _next_message(self, chat_id: Any) -> Dict[str, Any]:
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        }
+
+    def _store_file(self, size: int) -> Dict[str, Any]:
+        with self._lock:
+            self._file_id += 1
+            file_id = self._file_id
+        return {
+            'file_id': f"mock-file-{file_id}",
+            'file_unique_id': f"mock-unique-{file_id}",
+            'file_size': size,
+        }
+
+    def handle(self, method: str, params: Dict[str, Any],
+               files: Dict[str, bytes]) -> Any:
+        """اجرای یک متد Bot API و برگرداندن result"""
+        with self._lock:
+            self.calls.append((method, params))
+        name = method.lower()
+
+        if name == 'getme':
+            return {'id': 1, 'is_bot': True, 'first_name': "Mock Bot", 'username': "mock_bot"}
+        if name == 'getupdates':
+            return []
+        if name in ('sendmessage', 'editmessagetext'):
+            message = self._next_message(params.get('chat_id', 0))
+            message['text'] = params.get('text', '')
+            return message
+        if name in MEDIA_METHODS:
+            return self._send_media(name, params, files)
+        # deleteWebhook، setMyCommands، answerCallbackQuery و ...
+        return True
+
+    def _send_media(self, name: str, params: Dict[str, Any],
+                    files: Dict[str, bytes]) -> Dict[str, Any]:
+        field, attachment = MEDIA_METHODS[name]
+        value = params.get(field)
+
+        if field in files:
+            size = len(files[field])
+            if size > UPLOAD_FILE_LIMIT:
+                raise BotAPIError(413, "Request Entity Too Large")
+        elif isinstance(value, str) and value.startswith('file://'):
+            path = Path(unquote(urlparse(value).path))
+            if not path.is_file():
+                raise BotAPIError(400, f"Bad Request: file not found: {path}")
+            size = path.stat().st_size
+            if size > LOCAL_FILE_LIMIT:
+                raise BotAPIError(400, "Bad Request: file is too big")
+        elif isinstance(value, str) and value:
+            # ارسال دوباره با file_id
+            size = 0
+        else:
+            raise BotAPIError(400, f"Bad Request: there is no {field} in the request")
+
+        message = self._next_message(params.get('chat_id', 0))
+        media = self._store_file(size)
+        if isinstance(value, str) and value.startswith('mock-file-'):
+            media['file_id'] = value
+        if attachment == 'video':
+            media.update({'width': 1280, 'height': 720, 'duration': 0})
+        elif attachment == 'audio':
+            media['duration'] = 0
+        message[attachment] = media
+        if params.get('caption'):
+            message['caption'] = params['caption']
+        return message
+
+
+def _decode(value: str) -> Any:
+    """مقادیر فرم به صورت JSON ارسال می‌شوند (آرایه‌ها، اعداد و ...)"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _parse_body(content_type: str, body: bytes) -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+    params: Dict[str, Any] = {}
+    files: Dict[str, bytes] = {}
+    if not body:
+        return params, files
+
+    if content_type.startswith('application/json'):
+        return json.loads(body), files
+
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename() is not None:
+                files[name] = payload
+            else:
+                params[name] = _decode(payload.decode('utf-8'))
+        # فایل‌های پیوست با attach://name ارجاع داده می‌شوند
+        for key, value in list(params.items()):
+            if isinstance(value, str) and value.startswith('attach://'):
+                attached = value[len('attach://'):]
+                if attached in files:
+                    files[key] = files.pop(attached)
+        return params, files
+
+    for key, value in parse_qsl(body.decode('utf-8'), keep_blank_values=True):
+        params[key] = _decode(value)
+    return params, files
+
+
+class _Handler(BaseHTTPRequestHandler):
+    api: MockBotAPI = None
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_GET(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        # /bot<token>/<method>
+        path = urlparse(self.path)
+        segments = [s for s in path.path.split('/') if s]
+        if len(segments) != 2 or not segments[0].startswith('bot'):
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': "Not Found"})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            params, files = _parse_body(self.headers.get('Content-Type', ''), body)
+            params.update({k: _decode(v) for k, v in parse_qsl(path.query)})
+            result = self.api.handle(segments[1], params, files)
+        except BotAPIError as e:
+            self._reply(e.code, {'ok': False, 'error_code': e.code, 'description': e.description})
+            return
+        except Exception as e:
+            logger.exception("خطا در سرور ساختگی Bot API")
+            self._reply(500, {'ok': False, 'error_code': 500, 'description': str(e)})
+            return
+        self._reply(200, {'ok': True, 'result': result})
+
+    def _reply(self, status: int, payload: Dict[str, Any]):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("mock bot api: " + format, *args)
+
+
+class MockBotAPIServer:
+    """اجرای سرور ساختگی در thread پس‌زمینه
+
+        with MockBotAPIServer() as server:
+            BotManager(token="123:abc", base_url=server.base_url)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.api = MockBotAPI()
+        handler = type('Handler', (_Handler,), {'api': self.api})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def calls(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return self.api.calls
+
+    def start(self) -> 'MockBotAPIServer':
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-bot-api", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self) -> 'MockBotAPIServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="سرور ساختگی Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    server = MockBotAPIServer(args.host, args.port)
+    print(f"🧪 سرور ساختگی Bot API روی {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+progress.py - نمایش پیشرفت دانلود با ویرایش محدودشده پیام وضعیت
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram.error import BadRequest, RetryAfter
+
+from core.metadata_probe import format_duration, format_size
+
+logger = logging.getLogger(__name__)
+
+BAR_WIDTH = 10
+
+POSTPROCESSOR_LABELS = {
+    'Merger': "ادغام صدا و تصویر",
+    'ExtractAudio': "استخراج صدا",
+    'VideoConvertor': "تبدیل فرمت",
+    'VideoRemuxer': "تبدیل فرمت",
+    'FormatConverter': "آماده‌سازی فایل برای محدودیت حجم تلگرام",
+}
+
+
+def progress_percent(state: Dict[str, Any]) -> Optional[float]:
+    """درصد پیشرفت (None اگر حجم کل نامشخص باشد)"""
+    total = state.get('total')
+    downloaded = state.get('downloaded')
+    if not total or downloaded is None:
+        return None
+    return min(100.0, downloaded * 100.0 / total)
+
+
+def _bar(percent: float) -> str:
+    filled = int(round(percent / 100 * BAR_WIDTH))
+    return "█" * filled + "░" * (BAR_WIDTH - filled)
+
+
+def render_progress(state: Dict[str, Any], quality_text: str) -> str:
+    """متن پیام وضعیت برای هر مرحله (دانلود، پردازش، آپلود)"""
+    phase = state.get('phase')
+
+    if phase == 'postprocess':
+        name = state.get('postprocessor') or ''
+        label = next((text for key, text in POSTPROCESSOR_LABELS.items() if key in name),
+                     "پردازش فایل")
+        return f"⚙️ در حال {label}...\n\n📦 کیفیت: {quality_text}"
+
+    if phase == 'upload':
+        lines = [f"📤 در حال ارسال فایل به تلگرام...\n", f"📦 کیفیت: {quality_text}"]
+        if state.get('parts', 1) > 1:
+            lines.append(f"📎 بخش {state['part']} از {state['parts']}")
+        if state.get('total'):
+            lines.append(f"📁 حجم: {format_size(state['total'])}")
+        return "\n".join(lines)
+
+    lines = [f"⏳ در حال دانلود با کیفیت {quality_text}\n"]
+    percent = progress_percent(state)
+    if percent is not None:
+        lines.append(f"{_bar(percent)} {percent:.0f}%")
+        lines.append(f"📦 {format_size(state.get('downloaded'))} / {format_size(state['total'])}")
+    elif state.get('downloaded'):
+        lines.append(f"📦 {format_size(state['downloaded'])}")
+    if state.get('speed'):
+        lines.append(f"🚀 سرعت: {format_size(state['speed'])}/s")
+    if state.get('eta') is not None:
+        lines.append(f"⏱️ زمان باقی‌مانده: {format_duration(state['eta'])}")
+    return "\n".join(lines)
+
+
+class ChatThrottle:
+    """فاصله زمانی حداقل بین ویرایش پیام‌ها در هر گفتگو"""
+
+    MAX_CHATS = 10000
+
+    def __init__(self, min_interval: float = 3.0):
+        self.min_interval = min_interval
+        # chat_id -> زمان مجاز ویرایش بعدی
+        self._next: Dict[int, float] = {}
+
+    def delay(self, chat_id: int) -> float:
+        """زمان باقی‌مانده تا ویرایش مجاز بعدی"""
+        return max(0.0, self._next.get(chat_id, 0.0) - time.monotonic())
+
+    def mark(self, chat_id: int, wait: Optional[float] = None):
+        """ثبت ویرایش (یا درخواست صبر تلگرام)"""
+        now = time.monotonic()
+        if len(self._next) >= self.MAX_CHATS:
+            self._next = {chat: t for chat, t in self._next.items() if t > now}
+        self._next[chat_id] = now + (self.min_interval if wait is None else wait)
+
+
+class ProgressReporter:
+    """به‌روزرسانی پیام وضعیت یک دانلود
+
+    وضعیت‌های پشت سر هم یکی می‌شوند و فقط آخرین وضعیت پس از سپری شدن
+    فاصله مجاز گفتگو ارسال می‌شود. در مرحله دانلود، تغییر کمتر از
+    min_percent درصد نادیده گرفته می‌شود؛ تغییر مرحله همیشه نمایش داده می‌شود.
+    """
+
+    def __init__(self, edit: Callable[[str], Awaitable[Any]], chat_id: int,
+                 quality_text: str, throttle: ChatThrottle, min_percent: float = 5.0):
+        self.edit = edit
+        self.chat_id = chat_id
+        self.quality_text = quality_text
+        self.throttle = throttle
+        self.min_percent = min_percent
+        self._pending: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_phase: Optional[str] = None
+        self._last_percent: Optional[float] = None
+        self._last_text: Optional[str] = None
+        self._closed = False
+
+    def update(self, state: Dict[str, Any]):
+        """دریافت وضعیت جدید (از حلقه رویداد فراخوانی می‌شود)"""
+        if self._closed:
+            return
+
+        if state.get('phase', 'download') == 'download' and self._last_phase in (None, 'download'):
+            percent = progress_percent(state)
+            if (percent is not None and self._last_percent is not None
+                    and percent < 100 and abs(percent - self._last_percent) < self.min_percent):
+                return
+
+        self._pending = state
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        # وضعیتی که هنگام انتظار یا ویرایش قبلی رسیده در همین task ارسال می‌شود
+        while self._pending is not None and not self._closed:
+            delay = self.throttle.delay(self.chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            state, self._pending = self._pending, None
+            if state is None or self._closed:
+                return
+
+            text = render_progress(state, self.quality_text)
+            if text == self._last_text:
+                continue
+
+            self.throttle.mark(self.chat_id)
+            try:
+                await self.edit(text)
+                self._last_text = text
+                self._last_phase = state.get('phase', 'download')
+                self._last_percent = progress_percent(state)
+            except RetryAfter as e:
+                self.throttle.mark(self.chat_id, wait=float(e.retry_after))
+                # وضعیت ارسال‌نشده پس از پایان صبر دوباره ارسال می‌شود (مگر وضعیت جدیدتری برسد)
+                if self._pending is None:
+                    self._pending = state
+            except BadRequest as e:
+                # «message is not modified» یا پیام حذف شده
+                logger.debug(f"ویرایش پیام پیشرفت انجام نشد: {e}")
+            except Exception as e:
+                logger.debug(f"خطا در ارسال پیشرفت دانلود: {e}")
+
+    async def close(self):
+        """توقف به‌روزرسانی‌ها پیش از ارسال پیام نهایی"""
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,91 @@
+"""
+single_flight.py - یکی‌سازی درخواست‌های هم‌زمان یکسان (single-flight)
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """اجرای فقط یک کار برای هر کلید در هر لحظه
+
+    فراخوانی‌های هم‌زمان با کلید یکسان به کار در جریان متصل می‌شوند و همگی
+    همان نتیجه (یا همان خطا) را دریافت می‌کنند. کار در یک task جدا اجرا می‌شود؛
+    لغو شدن یکی از منتظرها کار را متوقف نمی‌کند، مگر اینکه منتظر دیگری باقی نماند.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.started = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        """آیا کاری برای این کلید در حال اجراست؟"""
+        return key in self._flights
+
+    def waiters(self, key: Hashable) -> int:
+        """تعداد منتظرهای کار در جریان"""
+        flight = self._flights.get(key)
+        return flight.waiters if flight else 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """اجرای fn یا اتصال به اجرای در جریان
+
+        خروجی (نتیجه، shared) است؛ shared برای فراخوانی‌هایی که به کار شروع‌شده
+        توسط فراخوانی دیگری متصل شده‌اند True است.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.started += 1
+            flight = _Flight(asyncio.get_running_loop().create_task(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task: self._finish(key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            # آخرین منتظر رفته است؛ ادامه کار فایده‌ای ندارد
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    async def cancel_all(self):
+        """لغو تمام کارهای در جریان و انتظار برای پایان پاک‌سازی آن‌ها (هنگام توقف)"""
+        tasks = [flight.task for flight in self._flights.values()]
+        for task in tasks:
+            # کاری که پس از رفتن آخرین منتظر لغو شده در حال پاک‌سازی است
+            if not task.cancelling():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _finish(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # جلوگیری از هشدار «exception never retrieved» وقتی منتظری باقی نمانده است
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """آمار یکی‌سازی"""
+        return {
+            'in_flight': len(self._flights),
+            'started': self.started,
+            'shared': self.shared,
+        }
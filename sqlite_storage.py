@@ -0,0 +1,202 @@
+"""
+sqlite_storage.py - موتور ذخیره‌سازی SQLite (حالت WAL با ایندکس و تراکنش گروهی)
+"""
+
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from core.base_storage import BaseStorage, INDEXED_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    collection   TEXT NOT NULL,
+    key          TEXT NOT NULL,
+    user_id      TEXT,
+    status       TEXT,
+    requested_at TEXT,
+    is_active    TEXT,
+    data         TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+) WITHOUT ROWID;
+"""
+_INDEXES = "".join(
+    f"CREATE INDEX IF NOT EXISTS idx_records_{field} ON records (collection, {field});\n"
+    for field in INDEXED_FIELDS
+)
+
+# کوئری‌ها ثابت هستند تا sqlite3 آن‌ها را یک بار کامپایل و cache کند
+_SQL_GET = "SELECT data FROM records WHERE collection = ? AND key = ?"
+_SQL_PUT = (
+    f"INSERT OR REPLACE INTO records (collection, key, {', '.join(INDEXED_FIELDS)}, data) "
+    f"VALUES ({', '.join('?' * (len(INDEXED_FIELDS) + 3))})"
+)
+_SQL_DELETE = "DELETE FROM records WHERE collection = ? AND key = ?"
+_SQL_PAGE = (
+    "SELECT key, data FROM records WHERE collection = ? AND key > ? "
+    "ORDER BY key LIMIT ?"
+)
+_SQL_COUNT = "SELECT COUNT(*) FROM records WHERE collection = ?"
+_SQL_FIND = {
+    field: f"SELECT key, data FROM records WHERE collection = ? AND {field} = ?"
+    for field in INDEXED_FIELDS
+}
+_SQL_COUNT_BY = {
+    field: f"SELECT COUNT(*) FROM records WHERE collection = ? AND {field} = ?"
+    for field in INDEXED_FIELDS
+}
+_SQL_RANGE = {
+    field: f"SELECT key, data FROM records WHERE collection = ? AND {field} >= ? AND {field} < ?"
+    for field in INDEXED_FIELDS
+}
+
+
+class SQLiteStorage(BaseStorage):
+    """ذخیره‌سازی رکوردها در SQLite"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+
+        # isolation_level=None: تراکنش‌ها به صورت صریح مدیریت می‌شوند
+        self._conn = sqlite3.connect(
+            str(db_path),
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.executescript(_INDEXES)
+
+        logger.info(f"🗄️ پایگاه داده SQLite آماده است: {db_path}")
+
+    def _migrate(self):
+        """افزودن ستون‌های ایندکس جدید به پایگاه داده‌های قدیمی و پر کردن آن‌ها"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(records)")}
+        missing = [field for field in INDEXED_FIELDS if field not in columns]
+        if not missing:
+            return
+
+        with self.batch():
+            for field in missing:
+                self._conn.execute(f"ALTER TABLE records ADD COLUMN {field} TEXT")
+            rows = self._conn.execute("SELECT collection, key, data FROM records").fetchall()
+            self._conn.executemany(
+                _SQL_PUT, [self._row(collection, key, json.loads(data)) for collection, key, data in rows]
+            )
+        logger.info(f"🗄️ ستون‌های {', '.join(missing)} به {len(rows)} رکورد SQLite اضافه شد")
+
+    def _row(self, collection: str, key: str, record: Any) -> Tuple:
+        """ساخت ردیف جدول به همراه ستون‌های ایندکس‌شده"""
+        indexed = [None] * len(INDEXED_FIELDS)
+        if isinstance(record, dict):
+            for i, field in enumerate(INDEXED_FIELDS):
+                value = record.get(field)
+                indexed[i] = str(value) if value is not None else None
+        data = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        return (collection, str(key), *indexed, data)
+
+    def _check_field(self, field: str):
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"فیلد {field} ایندکس نشده است")
+
+    def get(self, collection: str, key: str) -> Optional[Any]:
+        """دریافت یک رکورد"""
+        with self._lock:
+            row = self._conn.execute(_SQL_GET, (collection, str(key))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, collection: str, key: str, record: Any):
+        """ذخیره یک رکورد"""
+        with self._lock:
+            self._conn.execute(_SQL_PUT, self._row(collection, key, record))
+
+    def put_many(self, collection: str, items: Dict[str, Any]):
+        """ذخیره گروهی رکوردها در یک تراکنش"""
+        rows = [self._row(collection, key, record) for key, record in items.items()]
+        with self.batch():
+            self._conn.executemany(_SQL_PUT, rows)
+
+    def delete(self, collection: str, key: str) -> bool:
+        """حذف یک رکورد"""
+        with self._lock:
+            cursor = self._conn.execute(_SQL_DELETE, (collection, str(key)))
+        return cursor.rowcount > 0
+
+    def iter_all(self, collection: str) -> Iterator[Tuple[str, Any]]:
+        """پیمایش تمام رکوردها بدون بارگذاری همه در حافظه"""
+        # صفحه‌بندی بر اساس کلید تا قفل بین yieldها نگه داشته نشود
+        last_key = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(_SQL_PAGE, (collection, last_key, 500)).fetchall()
+            if not rows:
+                break
+            for key, data in rows:
+                yield key, json.loads(data)
+            last_key = rows[-1][0]
+
+    def count(self, collection: str, field: str = None, value: Any = None) -> int:
+        """تعداد رکوردها"""
+        with self._lock:
+            if field is None:
+                row = self._conn.execute(_SQL_COUNT, (collection,)).fetchone()
+            else:
+                self._check_field(field)
+                row = self._conn.execute(_SQL_COUNT_BY[field], (collection, str(value))).fetchone()
+        return row[0]
+
+    def find(self, collection: str, field: str, value: Any) -> List[Tuple[str, Any]]:
+        """جستجو روی یک فیلد ایندکس‌شده"""
+        self._check_field(field)
+        with self._lock:
+            rows = self._conn.execute(_SQL_FIND[field], (collection, str(value))).fetchall()
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def find_range(self, collection: str, field: str, start: Any = None,
+                   end: Any = None) -> List[Tuple[str, Any]]:
+        """جستجوی بازه‌ای (start <= value < end)"""
+        self._check_field(field)
+        # رشته خالی کوچک‌ترین و '\uffff' بزرگ‌ترین مقدار متنی است
+        low = '' if start is None else str(start)
+        high = '\uffff' if end is None else str(end)
+        with self._lock:
+            rows = self._conn.execute(_SQL_RANGE[field], (collection, low, high)).fetchall()
+        return [(key, json.loads(data)) for key, data in rows]
+
+    @contextmanager
+    def batch(self):
+        """گروه‌بندی چند عملیات نوشتن در یک تراکنش"""
+        with self._lock:
+            outermost = self._batch_depth == 0
+            if outermost:
+                self._conn.execute("BEGIN")
+            self._batch_depth += 1
+            try:
+                yield self
+            except Exception:
+                self._batch_depth -= 1
+                if outermost:
+                    self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._batch_depth -= 1
+                if outermost:
+                    self._conn.execute("COMMIT")
+
+    def close(self):
+        """بستن اتصال"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,94 @@
+"""
+stats.py - شمارنده‌های افزایشی آمار سیستم با تجمیع روزانه
+"""
+
+import time
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+
+# شمارنده‌هایی که علاوه بر مقدار کل، به تفکیک روز هم نگه داشته می‌شوند
+DAILY_FIELDS = ('users', 'downloads', 'payments', 'revenue')
+
+
+class StatsCounters:
+    """آمار سیستم که هنگام وقوع رویدادها به‌روز می‌شود
+    
+    خواندن آمار (پنل ادمین) بدون پیمایش کاربران و پرداخت‌ها و در زمان ثابت انجام
+    می‌شود. برای هر روز یک bucket جداگانه نگه داشته می‌شود و bucket های قدیمی‌تر
+    از retention_days حذف می‌شوند.
+    """
+    
+    def __init__(self, retention_days: int = 90):
+        self.retention_days = retention_days
+        self.totals: Dict[str, float] = {field: 0 for field in DAILY_FIELDS}
+        self.totals['premium_users'] = 0
+        self.daily: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _day_key(ts: float = None) -> str:
+        return date.fromtimestamp(time.time() if ts is None else ts).isoformat()
+    
+    def add(self, field: str, amount: float = 1, ts: float = None, daily: bool = True):
+        """افزایش یک شمارنده (ts زمان رویداد برای bucket روزانه است)"""
+        with self._lock:
+            self.totals[field] = self.totals.get(field, 0) + amount
+            if not daily or field not in DAILY_FIELDS:
+                return
+            
+            day = self._day_key(ts)
+            bucket = self.daily.get(day)
+            if bucket is None:
+                bucket = self.daily[day] = {f: 0 for f in DAILY_FIELDS}
+                self._prune()
+                if day not in self.daily:
+                    return
+            bucket[field] += amount
+    
+    def restore_day(self, field: str, day: str, amount: float):
+        """بازگرداندن شمارنده ذخیره‌شده یک روز (مقدار کل تغییر نمی‌کند)"""
+        with self._lock:
+            if day < (date.today() - timedelta(days=self.retention_days)).isoformat():
+                return
+            bucket = self.daily.setdefault(day, {f: 0 for f in DAILY_FIELDS})
+            bucket[field] = amount
+    
+    def _prune(self):
+        oldest = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        for day in [d for d in self.daily if d < oldest]:
+            del self.daily[day]
+    
+    def reset(self):
+        """صفر کردن تمام شمارنده‌ها (پیش از بازسازی)"""
+        with self._lock:
+            for field in self.totals:
+                self.totals[field] = 0
+            self.daily.clear()
+    
+    def day(self, day: str = None) -> Dict[str, float]:
+        """شمارنده‌های یک روز (پیش‌فرض امروز)"""
+        bucket = self.daily.get(day or self._day_key())
+        return dict(bucket) if bucket else {field: 0 for field in DAILY_FIELDS}
+    
+    def last_days(self, days: int = 7) -> List[Tuple[str, Dict[str, float]]]:
+        """شمارنده‌های روزهای اخیر (از قدیم به جدید)"""
+        today = date.today()
+        keys = [(today - timedelta(days=i)).isoformat() for i in range(days - 1, -1, -1)]
+        return [(key, self.day(key)) for key in keys]
+    
+    def snapshot(self) -> Dict[str, float]:
+        """مقادیر کل به همراه شمارنده‌های امروز"""
+        today = self.day()
+        return {
+            'total_users': self.totals['users'],
+            'premium_users': self.totals['premium_users'],
+            'total_downloads': self.totals['downloads'],
+            'total_payments': self.totals['payments'],
+            'total_revenue': self.totals['revenue'],
+            'today_users': today['users'],
+            'today_downloads': today['downloads'],
+            'today_payments': today['payments'],
+            'today_revenue': today['revenue'],
+        }
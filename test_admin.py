@@ -0,0 +1,148 @@
+"""
+test_admin.py - تست ریپوزیتوری‌های دامنه
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_admin.py
+"""
+
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+from core.admin import AdRepository, DownloadRepository, DownloadStatus
+from core.sqlite_storage import SQLiteStorage
+
+
+def test_json_snapshots_are_coalesced(tmp_path, monkeypatch):
+    repo = DownloadRepository(tmp_path)
+    saves = []
+    save_json = repo._save_json
+    monkeypatch.setattr(repo, '_save_json', lambda name, data: (saves.append(len(data)), save_json(name, data)))
+
+    async def burst():
+        ids = [repo.create_download("42", f"https://youtu.be/video{i:06d}", "youtube").id for i in range(5)]
+        repo.start_download(ids[0])
+        # هنوز هیچ snapshot ای ساخته نشده است
+        assert saves == []
+        await asyncio.sleep(repo.persist_delay + 0.1)
+        assert saves == [5]
+        repo.complete_download(ids[0], None, 10)
+        return ids
+
+    ids = asyncio.run(burst())
+    # flush تغییر معلق را بدون انتظار برای تایمر می‌نویسد
+    repo.flush()
+    assert saves == [5, 5]
+
+    loaded = DownloadRepository(tmp_path)
+    assert loaded.get_download(ids[0]).file_size == 10
+    assert loaded.count_downloads() == 5
+
+
+def test_json_snapshot_without_event_loop_is_immediate(tmp_path):
+    repo = DownloadRepository(tmp_path)
+    download = repo.create_download("42", "https://youtu.be/dQw4w9WgXcQ", "youtube")
+    assert DownloadRepository(tmp_path).get_download(download.id).url == download.url
+
+
+def test_active_campaigns_use_sqlite_index(tmp_path):
+    storage = SQLiteStorage(tmp_path / "bot.db")
+    try:
+        ads = AdRepository(tmp_path, storage)
+        active = ads.create_campaign({'title': "فعال", 'ad_type': "banner"})
+        ads.create_campaign({'title': "متوقف", 'ad_type': "banner", 'is_active': False})
+
+        assert [c.id for c in ads.get_active_campaigns()] == [active.id]
+        indexes = {row[0] for row in storage._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert "idx_records_is_active" in indexes
+    finally:
+        storage.close()
+
+
+def test_sqlite_migration_adds_index_columns(tmp_path):
+    """پایگاه داده قدیمی بدون ستون is_active هنگام باز شدن به‌روزرسانی می‌شود"""
+    conn = sqlite3.connect(str(tmp_path / "bot.db"))
+    conn.executescript("""
+        CREATE TABLE records (
+            collection TEXT NOT NULL, key TEXT NOT NULL, user_id TEXT, status TEXT,
+            requested_at TEXT, data TEXT NOT NULL, PRIMARY KEY (collection, key)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("INSERT INTO records (collection, key, data) VALUES (?, ?, ?)",
+                 ("domain.ads", "AD_1", json.dumps({'id': "AD_1", 'title': "قدیمی",
+                                                    'ad_type': "banner", 'is_active': True})))
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(tmp_path / "bot.db")
+    try:
+        assert [c.id for c in AdRepository(tmp_path, storage).get_active_campaigns()] == ["AD_1"]
+    finally:
+        storage.close()
+
+
+# ---------- ذخیره کارهای دانلود ----------
+
+@pytest.fixture(params=["json", "sqlite"])
+def repository_factory(request, tmp_path):
+    """ساخت DownloadRepository روی همان داده‌ها
+
+    factory(previous) ذخیره‌های معلق previous را می‌نویسد و ریپوزیتوری تازه‌ای
+    می‌سازد (شبیه‌سازی راه‌اندازی مجدد).
+    """
+    storages = []
+
+    def factory(previous=None):
+        if previous is not None:
+            previous.flush()
+            if previous.storage is not None:
+                previous.storage.close()
+        if request.param == "json":
+            return DownloadRepository(tmp_path)
+        storage = SQLiteStorage(tmp_path / "bot.db")
+        storages.append(storage)
+        return DownloadRepository(tmp_path, storage=storage)
+
+    yield factory
+    for storage in storages:
+        storage.close()
+
+
+def test_download_jobs_round_trip(repository_factory):
+    repo = repository_factory()
+    done = repo.create_download("42", "https://youtu.be/dQw4w9WgXcQ", "youtube",
+                                quality="720", chat_id=42, message_id=7)
+    running = repo.create_download("42", "https://vimeo.com/123456789", "vimeo", quality="480",
+                                   chat_id=42, message_id=8)
+    repo.start_download(done.id, output_dir="downloads/job_a")
+    repo.complete_download(done.id, None, 1024)
+    repo.start_download(running.id, output_dir="downloads/job_b")
+    repo.record_part(running.id, "downloads/job_b/video.mp4.part")
+
+    repo = repository_factory(repo)
+
+    completed = repo.get_download(done.id)
+    assert completed.status is DownloadStatus.COMPLETED
+    assert completed.file_size == 1024
+
+    unfinished = repo.get_unfinished()
+    assert [d.id for d in unfinished] == [running.id]
+    assert unfinished[0].status is DownloadStatus.PROCESSING
+    assert unfinished[0].part_path == "downloads/job_b/video.mp4.part"
+    assert unfinished[0].attempts == 1
+    assert (unfinished[0].chat_id, unfinished[0].message_id) == (42, 8)
+
+
+def test_download_transitions_are_enforced(repository_factory):
+    repo = repository_factory()
+    download = repo.create_download("42", "https://youtu.be/dQw4w9WgXcQ", "youtube")
+    assert repo.cancel_download(download.id)
+    # کار لغوشده دوباره شروع نمی‌شود
+    assert repo.start_download(download.id) is None
+
+    repo = repository_factory(repo)
+    assert repo.get_download(download.id).status is DownloadStatus.CANCELLED
+    assert repo.get_unfinished() == []
@@ -0,0 +1,114 @@
+"""
+test_bandwidth.py - تست سقف هم‌زمانی پلتفرم‌ها و محدودیت سرعت دانلود
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_bandwidth.py
+"""
+
+import asyncio
+
+import pytest
+
+from core.bandwidth import MB, BandwidthGovernor, SharedTokenBucket, throttle_hook
+from core.download_queue import DownloadJob, DownloadQueue
+
+
+def test_host_limits_cap_concurrent_downloads():
+    governor = BandwidthGovernor(host_limits={'YouTube': 1}, default_host_limit=2)
+    youtube = governor.host_key("https://youtu.be/dQw4w9WgXcQ")
+    other = governor.host_key("https://Example.com/video.mp4")
+    assert (youtube, other) == ("youtube", "example.com")
+
+    assert governor.has_capacity(youtube)
+    governor.acquire(youtube)
+    assert not governor.has_capacity(youtube)
+
+    governor.acquire(other)
+    assert governor.has_capacity(other)
+    governor.acquire(other)
+    assert not governor.has_capacity(other)
+    assert governor.stats()['active'] == {"youtube": 1, "example.com": 2}
+
+    governor.release(youtube)
+    governor.release(other)
+    assert governor.has_capacity(youtube) and governor.has_capacity(other)
+    assert governor.stats()['active'] == {"example.com": 1}
+
+
+def test_zero_limit_means_unlimited():
+    governor = BandwidthGovernor()
+    for _ in range(50):
+        governor.acquire("youtube")
+    assert governor.has_capacity("youtube")
+
+
+def test_from_config():
+    governor = BandwidthGovernor.from_config({
+        'global_rate_mb': 2, 'burst_mb': 4, 'concurrent_fragments': 3,
+        'host_concurrency': {'youtube': 1, 'default': 2},
+    })
+    assert governor.rate == 2 * MB
+    assert governor.bucket.burst == 4 * MB
+    assert governor.concurrent_fragments == 3
+    assert (governor.host_limit("youtube"), governor.host_limit("vimeo")) == (1, 2)
+
+
+@pytest.mark.parametrize("rate, fragments, opts, expected", [
+    (0, 1, {}, {'concurrent_fragment_downloads': 1}),
+    (2 * MB, 4, {}, {'concurrent_fragment_downloads': 4, 'ratelimit': 2 * MB}),
+    # سرعت کمتر درخواست‌شده حفظ می‌شود و بیشتر از سرعت کل نمی‌شود
+    (2 * MB, 4, {'ratelimit': MB}, {'concurrent_fragment_downloads': 4, 'ratelimit': MB}),
+    (2 * MB, 4, {'ratelimit': 8 * MB}, {'concurrent_fragment_downloads': 4, 'ratelimit': 2 * MB}),
+    # تنظیم صریح fragment ها بازنویسی نمی‌شود
+    (0, 4, {'concurrent_fragment_downloads': 8}, {'concurrent_fragment_downloads': 8}),
+])
+def test_apply_sets_ytdlp_options(rate, fragments, opts, expected):
+    governor = BandwidthGovernor(rate=rate, concurrent_fragments=fragments)
+    original = dict(opts)
+    assert governor.apply(opts) == expected
+    assert opts == original
+
+
+def test_queue_releases_host_after_failure():
+    governor = BandwidthGovernor(host_limits={'youtube': 1})
+    events = []
+
+    async def failing():
+        events.append(("fail", dict(governor.stats()['active'])))
+        raise RuntimeError("network error")
+
+    async def succeeding():
+        events.append(("ok", dict(governor.stats()['active'])))
+
+    async def run():
+        queue = DownloadQueue(workers=2, per_user_limit=2, governor=governor)
+        queue.start()
+        await queue.submit(DownloadJob(id="y1", user_id="1", run=failing, host="youtube"))
+        await queue.submit(DownloadJob(id="y2", user_id="1", run=succeeding, host="youtube"))
+        for _ in range(20):
+            if queue.completed_count == 2:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert queue.completed_count == 2
+    # کار دوم فقط پس از آزاد شدن جای کار ناموفق شروع شد
+    assert events == [("fail", {"youtube": 1}), ("ok", {"youtube": 1})]
+    assert governor.stats()['active'] == {}
+
+
+def test_token_bucket_returns_wait_time():
+    bucket = SharedTokenBucket(rate=1000, burst=1000)
+    assert bucket.consume(1000) == 0.0
+    assert bucket.consume(500) == pytest.approx(0.5, abs=0.05)
+
+
+def test_throttle_hook_stops_waiting_when_cancelled():
+    bucket = SharedTokenBucket(rate=1, burst=1)
+    hook = throttle_hook(bucket, should_stop=lambda: True)
+    # بدون should_stop این بلوک حدود یک ساعت صبر می‌کرد
+    hook({'status': 'downloading', 'tmpfilename': "video.part", 'downloaded_bytes': 3600})
+    hook({'status': 'finished', 'tmpfilename': "video.part", 'downloaded_bytes': 3600})
+    assert bucket.consume(0) == pytest.approx(3600, rel=0.01)
@@ -0,0 +1,195 @@
+"""
+test_download_queue.py - تست صف دانلود و زمان‌بند نوبتی
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_download_queue.py
+"""
+
+import asyncio
+
+import pytest
+
+from core.download_queue import DownloadJob, DownloadQueue, FairScheduler, QueueFullError, UserLimitError
+
+
+def _job(job_id, user_id, run=None, **kwargs):
+    async def noop():
+        pass
+    return DownloadJob(id=job_id, user_id=user_id, run=run or noop, **kwargs)
+
+
+async def _blocked_queue(**kwargs):
+    """صف با یک worker که با کار "busy" اشغال شده است"""
+    queue = DownloadQueue(workers=1, **kwargs)
+    queue.start()
+    release = asyncio.Event()
+    assert await queue.submit(_job("busy", "0", release.wait)) == 0
+    await asyncio.sleep(0)
+    assert queue.running_count == 1
+    return queue, release
+
+
+def test_user_limit_and_full_queue():
+    async def run():
+        queue, release = await _blocked_queue(max_size=2, per_user_limit=1)
+        assert await queue.submit(_job("a", "1")) == 1
+        with pytest.raises(UserLimitError):
+            await queue.submit(_job("a2", "1"))
+        assert await queue.submit(_job("b", "2")) == 2
+        with pytest.raises(QueueFullError):
+            await queue.submit(_job("c", "3"))
+        # کاربر رد شده در سقف هم‌زمانی شمرده نمی‌شود
+        assert queue.user_in_flight("3") == 0
+        release.set()
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_cancel_waiting_job():
+    async def run():
+        queue, release = await _blocked_queue()
+        ran = []
+
+        async def record(job_id):
+            ran.append(job_id)
+
+        for job_id, user_id in (("a", "1"), ("b", "2"), ("c", "3")):
+            await queue.submit(_job(job_id, user_id, lambda j=job_id: record(j)))
+        assert queue.position("c") == 3
+
+        assert queue.cancel("b")
+        assert not queue.cancel("b")
+        assert queue.user_in_flight("2") == 0
+        assert queue.position("b") is None
+        assert queue.position("c") == 2
+        assert sorted(queue.job_ids()) == ["a", "busy", "c"]
+
+        release.set()
+        while queue.waiting_count or queue.running_count:
+            await asyncio.sleep(0.01)
+        assert ran == ["a", "c"]
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_positions_are_computed_once_per_change(monkeypatch):
+    scheduler = FairScheduler()
+    for i in range(5):
+        scheduler.push(_job(f"j{i}", str(i)))
+
+    calls = []
+    order = scheduler.order
+    monkeypatch.setattr(scheduler, 'order', lambda: calls.append(1) or order())
+
+    assert [scheduler.positions()[f"j{i}"] for i in range(5)] == [1, 2, 3, 4, 5]
+    assert len(calls) == 1
+
+    scheduler.remove("j1")
+    assert scheduler.positions()["j4"] == 4
+    scheduler.pop()
+    assert scheduler.positions() == {"j2": 1, "j3": 2, "j4": 3}
+    assert len(calls) == 3
+
+
+def test_submit_without_position():
+    async def run():
+        queue, release = await _blocked_queue()
+        assert await queue.submit(_job("a", "1"), report_position=False) is None
+        assert queue.position("a") == 1
+        release.set()
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+# ---------- ترتیب زمان‌بندی ----------
+
+def _ids(jobs):
+    return [job.id for job in jobs]
+
+
+def test_stride_weighting_across_tiers():
+    scheduler = FairScheduler({'premium': 3, 'free': 1})
+    for i in range(4):
+        scheduler.push(_job(f"f{i}", f"free{i}", tier="free"))
+    for i in range(6):
+        scheduler.push(_job(f"p{i}", f"prem{i}", tier="premium"))
+
+    # هر سه نوبت premium یک نوبت free؛ در تساوی سطح با وزن بیشتر جلو می‌افتد
+    expected = ["p0", "f0", "p1", "p2", "p3", "f1", "p4", "p5", "f2", "f3"]
+    assert _ids(scheduler.order()) == expected
+    assert [scheduler.pop().id for _ in range(len(scheduler))] == expected
+
+
+def test_round_robin_between_users():
+    scheduler = FairScheduler()
+    for job_id, user_id in (("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b"), ("c1", "c"), ("b2", "b")):
+        scheduler.push(_job(job_id, user_id))
+
+    assert _ids(scheduler.order()) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_idle_tier_does_not_bank_credit():
+    scheduler = FairScheduler({'premium': 2, 'free': 1})
+    for i in range(6):
+        scheduler.push(_job(f"f{i}", f"u{i}"))
+    for _ in range(4):
+        scheduler.pop()
+    # premium تازه وارد شده نباید به خاطر بیکاری قبلی همه نوبت‌ها را بگیرد
+    for i in range(4):
+        scheduler.push(_job(f"p{i}", f"p{i}", tier="premium"))
+    assert _ids(scheduler.order()) == ["p0", "p1", "p2", "f4", "p3", "f5"]
+
+
+def test_ready_skips_busy_host_and_keeps_turn():
+    scheduler = FairScheduler()
+    scheduler.push(_job("y1", "a", host="youtube"))
+    scheduler.push(_job("i1", "a", host="instagram"))
+    scheduler.push(_job("y2", "b", host="youtube"))
+    scheduler.push(_job("i2", "c", host="instagram"))
+
+    not_youtube = lambda job: job.host != "youtube"
+    assert scheduler.has_ready(not_youtube)
+    # کار آماده بعدی کاربر a (i1) به جای y1 اجرا می‌شود
+    assert scheduler.pop(not_youtube).id == "i1"
+    assert scheduler.pop(not_youtube).id == "i2"
+    assert not scheduler.has_ready(not_youtube)
+    assert [scheduler.pop().id for _ in range(len(scheduler))] == ["y2", "y1"]
+
+
+def test_wait_percentiles_per_tier():
+    queue = DownloadQueue()
+    for seconds in range(1, 101):
+        queue._record_wait("free", float(seconds))
+    queue._record_wait("premium", 2.0)
+
+    percentiles = queue.wait_percentiles()
+    assert percentiles['free'] == {'count': 100, 'p50': 51.0, 'p90': 91.0, 'p99': 100.0}
+    assert percentiles['premium'] == {'count': 1, 'p50': 2.0, 'p90': 2.0, 'p99': 2.0}
+
+
+def test_queue_runs_fixed_mix_in_fair_order():
+    async def run():
+        queue, release = await _blocked_queue(weights={'premium': 2, 'free': 1}, per_user_limit=5)
+        ran = []
+
+        async def record(job_id):
+            ran.append(job_id)
+
+        mix = [("f1", "a", "free"), ("f2", "a", "free"), ("f3", "b", "free"),
+               ("p1", "c", "premium"), ("p2", "c", "premium"), ("p3", "d", "premium")]
+        for job_id, user_id, tier in mix:
+            await queue.submit(_job(job_id, user_id, lambda j=job_id: record(j), tier=tier))
+        expected = ["p1", "p3", "p2", "f1", "f3", "f2"]
+        assert _ids(queue._waiting.order()) == expected
+
+        release.set()
+        while queue.waiting_count or queue.running_count:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        assert ran == expected
+        assert set(queue.wait_percentiles()) == {"free", "premium"}
+
+    asyncio.run(run())
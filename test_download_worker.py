@@ -0,0 +1,76 @@
+"""
+test_download_worker.py - تست لغو و مهلت دانلود در پردازه worker
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_download_worker.py
+"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from core import download_worker
+from core.download_worker import DownloadCancelledError, DownloadExecutor, DownloadTimeoutError
+
+
+def _blocking_run(url, ydl_opts, output_dir, deadline, info=None,
+                  progress_queue=None, job_id=0, cancel_event=None):
+    """جایگزین run_ytdlp: مهلت را نادیده می‌گیرد و فقط با cancel_event متوقف می‌شود"""
+    marker_dir = ydl_opts['marker_dir']
+    open(os.path.join(output_dir, "video.mp4.part"), 'wb').close()
+    open(os.path.join(marker_dir, "started"), 'w').close()
+    stop_at = time.time() + 20
+    while not cancel_event.is_set():
+        if time.time() > stop_at:
+            return {'file_path': None}
+        time.sleep(0.05)
+    open(os.path.join(marker_dir, "stopped"), 'w').close()
+    raise DownloadCancelledError("دانلود لغو شد")
+
+
+@pytest.fixture
+def executor(tmp_path, monkeypatch):
+    # پردازه spawn تابع را با نام ماژول همین تست دوباره وارد می‌کند
+    monkeypatch.setattr(download_worker, 'run_ytdlp', _blocking_run)
+    executor = DownloadExecutor(max_workers=1, output_root=tmp_path / "downloads")
+    yield executor
+    executor.shutdown()
+
+
+async def _wait_for(path, timeout=30):
+    stop_at = time.monotonic() + timeout
+    while not path.exists():
+        assert time.monotonic() < stop_at, f"{path.name} ساخته نشد"
+        await asyncio.sleep(0.05)
+
+
+def test_cancel_stops_running_job(executor, tmp_path):
+    async def run():
+        task = asyncio.create_task(executor.download("https://youtu.be/x", {'marker_dir': str(tmp_path)}))
+        await _wait_for(tmp_path / "started")
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    # پوشه موقت فقط پس از توقف پردازه worker حذف می‌شود
+    assert (tmp_path / "stopped").exists()
+    assert os.listdir(tmp_path / "downloads") == []
+
+
+def test_outer_timeout_stops_running_job(executor, tmp_path):
+    # پردازه worker پیش از شروع مهلت آماده می‌شود (راه‌اندازی spawn کند است)
+    executor._get_pool().submit(os.getpid).result()
+    executor.timeout = 0.5
+    executor.TIMEOUT_GRACE = 0.5
+
+    async def run():
+        with pytest.raises(DownloadTimeoutError):
+            await executor.download("https://youtu.be/x", {'marker_dir': str(tmp_path)})
+
+    asyncio.run(run())
+    assert (tmp_path / "started").exists()
+    assert (tmp_path / "stopped").exists()
+    assert os.listdir(tmp_path / "downloads") == []
@@ -0,0 +1,81 @@
+"""
+test_downloaders.py - تست توکن دکمه‌ها و آپلود در حالت سرور محلی
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_downloaders.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core.callback_store import CallbackStore
+from core.mock_bot_api import MockBotAPIServer
+
+
+def test_callback_tokens_survive_restart(tmp_path):
+    store = CallbackStore(tmp_path, compact_threshold=5, max_entries=8)
+    tokens = [store.put(f"https://youtu.be/video{i:06d}", "42", ["720", "mp3"]) for i in range(12)]
+    # هر توکن یک خط ژورنال است و فایل کامل فقط هنگام compaction نوشته می‌شود
+    assert (tmp_path / "callback_tokens.journal").read_text(encoding='utf-8').count('\n') == 2
+
+    store = CallbackStore(tmp_path, compact_threshold=5, max_entries=8)
+    assert list(store._entries) == tokens[-8:]
+    entry = store.get(tokens[-1])
+    assert entry['url'] == "https://youtu.be/video000011"
+    assert entry['user_id'] == "42"
+    assert entry['qualities'] == ["720", "mp3"]
+    assert store.get(tokens[0]) is None
+
+
+# ---------- آپلود با سرور Bot API محلی ----------
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    pytest.importorskip("telegram")
+    from core.app import Config, DataManager, DownloadController
+
+    # پوشه‌های دانلود و cache نسبت به پوشه جاری ساخته می‌شوند
+    monkeypatch.chdir(tmp_path)
+    return DownloadController(DataManager(tmp_path / "data"), Config())
+
+
+async def _upload(base_url: str, local_mode: bool, controller, file_path):
+    from telegram import Bot
+
+    bot = Bot("123:abc", base_url=f"{base_url}/bot",
+              base_file_url=f"{base_url}/file/bot", local_mode=local_mode)
+    async with bot:
+        return await controller._upload_file(
+            SimpleNamespace(bot=bot), 42, 'video', str(file_path), "720p", (1, 1)
+        )
+
+
+def test_local_mode_upload_sends_file_path(controller, tmp_path):
+    video = tmp_path / "video.mp4"
+    # بزرگ‌تر از سقف آپلود عادی (50MB)؛ سرور محلی فایل را از دیسک می‌خواند
+    with open(video, 'wb') as file:
+        file.truncate(60 * 1024 * 1024)
+
+    with MockBotAPIServer() as server:
+        message = asyncio.run(_upload(server.base_url, True, controller, video))
+
+    assert message.video.file_id.startswith("mock-file-")
+    assert message.video.file_size == 60 * 1024 * 1024
+    method, params = server.calls[-1]
+    assert method == "sendVideo"
+    assert params['video'] == video.absolute().as_uri()
+
+
+def test_multipart_upload_without_local_mode(controller, tmp_path):
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"\x00" * 2048)
+
+    with MockBotAPIServer() as server:
+        message = asyncio.run(_upload(server.base_url, False, controller, video))
+
+    assert message.video.file_size == 2048
+    method, params = server.calls[-1]
+    assert method == "sendVideo"
+    assert not str(params.get('video', '')).startswith("file://")
@@ -0,0 +1,93 @@
+"""
+test_expiry_scheduler.py - تست زمان‌بندی انقضای اشتراک پریمیوم
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_expiry_scheduler.py
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from core.app import DataManager, PremiumExpiryScheduler, User, UserStatusCode
+
+
+def _premium(manager, user_id, expiry_ts):
+    user = User(user_id, f"user{user_id}", "Test")
+    user.status_code = UserStatusCode.PREMIUM
+    user.premium_expiry_ts = expiry_ts
+    manager.create_user(user)
+    return user
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return DataManager(tmp_path)
+
+
+def test_expire_due_in_expiry_order(manager):
+    scheduler = PremiumExpiryScheduler(manager)
+    for user_id, expiry_ts in (("1", 300), ("2", 100), ("3", 200), ("4", 100)):
+        scheduler.schedule(_premium(manager, user_id, expiry_ts))
+
+    assert scheduler.expire_due(now=50) == []
+    assert [u.id for u in scheduler.expire_due(now=200)] == ["2", "4", "3"]
+    assert scheduler.expire_due(now=250) == []
+    assert [u.id for u in scheduler.expire_due(now=1000)] == ["1"]
+    assert scheduler.expired_count == 4
+
+
+def test_expired_user_becomes_free(manager, tmp_path):
+    scheduler = PremiumExpiryScheduler(manager)
+    scheduler.schedule(_premium(manager, "1", 100))
+
+    [user] = scheduler.expire_due(now=100)
+    assert user.status_code == UserStatusCode.FREE
+    assert not manager.get_user("1").is_premium()
+
+    manager.flush()
+    assert DataManager(tmp_path).get_user("1").status == "free"
+    assert list(DataManager(tmp_path).iter_premium_users()) == []
+
+
+def test_renewal_leaves_stale_heap_entry(manager):
+    scheduler = PremiumExpiryScheduler(manager)
+    user = _premium(manager, "1", 100)
+    scheduler.schedule(user)
+    # تمدید: ورودی قبلی در heap می‌ماند ولی نباید کاربر را منقضی کند
+    user.premium_expiry_ts = 500
+    manager.update_user(user)
+    scheduler.schedule(user)
+    scheduler.schedule(user)
+
+    assert len(scheduler._heap) == 2
+    assert scheduler.expire_due(now=200) == []
+    assert manager.get_user("1").status_code == UserStatusCode.PREMIUM
+    assert [u.id for u in scheduler.expire_due(now=500)] == ["1"]
+
+
+def test_load_skips_free_users(manager):
+    _premium(manager, "1", 100)
+    manager.create_user(User("2", "free", "Free"))
+    scheduler = PremiumExpiryScheduler(manager)
+    scheduler.load()
+    assert list(scheduler._scheduled) == ["1"]
+
+
+def test_loop_notifies_expired_users(manager):
+    notified = []
+
+    async def notify(user):
+        notified.append(user.id)
+
+    async def run():
+        scheduler = PremiumExpiryScheduler(manager, notify)
+        scheduler.start()
+        scheduler.schedule(_premium(manager, "1", 1))
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert notified == ["1"]
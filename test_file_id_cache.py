@@ -0,0 +1,84 @@
+"""
+test_file_id_cache.py - تست cache شناسه فایل‌های تلگرام
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_file_id_cache.py
+"""
+
+from core import file_id_cache
+from core.file_id_cache import FileIdCache
+
+
+def _url(i):
+    return f"https://youtu.be/video{i:06d}"
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(file_id_cache.time, 'time', clock)
+    cache = FileIdCache(tmp_path, ttl=100)
+    cache.put(_url(1), "720", "file-1", "video")
+
+    clock.now += 99
+    assert cache.get(_url(1), "720")['file_id'] == "file-1"
+    clock.now += 1
+    assert cache.get(_url(1), "720") is None
+    assert cache.stats()['entries'] == 0
+
+    # ورودی منقضی پس از راه‌اندازی مجدد بارگذاری نمی‌شود
+    cache.put(_url(2), "720", "file-2", "video")
+    clock.now += 100
+    assert FileIdCache(tmp_path, ttl=100).stats()['entries'] == 0
+
+
+def test_lru_eviction(tmp_path):
+    cache = FileIdCache(tmp_path, max_entries=3)
+    for i in range(3):
+        cache.put(_url(i), "720", f"file-{i}", "video")
+    # دسترسی به قدیمی‌ترین ورودی آن را از حذف نجات می‌دهد
+    assert cache.get(_url(0), "720") is not None
+    cache.put(_url(3), "720", "file-3", "video")
+
+    assert cache.get(_url(1), "720") is None
+    assert [cache.get(_url(i), "720")['file_id'] for i in (0, 2, 3)] == ["file-0", "file-2", "file-3"]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_hit_rate(tmp_path):
+    cache = FileIdCache(tmp_path)
+    cache.put(_url(1), "720", "file-1", "video")
+    cache.get(_url(1), "720")
+    cache.get(_url(1), "720")
+    cache.get(_url(1), "480")
+    cache.get(_url(2), "720")
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 2)
+    assert stats['hit_rate'] == 0.5
+    assert cache.get(_url(1), "720")['hits'] == 3
+
+
+def test_put_appends_to_journal(tmp_path):
+    cache = FileIdCache(tmp_path, max_entries=2, compact_threshold=100)
+    for i in range(3):
+        cache.put(_url(i), "720", f"file-{i}", "video")
+    cache.invalidate(_url(2), "720")
+
+    # سه ورودی، یک حذف LRU و یک invalidate؛ فایل کامل نوشته نشده است
+    assert (tmp_path / "file_id_cache.journal").read_text(encoding='utf-8').count('\n') == 5
+    assert not (tmp_path / "file_id_cache.json").exists()
+
+    cache = FileIdCache(tmp_path, max_entries=2, compact_threshold=100)
+    assert cache.get(_url(0), "720") is None
+    assert cache.get(_url(1), "720")['file_id'] == "file-1"
+    assert cache.get(_url(2), "720") is None
+    # بارگذاری ژورنال را در فایل اصلی ادغام می‌کند
+    assert (tmp_path / "file_id_cache.journal").read_text(encoding='utf-8') == ""
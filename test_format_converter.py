@@ -0,0 +1,91 @@
+"""
+test_format_converter.py - تست انتخاب فرمت پیش از دانلود
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_format_converter.py
+"""
+
+import pytest
+
+from core.format_converter import FormatConverter
+
+
+MB = 1024 * 1024
+LIMIT = 50 * MB  # حجم هدف با حاشیه: 47.5MB
+
+
+def _video(format_id, height, size, ext='mp4', acodec='none'):
+    return {'format_id': format_id, 'height': height, 'filesize': size, 'ext': ext,
+            'vcodec': 'avc1', 'acodec': acodec}
+
+
+def _audio(format_id, abr, size, ext):
+    return {'format_id': format_id, 'abr': abr, 'filesize': size, 'ext': ext,
+            'vcodec': 'none', 'acodec': 'mp4a'}
+
+
+FORMATS = [
+    _video('137', 1080, 200 * MB),
+    _video('136', 720, 40 * MB),
+    _video('244', 480, 30 * MB, ext='webm'),
+    _video('18', 360, 20 * MB, acodec='mp4a'),
+    _audio('140', 128, 5 * MB, 'm4a'),
+    _audio('251', 160, 6 * MB, 'webm'),
+]
+
+
+@pytest.mark.parametrize("strategy, quality, duration, action, fmt, size, height", [
+    # فرمت همراه صدا بدون ترکیب
+    ('fit', '360', 600, 'direct', None, 20 * MB, 360),
+    # تصویر بدون صدا + بهترین صدا (251)
+    ('fit', '720', 600, 'direct', None, 46 * MB, 720),
+    ('fit', '1080', 600, 'fit', '136+251', 46 * MB, 720),
+    ('split', '1080', 600, 'split', '137+251', 206 * MB, 1080),
+    ('reencode', '1080', 600, 'reencode', '137+251', 206 * MB, 1080),
+    # بیت‌ریت لازم برای ویدئوی طولانی کمتر از حداقل است؛ به جای کدگذاری تقسیم می‌شود
+    ('reencode', '1080', 6000, 'split', '137+251', 206 * MB, 1080),
+    # mp4 فقط فرمت‌های mp4 و صدای m4a
+    ('fit', 'mp4', 600, 'fit', '136+140', 45 * MB, 720),
+    ('split', 'mp4', 600, 'split', '137+140', 205 * MB, 1080),
+])
+def test_plan_video(strategy, quality, duration, action, fmt, size, height):
+    plan = FormatConverter(LIMIT, strategy).plan({'duration': duration, 'formats': FORMATS}, quality)
+    assert (plan.action, plan.format, plan.estimated_size, plan.height) == (action, fmt, size, height)
+
+
+@pytest.mark.parametrize("strategy, duration, action, bitrate", [
+    ('fit', 1000, 'direct', 192),
+    # 192 و 160 جا نمی‌شوند
+    ('fit', 3000, 'fit', 128),
+    ('reencode', 3000, 'fit', 128),
+    # split کیفیت را پایین نمی‌آورد
+    ('split', 3000, 'split', 192),
+    ('fit', 10000, 'split', 192),
+])
+def test_plan_audio_steps_down(strategy, duration, action, bitrate):
+    plan = FormatConverter(LIMIT, strategy).plan({'duration': duration, 'formats': FORMATS}, 'mp3')
+    assert (plan.action, plan.audio_quality) == (action, bitrate)
+    assert plan.estimated_size == bitrate * 1000 / 8 * duration
+
+
+@pytest.mark.parametrize("info, quality", [
+    (None, '720'),
+    ({'duration': None, 'formats': FORMATS}, 'mp3'),
+    # فقط صدا
+    ({'duration': 600, 'formats': FORMATS[4:]}, '720'),
+    # mp4 درخواست شده ولی فقط webm موجود است
+    ({'duration': 600, 'formats': [_video('244', 480, 30 * MB, ext='webm')]}, 'mp4'),
+    # تصویر بدون صدا و بدون هیچ فرمت صدا
+    ({'duration': 600, 'formats': FORMATS[:2]}, '720'),
+    # حجم نامشخص
+    ({'duration': None, 'formats': [{'format_id': '22', 'height': 720, 'vcodec': 'avc1',
+                                     'acodec': 'mp4a', 'ext': 'mp4'}]}, '720'),
+])
+def test_plan_without_usable_formats(info, quality):
+    plan = FormatConverter(LIMIT).plan(info, quality)
+    assert (plan.action, plan.format, plan.estimated_size) == ('direct', None, None)
+
+
+def test_invalid_strategy():
+    with pytest.raises(ValueError):
+        FormatConverter(LIMIT, 'shrink')
@@ -0,0 +1,41 @@
+"""
+test_json_storage.py - تست ژورنال افزایشی
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_json_storage.py
+"""
+
+from core import json_storage
+from core.json_storage import JournalStore
+
+
+def _count_fsync(monkeypatch):
+    calls = []
+    monkeypatch.setattr(json_storage.os, 'fsync', lambda fd: calls.append(fd))
+    return calls
+
+
+def test_journal_fsyncs_each_batch(tmp_path, monkeypatch):
+    calls = _count_fsync(monkeypatch)
+    journal = JournalStore(tmp_path)
+    journal.append('users', "1", {'n': 1})
+    journal.append_many([('users', "2", {'n': 2}), ('users', "3", {'n': 3})])
+    journal.append('users', "1", op='del')
+    journal.close()
+
+    # یک fsync برای هر append و یکی برای کل دسته
+    assert len(calls) == 3
+    data = {'users': {}}
+    assert JournalStore(tmp_path).replay(data) == 4
+    assert data['users'] == {"2": {'n': 2}, "3": {'n': 3}}
+
+
+def test_journal_without_fsync(tmp_path, monkeypatch):
+    calls = _count_fsync(monkeypatch)
+    journal = JournalStore(tmp_path, fsync=False)
+    journal.append_many([('users', "1", {'n': 1})])
+    journal.append_many([])
+    journal.close()
+
+    assert calls == []
+    assert journal.entries == 1
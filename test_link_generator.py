@@ -0,0 +1,52 @@
+"""
+test_link_generator.py - تست لینک یکتا و تشخیص پلتفرم
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_link_generator.py
+"""
+
+import pytest
+
+from core.link_generator import Platform, canonical_key, canonicalize, match_platform
+
+
+def test_canonicalize_youtube_variants():
+    variants = [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=abc",
+        "https://youtu.be/dQw4w9WgXcQ?t=42",
+        "https://m.youtube.com/shorts/dQw4w9WgXcQ",
+        "https://www.youtube.com/embed/dQw4w9WgXcQ",
+    ]
+    keys = {canonical_key(url) for url in variants}
+    assert keys == {"youtube:dQw4w9WgXcQ"}
+    assert canonicalize(variants[0]).platform == Platform.YOUTUBE.value
+
+
+def test_canonicalize_drops_tracking_params():
+    url = "https://example.com/video?id=7&utm_source=telegram&fbclid=xyz"
+    assert canonical_key(url) == canonical_key("https://example.com/video?id=7")
+    assert canonical_key(url) != canonical_key("https://example.com/video?id=8")
+
+
+@pytest.mark.parametrize("url, platform", [
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", Platform.YOUTUBE),
+    ("https://youtu.be/dQw4w9WgXcQ", Platform.YOUTUBE),
+    ("HTTPS://M.YOUTUBE.COM/shorts/dQw4w9WgXcQ", Platform.YOUTUBE),
+    ("https://www.instagram.com/reel/Cx1abcDEF/", Platform.INSTAGRAM),
+    ("https://vm.tiktok.com/ZMabc123/", Platform.TIKTOK),
+    ("https://x.com/user/status/1234567890123456789", Platform.TWITTER),
+    ("https://vimeo.com/123456789", Platform.VIMEO),
+])
+def test_match_platform_supported(url, platform):
+    assert match_platform(url) is platform
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/some/article",
+    "https://evil.example/?q=youtube.com",
+    "https://notyoutube.com/watch?v=dQw4w9WgXcQ",
+    "ftp://youtube.com/watch?v=dQw4w9WgXcQ",
+    "سلام، چطور می‌توانم اشتراک بخرم؟",
+])
+def test_match_platform_rejects_other_links(url):
+    assert match_platform(url) is None
@@ -0,0 +1,129 @@
+"""
+test_media_cache.py - تست cache فایل‌های دانلود شده روی دیسک
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_media_cache.py
+"""
+
+import os
+import time
+
+from core.media_cache import MediaCache
+
+
+def _url(i):
+    return f"https://youtu.be/video{i:06d}"
+
+
+def _file(tmp_path, name, content):
+    path = tmp_path / "downloads" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+def _cache(tmp_path, **kwargs):
+    return MediaCache(tmp_path / "cache", **kwargs)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    cache = _cache(tmp_path)
+    first = cache.put(_url(1), "720", _file(tmp_path, "a.mp4", b"x" * 100))
+    second = cache.put(_url(2), "720", _file(tmp_path, "b.mp4", b"x" * 100))
+
+    assert first == second
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['objects'] == 1
+    assert cache.total_bytes == 100
+
+    # فایل تا حذف آخرین ارجاع باقی می‌ماند
+    cache.invalidate(_url(1), "720")
+    assert os.path.exists(first)
+    cache.invalidate(_url(2), "720")
+    assert not os.path.exists(first)
+    assert cache.total_bytes == 0
+
+
+def test_lru_eviction(tmp_path):
+    cache = _cache(tmp_path, max_bytes=250)
+    paths = [cache.put(_url(i), "720", _file(tmp_path, f"{i}.mp4", bytes([i]) * 100)) for i in range(2)]
+    cache._index[cache.make_key(_url(0), "720")]['last_access'] = time.time() + 10
+
+    cache.put(_url(2), "720", _file(tmp_path, "2.mp4", b"\x02" * 100))
+
+    assert cache.get(_url(1), "720") is None
+    assert not os.path.exists(paths[1])
+    assert cache.get(_url(0), "720") == paths[0]
+    assert cache.stats()['evictions'] == 1
+    assert cache.total_bytes == 200
+
+
+def test_lfu_eviction(tmp_path):
+    cache = _cache(tmp_path, max_bytes=250, policy="lfu")
+    for i in range(2):
+        cache.put(_url(i), "720", _file(tmp_path, f"{i}.mp4", bytes([i]) * 100))
+    # ورودی اول پرکاربردتر است؛ ورودی دوم با وجود دسترسی جدیدتر حذف می‌شود
+    cache.get(_url(0), "720")
+    cache.get(_url(0), "720")
+    cache.get(_url(1), "720")
+
+    cache.put(_url(2), "720", _file(tmp_path, "2.mp4", b"\x02" * 100))
+
+    assert cache.get(_url(1), "720") is None
+    assert cache.get(_url(0), "720") is not None
+
+
+def test_pinned_file_is_not_evicted(tmp_path):
+    cache = _cache(tmp_path, max_bytes=150)
+    pinned = cache.put(_url(0), "720", _file(tmp_path, "0.mp4", b"\x00" * 100), pin=True)
+    cache.put(_url(1), "720", _file(tmp_path, "1.mp4", b"\x01" * 100))
+
+    # ورودی pin شده رد می‌شود؛ حجم موقتاً از سقف بیشتر است
+    assert os.path.exists(pinned)
+    assert cache.stats()['evictions'] == 0
+
+    cache.unpin(pinned)
+    cache.put(_url(2), "720", _file(tmp_path, "2.mp4", b"\x02" * 100))
+    assert not os.path.exists(pinned)
+
+
+def test_invalidate_pinned_file_defers_delete(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put(_url(0), "720", _file(tmp_path, "0.mp4", b"\x00" * 100))
+    path = cache.get(_url(0), "720", pin=True)
+    same = cache.get(_url(0), "720", pin=True)
+
+    cache.invalidate(_url(0), "720")
+    assert os.path.exists(path)
+    cache.unpin(path)
+    assert os.path.exists(same)
+    cache.unpin(same)
+    assert not os.path.exists(path)
+
+
+def test_rebuild_reconciles_index_with_disk(tmp_path):
+    cache = _cache(tmp_path)
+    kept = cache.put(_url(0), "720", _file(tmp_path, "0.mp4", b"\x00" * 100))
+    missing = cache.put(_url(1), "720", _file(tmp_path, "1.mp4", b"\x01" * 100))
+    resized = cache.put(_url(2), "720", _file(tmp_path, "2.mp4", b"\x02" * 100))
+    cache.flush()
+
+    os.remove(missing)
+    with open(resized, 'ab') as f:
+        f.write(b"!")
+    orphan = cache.objects_dir / "ab" / ("ab" * 32 + ".mp4")
+    orphan.parent.mkdir(exist_ok=True)
+    orphan.write_bytes(b"orphan")
+    partial = cache.objects_dir / "ab" / ("cd" * 32 + ".mp4.tmp")
+    partial.write_bytes(b"partial")
+
+    cache = _cache(tmp_path)
+    assert cache.get(_url(0), "720") == kept
+    assert cache.get(_url(1), "720") is None
+    assert cache.get(_url(2), "720") is None
+    assert not os.path.exists(resized)
+    assert not orphan.exists()
+    assert not partial.exists()
+    assert cache.total_bytes == 100
+    # index اصلاح‌شده ذخیره شده است
+    assert cache.stats()['entries'] == _cache(tmp_path).stats()['entries'] == 1
@@ -0,0 +1,70 @@
+"""
+test_payments.py - تست ذخیره پرداخت‌ها و اشتراک‌ها در DataManager
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_payments.py
+"""
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from core.admin import DownloadRepository, PaymentRepository
+from core.app import DataManager, User
+from core.sqlite_storage import SQLiteStorage
+
+
+def _txids(manager):
+    return [p['txid'] for user_payments in manager._iter_payments() for p in user_payments]
+
+
+def test_payment_round_trip(manager_factory):
+    manager = manager_factory()
+    manager.create_user(User("42", "ali", "Ali"))
+    manager.add_payment("42", "ماهانه", 5.0, "a" * 64, plan_id="monthly")
+    manager.add_payment("42", "ماهانه", 5.0, "b" * 64, plan_id="monthly")
+
+    # اشتراک بلافاصله (حتی با storage) از حافظه خوانده می‌شود
+    assert manager.premium_users["42"]['plan_id'] == "monthly"
+    assert manager.get_premium_record("42")['plan_id'] == "monthly"
+
+    manager = manager_factory(manager)
+
+    assert manager.get_premium_record("42")['plan'] == "ماهانه"
+    assert _txids(manager) == ["a" * 64, "b" * 64]
+    stats = manager.get_system_stats()
+    assert stats['total_payments'] == stats['today_payments'] == 2
+    assert stats['total_revenue'] == 10.0
+
+
+def test_write_behind_payment_is_independent_copy(manager_factory):
+    manager = manager_factory()
+    manager.enable_write_behind()
+    manager.add_payment("42", "ماهانه", 5.0, "a" * 64)
+
+    changes = manager.collect_changes()
+    # تغییرات بعدی روی حلقه رویداد نباید داده‌های در حال نوشتن را تغییر دهند
+    manager.add_payment("42", "ماهانه", 5.0, "b" * 64)
+    records = {(collection, key): value for collection, key, value in changes[0]}
+    assert [p['txid'] for p in records[('payments', '42')]] == ["a" * 64]
+
+    manager.write_changes(changes)
+    manager = manager_factory(manager)
+    assert _txids(manager) == ["a" * 64, "b" * 64]
+
+def test_domain_repositories_share_sqlite_file(tmp_path):
+    """مجموعه‌های DataManager و ریپوزیتوری‌های دامنه در یک فایل SQLite تداخل ندارند"""
+    storage = SQLiteStorage(tmp_path / "bot.db")
+    try:
+        manager = DataManager(tmp_path, storage=storage)
+        manager.add_payment("42", "ماهانه", 5.0, "a" * 64)
+        downloads = DownloadRepository(tmp_path / "jobs", storage=storage)
+        download = downloads.create_download("42", "https://youtu.be/dQw4w9WgXcQ", "youtube")
+        payments = PaymentRepository(tmp_path / "payments", storage=storage)
+
+        assert storage.get('payments', "42")[0]['txid'] == "a" * 64
+        assert storage.get('downloads', download.id) is None
+        assert downloads.get_download(download.id).url == "https://youtu.be/dQw4w9WgXcQ"
+        assert payments.get_all_payments() == []
+    finally:
+        storage.close()
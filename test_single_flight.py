@@ -0,0 +1,126 @@
+"""
+test_single_flight.py - تست یکی‌سازی درخواست‌های هم‌زمان
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_single_flight.py
+"""
+
+import asyncio
+
+import pytest
+
+from core.single_flight import SingleFlight
+
+
+class _Work:
+    """کار قابل کنترل: تا set شدن release منتظر می‌ماند"""
+
+    def __init__(self, result="file", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def _start(flight, work, count):
+    tasks = [asyncio.create_task(flight.do("key", work)) for _ in range(count)]
+    # یک نوبت برای اتصال منتظرها و یک نوبت برای شروع خود کار
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert work.calls == 1
+    return tasks
+
+
+def test_followers_share_one_result():
+    async def run():
+        flight = SingleFlight()
+        work = _Work()
+        tasks = await _start(flight, work, 3)
+        assert flight.waiters("key") == 3
+
+        work.release.set()
+        results = await asyncio.gather(*tasks)
+        assert results == [("file", False), ("file", True), ("file", True)]
+        assert work.calls == 1
+        assert flight.stats() == {'in_flight': 0, 'started': 1, 'shared': 2}
+
+    asyncio.run(run())
+
+
+def test_error_reaches_all_waiters():
+    async def run():
+        flight = SingleFlight()
+        work = _Work(error=ValueError("boom"))
+        tasks = await _start(flight, work, 2)
+        work.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        assert not flight.in_flight("key")
+
+    asyncio.run(run())
+
+
+def test_cancelling_one_waiter_keeps_flight_running():
+    async def run():
+        flight = SingleFlight()
+        work = _Work()
+        first, second = await _start(flight, work, 2)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert flight.waiters("key") == 1
+        assert not work.cancelled
+
+        work.release.set()
+        assert await second == ("file", True)
+
+    asyncio.run(run())
+
+
+def test_cancelling_last_waiter_cancels_flight():
+    async def run():
+        flight = SingleFlight()
+        work = _Work()
+        first, second = await _start(flight, work, 2)
+
+        for task in (first, second):
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        await asyncio.sleep(0)
+        assert work.cancelled
+        assert not flight.in_flight("key")
+
+        # کلید پس از لغو دوباره قابل اجراست
+        again = _Work("again")
+        again.release.set()
+        assert await flight.do("key", again) == ("again", False)
+
+    asyncio.run(run())
+
+
+def test_cancel_all_waits_for_cleanup():
+    async def run():
+        flight = SingleFlight()
+        work = _Work()
+        [task] = await _start(flight, work, 1)
+        await flight.cancel_all()
+        assert work.cancelled
+        assert not flight.in_flight("key")
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+"""
+test_stats.py - تست شمارنده‌های آمار سیستم
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_stats.py
+"""
+
+import time
+from datetime import date, timedelta
+
+from core.stats import StatsCounters
+
+
+DAY = 86400
+
+
+def test_totals_and_daily_buckets():
+    stats = StatsCounters()
+    now = time.time()
+    stats.add('users', ts=now)
+    stats.add('users', ts=now - DAY)
+    stats.add('revenue', 5.0, ts=now)
+    stats.add('downloads', 7, daily=False)
+    stats.add('premium_users')
+
+    snapshot = stats.snapshot()
+    assert snapshot['total_users'] == 2
+    assert snapshot['today_users'] == 1
+    assert snapshot['total_revenue'] == snapshot['today_revenue'] == 5.0
+    assert snapshot['total_downloads'] == 7
+    assert snapshot['today_downloads'] == 0
+    assert snapshot['premium_users'] == 1
+
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    assert stats.day(yesterday)['users'] == 1
+    assert [day for day, _ in stats.last_days(2)] == [yesterday, date.today().isoformat()]
+
+
+def test_old_buckets_are_pruned():
+    stats = StatsCounters(retention_days=3)
+    stats.add('users', ts=time.time() - 10 * DAY)
+    assert stats.totals['users'] == 1
+    assert stats.daily == {}
+
+    stats.add('users', ts=time.time() - 2 * DAY)
+    stats.add('users')
+    assert len(stats.daily) == 2
+
+
+def test_restore_day_keeps_totals():
+    stats = StatsCounters(retention_days=3)
+    today = date.today().isoformat()
+    stats.restore_day('downloads', today, 4)
+    stats.restore_day('downloads', (date.today() - timedelta(days=10)).isoformat(), 9)
+    stats.add('downloads')
+
+    assert stats.day()['downloads'] == 5
+    assert stats.totals['downloads'] == 1
+    assert list(stats.daily) == [today]
+
+
+def test_reset():
+    stats = StatsCounters()
+    stats.add('payments')
+    stats.reset()
+    assert stats.snapshot()['total_payments'] == 0
+    assert stats.daily == {}
@@ -0,0 +1,89 @@
+"""
+test_users.py - تست ذخیره و بارگذاری کاربران در DataManager
+
+اجرا (از پوشه والد core):
+    python -m pytest core/test_users.py
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from core.app import DataManager, User
+
+
+def test_user_round_trip(manager_factory):
+    manager = manager_factory()
+    user = User(6102531955, "ali", "Ali")
+    manager.create_user(user)
+    manager.increment_downloads("6102531955")
+    manager.increment_downloads("6102531955")
+
+    manager = manager_factory(manager)
+
+    loaded = manager.get_user("6102531955")
+    assert loaded is not None
+    assert loaded.id == "6102531955"
+    assert (loaded.username, loaded.first_name) == ("ali", "Ali")
+    assert loaded.download_count == 2
+    assert loaded.join_ts == user.join_ts
+    assert manager.count_users() == 1
+
+
+def test_write_behind_changes_are_flushed(manager_factory):
+    manager = manager_factory()
+    manager.enable_write_behind()
+    manager.create_user(User("8", "reza", "Reza"))
+    manager.increment_downloads("8")
+    # رکورد کاربر و شمارنده دانلود امروز
+    assert manager.pending_count == 2
+
+    manager = manager_factory(manager)
+    assert manager.get_user("8").download_count == 1
+
+
+def test_premium_user_round_trip(manager_factory):
+    manager = manager_factory()
+    user = User("7", "sara", "Sara")
+    user.activate_premium(30)
+    manager.create_user(user)
+
+    manager = manager_factory(manager)
+
+    loaded = manager.get_user("7")
+    assert loaded.is_premium()
+    assert loaded.premium_expiry_ts == user.premium_expiry_ts
+    assert [u.id for u in manager.iter_premium_users()] == ["7"]
+
+def test_download_stats_survive_restart(manager_factory):
+    manager = manager_factory()
+    manager.create_user(User("9", "mina", "Mina"))
+    manager.increment_downloads("9")
+    manager.increment_downloads("9")
+
+    manager = manager_factory(manager)
+
+    stats = manager.get_system_stats()
+    assert stats['total_downloads'] == 2
+    assert stats['today_downloads'] == 2
+    assert stats['premium_users'] == 0
+
+def test_legacy_users_json(tmp_path):
+    """users.json قدیمی شناسه عددی و وضعیت نامعتبر دارد"""
+    (tmp_path / "users.json").write_text(json.dumps({
+        "6102531955": {
+            "id": 6102531955, "username": "ali", "first_name": "Ali", "last_name": None,
+            "join_date": "2024-01-01T10:00:00", "status": None,
+            "download_count": 5, "premium_expiry": None,
+        },
+    }), encoding='utf-8')
+
+    manager = DataManager(tmp_path)
+    user = manager.get_user("6102531955")
+    assert user is not None
+    assert user.id == "6102531955"
+    assert user.status == "free"
+    assert user.download_count == 5
+    assert manager.get_user(6102531955) is user